@@ -1,9 +1,8 @@
 import streamlit as st
-from PIL import Image
-import requests
-import os
 import uuid
 
+from frontend_client import load_css, load_image, render_messages, stream_reply
+
 st.session_state.setdefault("session_id", str(uuid.uuid4()))
 
 st.set_page_config(page_title="WanderBot", page_icon=":luggage:")
@@ -22,12 +21,8 @@ if st.sidebar.button("Weather-Based Trip Guide"):
 
 page = st.session_state.current_page
 
-# Read and apply custom CSS
-with open("styles.css") as f:
-    st.markdown(f"<style>{f.read()}</style>", unsafe_allow_html=True)
-
-# API URL
-API_URL = os.getenv("FASTAPI_URL", "http://localhost:8000/chat")
+# Apply custom CSS (read once per server process)
+st.markdown(f"<style>{load_css()}</style>", unsafe_allow_html=True)
 
 # Initialize chat history
 st.session_state.setdefault("messages", [])
@@ -37,7 +32,7 @@ st.session_state.setdefault("show_intro", True)
 with st.container():
     col1, col2, col3 = st.columns([1, 6, 3])
     with col1:
-        logo = Image.open("images/Wander_bot_logo.png")
+        logo = load_image("images/Wander_bot_logo.png")
         st.image(logo, width=30, use_container_width= True) 
     with col2:
         st.markdown(
@@ -52,6 +47,7 @@ with st.container():
         if st.session_state.messages:
             if st.button("Clear Conversation", help="Delete all messages", key="clear-btn"):
                 st.session_state.messages.clear()
+                st.session_state.pop("render_window", None)
                 st.session_state.session_id = str(uuid.uuid4())
                 st.rerun()
             else:
@@ -61,9 +57,7 @@ with st.container():
 # Chat input
 if page == "Chat with WanderBot":     
     # Show existing chat messages
-    for message in st.session_state.messages:
-        with st.chat_message(message["role"]):
-            st.markdown(message["content"])
+    render_messages(st.session_state.messages)
 
     prompt = st.chat_input("Ask me travel-related questions…")
 
@@ -71,19 +65,8 @@ if page == "Chat with WanderBot":
         st.chat_message("user").markdown(prompt)
         st.session_state.messages.append({"role": "user", "content": prompt})
 
-        with st.spinner("WanderBot is thinking... 💭"):
-            try:
-                response = requests.post(API_URL, json={
-                "session_id": st.session_state.session_id,
-                "message": prompt
-                })
-
-                response.raise_for_status()
-                bot_reply = response.json().get("reply", "No reply.")
-            except Exception:
-                bot_reply = "WanderBot ran into an issue. Please try again later."
-
-        st.chat_message("assistant").markdown(bot_reply)
+        with st.chat_message("assistant"):
+            bot_reply = st.write_stream(stream_reply(st.session_state.session_id, prompt)) or "No reply."
         st.session_state.messages.append({"role": "assistant", "content": bot_reply})
         st.rerun()
 
@@ -128,16 +111,6 @@ elif page == "Weather Based Trip Guide":
         )
 
 
-        with st.spinner("WanderBot is planning your trip..."):
-            try:
-                response = requests.post(API_URL, json={
-                    "session_id": st.session_state.session_id,
-                    "message": message
-                })
-                response.raise_for_status()
-                bot_reply = response.json().get("reply", "No reply.")
-            except Exception:
-                bot_reply = "WanderBot ran into an issue. Please try again later."
-
         st.markdown("### ✈️ Here's your travel insight:")
-        st.success(bot_reply)
+        with st.container(border=True):
+            st.write_stream(stream_reply(st.session_state.session_id, message))
@@ -0,0 +1,188 @@
+# admission.py
+# Admission control in front of the chat endpoints. A request is checked
+# against per-IP and per-session token buckets (shared through Redis) on
+# arrival. Its turn then needs one of MODEL_CONCURRENCY slots in this worker,
+# taken once it holds the session lock, so duplicates and turns queued behind
+# another in their session hold no slot while they wait. When every slot is
+# taken the turn waits in a bounded queue, up to
+# ADMISSION_QUEUE_TIMEOUT_SECONDS. Anything that cannot get in is turned away
+# at once with 429 (client over its rate) or 503 (worker at capacity) and a
+# Retry-After, instead of piling onto Gemini and timing out. Admitted
+# requests then see the latency of a worker that is never over capacity.
+import asyncio
+import math
+import os
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Optional
+
+from backend import metrics
+from backend.rate_limit import TokenBucket
+
+
+ADMISSION_ENABLED = os.getenv("ADMISSION_ENABLED", "true").lower() in ("1", "true", "yes")
+MODEL_CONCURRENCY = int(os.getenv("MODEL_CONCURRENCY", "16"))
+ADMISSION_QUEUE_SIZE = int(os.getenv("ADMISSION_QUEUE_SIZE", "32"))
+ADMISSION_QUEUE_TIMEOUT_SECONDS = float(os.getenv("ADMISSION_QUEUE_TIMEOUT_SECONDS", "5"))
+
+SESSION_RATE_PER_MINUTE = float(os.getenv("SESSION_RATE_PER_MINUTE", "12"))
+SESSION_BURST = float(os.getenv("SESSION_BURST", "4"))
+IP_RATE_PER_MINUTE = float(os.getenv("IP_RATE_PER_MINUTE", "60"))
+IP_BURST = float(os.getenv("IP_BURST", "20"))
+# Behind a load balancer the client address is the first X-Forwarded-For hop
+TRUST_FORWARDED_FOR = os.getenv("TRUST_FORWARDED_FOR", "false").lower() in ("1", "true", "yes")
+# Peers whose X-Forwarded-For is believed even without that: the Streamlit
+# frontend, which forwards its users' addresses. Other clients can't pick their own bucket.
+TRUSTED_PROXIES = {host.strip() for host in os.getenv("TRUSTED_PROXIES", "127.0.0.1,::1").split(",") if host.strip()}
+
+session_limiter = TokenBucket("session", rate=SESSION_RATE_PER_MINUTE / 60, capacity=SESSION_BURST)
+ip_limiter = TokenBucket("ip", rate=IP_RATE_PER_MINUTE / 60, capacity=IP_BURST)
+
+admission_stats = {
+    "admitted": 0, "queued": 0, "shed_queue_full": 0, "shed_queue_timeout": 0,
+    "rate_limited_session": 0, "rate_limited_ip": 0,
+}
+
+
+class Rejected(Exception):
+    def __init__(self, status_code: int, retry_after: float, reason: str):
+        super().__init__(reason)
+        self.status_code = status_code
+        self.retry_after = max(1, math.ceil(retry_after))
+        self.reason = reason
+
+
+class ConcurrencyGate:
+    # At most `limit` holders; up to `queue_size` more wait in FIFO order.
+    # release() hands the slot straight to the oldest waiter.
+    def __init__(self, limit: int, queue_size: int, queue_timeout: float):
+        self.limit = limit
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.active = 0
+        self.waiters: deque = deque()
+        self.hold_seconds = 1.0  # moving average, for Retry-After
+
+    def expected_wait(self) -> float:
+        return self.hold_seconds * (len(self.waiters) + 1) / self.limit
+
+    async def acquire(self):
+        if self.active < self.limit and not self.waiters:
+            self.active += 1
+            return
+        if len(self.waiters) >= self.queue_size:
+            admission_stats["shed_queue_full"] += 1
+            raise Rejected(503, self.expected_wait(), "queue_full")
+
+        admission_stats["queued"] += 1
+        waiter = asyncio.get_running_loop().create_future()
+        self.waiters.append(waiter)
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(waiter, self.queue_timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if waiter.done() and not waiter.cancelled():
+                self.release()  # the slot arrived just as this request gave up
+            elif waiter in self.waiters:
+                self.waiters.remove(waiter)
+            if isinstance(e, asyncio.TimeoutError):
+                admission_stats["shed_queue_timeout"] += 1
+                raise Rejected(503, self.expected_wait(), "queue_timeout")
+            raise
+        finally:
+            metrics.observe("admission_wait_seconds", time.perf_counter() - started)
+
+    def release(self, held: Optional[float] = None):
+        if held is not None:
+            self.hold_seconds = 0.9 * self.hold_seconds + 0.1 * held
+        while self.waiters:
+            waiter = self.waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.active -= 1
+
+
+model_gate = ConcurrencyGate(MODEL_CONCURRENCY, ADMISSION_QUEUE_SIZE, ADMISSION_QUEUE_TIMEOUT_SECONDS)
+
+
+def client_address(request) -> Optional[str]:
+    # None when a trusted frontend did not say who its user is: its own address
+    # is shared by all of its users, so only the session limit applies
+    peer = request.client.host if request.client else "unknown"
+    trusted = peer in TRUSTED_PROXIES
+    if TRUST_FORWARDED_FOR or trusted:
+        forwarded = request.headers.get("x-forwarded-for")
+        if forwarded:
+            return forwarded.split(",")[0].strip()
+    return None if trusted else peer
+
+
+async def check_rate(session_id: str, address: Optional[str]):
+    if address is not None:
+        retry_after = await ip_limiter.try_acquire(address)
+        if retry_after:
+            admission_stats["rate_limited_ip"] += 1
+            raise Rejected(429, retry_after, "ip_rate")
+    retry_after = await session_limiter.try_acquire(session_id)
+    if retry_after:
+        admission_stats["rate_limited_session"] += 1
+        raise Rejected(429, retry_after, "session_rate")
+
+
+class Admission:
+    # One admitted turn's slot. release() may be called more than once:
+    # streaming responses release from the generator and again after sending.
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.released = False
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            model_gate.release(time.perf_counter() - self.started)
+
+
+async def check_client(session_id: str, address: Optional[str]):
+    # Raises Rejected (429) when the client is over its rate
+    if not ADMISSION_ENABLED:
+        return
+    try:
+        await check_rate(session_id, address)
+    except Rejected as e:
+        metrics.inc("requests_shed_total", reason=e.reason)
+        raise
+
+
+async def acquire_slot() -> Optional[Admission]:
+    # Raises Rejected (503); returns None when admission control is off
+    if not ADMISSION_ENABLED:
+        return None
+    try:
+        await model_gate.acquire()
+    except Rejected as e:
+        metrics.inc("requests_shed_total", reason=e.reason)
+        raise
+    admission_stats["admitted"] += 1
+    return Admission()
+
+
+@asynccontextmanager
+async def model_slot():
+    slot = await acquire_slot()
+    try:
+        yield
+    finally:
+        if slot is not None:
+            slot.release()
+
+
+def stats() -> dict:
+    result = dict(admission_stats)
+    result["active"] = model_gate.active
+    result["concurrency_limit"] = model_gate.limit
+    result["queue_depth"] = len(model_gate.waiters)
+    result["queue_limit"] = model_gate.queue_size
+    result["avg_hold_seconds"] = round(model_gate.hold_seconds, 3)
+    return result
@@ -0,0 +1,175 @@
+# context.py
+# Decides which part of a session's history is sent to the model.
+# The most recent turns go verbatim, older ones are folded into a rolling
+# summary stored next to the history, and everything is kept under a token budget.
+import json
+import os
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, List
+
+from redis.exceptions import WatchError
+
+from backend.history import (
+    HISTORY_TTL, bump_history_version, entry_text, get_history, history_length, is_function_response,
+)
+
+
+SUMMARY_PREFIX = "chat_summary:"
+
+# Turns always kept verbatim once a summary exists
+CONTEXT_RECENT_TURNS = int(os.getenv("CONTEXT_RECENT_TURNS", "6"))
+# Extra turns allowed to pile up before they are folded, so the summary is not redone every turn
+CONTEXT_SUMMARY_BATCH_TURNS = int(os.getenv("CONTEXT_SUMMARY_BATCH_TURNS", "4"))
+# Estimated tokens allowed for summary plus verbatim history
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "8000"))
+
+SUMMARY_LEAD_IN = "Summary of our earlier conversation:\n"
+SUMMARY_ACK = "Understood, I'll keep that in mind."
+
+Summarizer = Callable[[str, List[dict]], Awaitable[str]]
+
+context_metrics = {
+    "requests": 0,
+    "history_tokens": 0,
+    "prompt_tokens": 0,
+    "tokens_saved": 0,
+    "summaries": 0,
+    "summary_conflicts": 0,
+    "turns_dropped": 0,
+}
+
+
+@dataclass
+class ContextWindow:
+    entries: List[dict] = field(default_factory=list)
+    history_tokens: int = 0  # what sending the full history would have cost
+    prompt_tokens: int = 0  # what is actually sent
+
+    @property
+    def tokens_saved(self) -> int:
+        return self.history_tokens - self.prompt_tokens
+
+
+def estimate_tokens(text: str) -> int:
+    # Roughly 4 characters per token; good enough for budgeting without a round trip
+    return len(text) // 4 + 1
+
+
+def entry_tokens(entries: List[dict]) -> int:
+    return sum(estimate_tokens(entry_text(entry)) for entry in entries)
+
+
+def split_turns(entries: List[dict]) -> List[List[dict]]:
+    # A turn starts at each user message; tool results are sent as user entries but belong to the turn
+    turns = []
+    for entry in entries:
+        starts_turn = entry.get("role") == "user" and not is_function_response(entry)
+        if starts_turn or not turns:
+            turns.append([])
+        turns[-1].append(entry)
+    return turns
+
+
+def summary_key(session_id: str) -> str:
+    return SUMMARY_PREFIX + session_id
+
+
+async def get_summary(redis_client, session_id: str) -> dict:
+    raw = await redis_client.get(summary_key(session_id))
+    if raw:
+        return json.loads(raw)
+    return {"summary": "", "covered": 0, "covered_tokens": 0}
+
+
+async def build_context(redis_client, session_id: str, token_budget: int = CONTEXT_TOKEN_BUDGET) -> ContextWindow:
+    record = await get_summary(redis_client, session_id)
+    # Only the part of the history the summary does not cover is read
+    tail = await get_history(redis_client, session_id, start=record["covered"])
+
+    turns = split_turns(tail)
+    window = ContextWindow(history_tokens=record["covered_tokens"] + entry_tokens(tail))
+
+    prefix = []
+    if record["summary"]:
+        prefix = [
+            {"role": "user", "content": SUMMARY_LEAD_IN + record["summary"]},
+            {"role": "assistant", "content": SUMMARY_ACK},
+        ]
+    used = entry_tokens(prefix)
+
+    # Newest turns first, stop at the first one that no longer fits
+    kept = []
+    for turn in reversed(turns):
+        cost = entry_tokens(turn)
+        if used + cost > token_budget:
+            break
+        kept.insert(0, turn)
+        used += cost
+
+    dropped = len(turns) - len(kept)
+    if dropped:
+        # Not in the summary yet either; refresh_summary folds them once a batch has built up
+        context_metrics["turns_dropped"] += dropped
+        print(f"Context for session {session_id}: {dropped} older turns over the token budget were left out")
+
+    window.entries = prefix + [entry for turn in kept for entry in turn]
+    window.prompt_tokens = used
+
+    context_metrics["requests"] += 1
+    context_metrics["history_tokens"] += window.history_tokens
+    context_metrics["prompt_tokens"] += window.prompt_tokens
+    context_metrics["tokens_saved"] += window.tokens_saved
+    return window
+
+
+async def save_summary(redis_client, session_id: str, expected_covered: int, record: dict) -> bool:
+    # Compare-and-set on "covered", so concurrent refreshes cannot move it backwards
+    key = summary_key(session_id)
+    async with redis_client.pipeline(transaction=True) as pipe:
+        try:
+            await pipe.watch(key)
+            raw = await pipe.get(key)
+            covered = json.loads(raw)["covered"] if raw else 0
+            if covered != expected_covered:
+                return False
+            pipe.multi()
+            pipe.setex(key, HISTORY_TTL, json.dumps(record))
+            await pipe.execute()
+            return True
+        except WatchError:
+            return False
+
+
+async def refresh_summary(redis_client, session_id: str, summarize: Summarizer) -> bool:
+    # Runs after a turn is stored. Folds turns older than the recent window into the
+    # summary, but only once a full batch of them has accumulated.
+    fold_at = CONTEXT_RECENT_TURNS + CONTEXT_SUMMARY_BATCH_TURNS
+    record = await get_summary(redis_client, session_id)
+    # Every stored turn is at least a message and a reply, so a short tail is
+    # ruled out by its length alone, before reading and decoding it
+    uncovered = await history_length(redis_client, session_id) - record["covered"]
+    turns = []
+    if uncovered >= 2 * fold_at:
+        turns = split_turns(await get_history(redis_client, session_id, start=record["covered"]))
+
+    if len(turns) < fold_at:
+        # Keep the summary alive as long as the history it belongs to
+        await redis_client.expire(summary_key(session_id), HISTORY_TTL)
+        return False
+
+    to_fold = [entry for turn in turns[:-CONTEXT_RECENT_TURNS] for entry in turn]
+    summary = await summarize(record["summary"], to_fold)
+
+    updated = {
+        "summary": summary,
+        "covered": record["covered"] + len(to_fold),
+        "covered_tokens": record["covered_tokens"] + entry_tokens(to_fold),
+    }
+    if not await save_summary(redis_client, session_id, record["covered"], updated):
+        # Another refresh of this session saved first; its summary stands
+        context_metrics["summary_conflicts"] += 1
+        return False
+    # The context sent to the model changed, so sessions cached by workers are stale
+    await bump_history_version(redis_client, session_id)
+    context_metrics["summaries"] += 1
+    return True
@@ -0,0 +1,204 @@
+# gazetteer.py
+# Offline city lookup over a GeoNames cities dump compiled into a sorted,
+# memory-mapped index. get_coordinates_from_city tries this before Nominatim.
+# Only exact, unambiguous name matches are answered here; partial or
+# misspelt names, and names several sizeable places share, go to Nominatim.
+#
+# Build the index once (e.g. from https://download.geonames.org/export/dump/):
+#   python -m backend.gazetteer cities15000.txt countryInfo.txt
+import bisect
+import json
+import os
+import re
+import threading
+import unicodedata
+from typing import List, Optional
+
+import numpy as np
+
+
+GAZETTEER_DIR = os.getenv("GAZETTEER_DIR", os.path.join(os.path.dirname(__file__), "data", "gazetteer"))
+# The largest exact match wins only when it is this many times bigger than the next
+GAZETTEER_DOMINANCE = float(os.getenv("GAZETTEER_DOMINANCE", "10"))
+
+RECORD_DTYPE = np.dtype([
+    ("latitude", "<f4"),
+    ("longitude", "<f4"),
+    ("population", "<u4"),
+    ("country", "S2"),
+    ("name_id", "<u4"),
+])
+
+# Common ways users name a country that GeoNames does not list
+COUNTRY_CODE_ALIASES = {
+    "uk": "GB", "great britain": "GB", "britain": "GB", "england": "GB", "scotland": "GB",
+    "wales": "GB", "northern ireland": "GB", "us": "US", "usa": "US", "america": "US",
+    "united states of america": "US", "uae": "AE", "holland": "NL", "the netherlands": "NL",
+    "south korea": "KR", "north korea": "KP", "russia": "RU", "czechia": "CZ", "turkiye": "TR",
+    "ivory coast": "CI", "vietnam": "VN", "laos": "LA", "iran": "IR", "syria": "SY",
+}
+
+
+def normalize_name(name: str) -> str:
+    # "São Paulo" -> "sao paulo", "Saint-Étienne" -> "saint etienne"
+    name = unicodedata.normalize("NFKD", name)
+    name = "".join(ch for ch in name if not unicodedata.combining(ch))
+    name = re.sub(r"[-_/]", " ", name.casefold())
+    name = re.sub(r"[^\w\s]", "", name)
+    return re.sub(r"\s+", " ", name).strip()
+
+
+class _Strings:
+    # Read-only sequence over a blob of utf-8 strings plus an offsets array
+    def __init__(self, blob, offsets):
+        # memoryviews index far faster than np.memmap and still read straight from the mapping
+        self.blob = memoryview(blob)
+        self.offsets = memoryview(offsets)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        return str(self.blob[self.offsets[i]:self.offsets[i + 1]], "utf-8")
+
+
+class Gazetteer:
+    def __init__(self, directory: str):
+        load = lambda name: np.load(os.path.join(directory, name), mmap_mode="r")
+        self.keys = _Strings(load("keys.npy"), load("key_offsets.npy"))
+        self.key_records = load("key_records.npy")  # key index -> record index
+        self.records = load("records.npy")
+        self.names = _Strings(load("names.npy"), load("name_offsets.npy"))
+        with open(os.path.join(directory, "countries.json"), encoding="utf-8") as f:
+            countries = json.load(f)
+        self.country_names = countries["names"]  # code -> display name
+        self.country_codes = {normalize_name(name): code for code, name in self.country_names.items()}
+        self.country_codes.update({normalize_name(alias): code for alias, code in COUNTRY_CODE_ALIASES.items()})
+        self.country_codes.update({code.lower(): code for code in self.country_names})
+
+    def country_code(self, country: str) -> Optional[str]:
+        return self.country_codes.get(normalize_name(country))
+
+    def _unambiguous(self, key_indexes, country_code: Optional[str]) -> Optional[int]:
+        # The matching record, or None when there is none or no clear winner
+        candidates = {}
+        for i in key_indexes:
+            record_index = int(self.key_records[i])
+            record = self.records[record_index]
+            if country_code and record["country"].decode() != country_code:
+                continue
+            candidates[record_index] = int(record["population"])
+        if not candidates:
+            return None
+        ranked = sorted(candidates.items(), key=lambda item: item[1], reverse=True)
+        if len(ranked) > 1 and ranked[0][1] < GAZETTEER_DOMINANCE * max(ranked[1][1], 1):
+            return None
+        return ranked[0][0]
+
+    def find(self, city: str, country: Optional[str] = None) -> Optional[int]:
+        key = normalize_name(city)
+        if not key:
+            return None
+        country_code = self.country_code(country) if country else None
+        if country and not country_code:
+            return None  # cannot disambiguate, let Nominatim decide
+
+        lo = bisect.bisect_left(self.keys, key)
+        hi = bisect.bisect_right(self.keys, key, lo)
+        return self._unambiguous(range(lo, hi), country_code)
+
+    def lookup(self, city: str, country: Optional[str] = None) -> Optional[dict]:
+        index = self.find(city, country)
+        if index is None:
+            return None
+        record = self.records[index]
+        name = self.names[int(record["name_id"])]
+        country_name = self.country_names.get(record["country"].decode(), record["country"].decode())
+        return {
+            "latitude": round(float(record["latitude"]), 4),
+            "longitude": round(float(record["longitude"]), 4),
+            "name": name,
+            "full_address": f"{name}, {country_name}",
+        }
+
+
+_gazetteer = None
+_gazetteer_lock = threading.Lock()
+_gazetteer_missing = False
+
+
+def get_gazetteer() -> Optional[Gazetteer]:
+    # Loaded on first use so startup does not pay for it; None when no index is built
+    global _gazetteer, _gazetteer_missing
+    if _gazetteer is None and not _gazetteer_missing:
+        with _gazetteer_lock:
+            if _gazetteer is None and not _gazetteer_missing:
+                if os.path.exists(os.path.join(GAZETTEER_DIR, "records.npy")):
+                    _gazetteer = Gazetteer(GAZETTEER_DIR)
+                else:
+                    print(f"No gazetteer index in {GAZETTEER_DIR}, geocoding will use Nominatim only")
+                    _gazetteer_missing = True
+    return _gazetteer
+
+
+def lookup_city(query: str) -> Optional[dict]:
+    # query is "City, Country" as built by get_weather_forecast
+    gazetteer = get_gazetteer()
+    if gazetteer is None:
+        return None
+    city, _, country = query.rpartition(",")
+    if not city:
+        city, country = country, ""
+    return gazetteer.lookup(city, country.strip() or None)
+
+
+def _write_strings(directory: str, prefix: str, strings: List[str]):
+    encoded = [s.encode("utf-8") for s in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype="<u4")
+    np.cumsum([len(b) for b in encoded], out=offsets[1:])
+    np.save(os.path.join(directory, f"{prefix}s.npy"), np.frombuffer(b"".join(encoded), dtype=np.uint8))
+    np.save(os.path.join(directory, f"{prefix}_offsets.npy"), offsets)
+
+
+def build_index(cities_path: str, country_info_path: str, directory: str = GAZETTEER_DIR) -> int:
+    # cities_path: GeoNames citiesNNNN.txt; country_info_path: GeoNames countryInfo.txt
+    countries = {}
+    with open(country_info_path, encoding="utf-8") as f:
+        for line in f:
+            if line.startswith("#") or not line.strip():
+                continue
+            fields = line.rstrip("\n").split("\t")
+            countries[fields[0]] = fields[4]
+
+    records, names, keys = [], [], []
+    with open(cities_path, encoding="utf-8") as f:
+        for line in f:
+            fields = line.rstrip("\n").split("\t")
+            if len(fields) < 15:
+                continue
+            name, ascii_name = fields[1], fields[2]
+            record_id = len(records)
+            records.append((float(fields[4]), float(fields[5]), int(fields[14] or 0), fields[8].encode(), len(names)))
+            names.append(name)
+            for key in {normalize_name(name), normalize_name(ascii_name)}:
+                if key:
+                    keys.append((key, record_id))
+
+    keys.sort()
+    os.makedirs(directory, exist_ok=True)
+    np.save(os.path.join(directory, "records.npy"), np.array(records, dtype=RECORD_DTYPE))
+    np.save(os.path.join(directory, "key_records.npy"), np.array([r for _, r in keys], dtype="<u4"))
+    _write_strings(directory, "key", [k for k, _ in keys])
+    _write_strings(directory, "name", names)
+    with open(os.path.join(directory, "countries.json"), "w", encoding="utf-8") as f:
+        json.dump({"names": countries}, f)
+    return len(records)
+
+
+if __name__ == "__main__":
+    import sys
+
+    if len(sys.argv) < 3:
+        sys.exit("usage: python -m backend.gazetteer <citiesNNNN.txt> <countryInfo.txt> [output dir]")
+    count = build_index(*sys.argv[1:4])
+    print(f"Indexed {count} cities")
@@ -0,0 +1,159 @@
+# geocache.py
+# Two-tier cache for geocoding results: an in-process LRU in front of a
+# SQLite file shared by every worker on the host. Places Nominatim could not
+# find are cached too, for a shorter time. Every call may touch SQLite, so
+# async callers go through backend.tool_runner.run_blocking.
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+from cachetools import LRUCache
+
+
+GEOCODE_CACHE_PATH = os.getenv("GEOCODE_CACHE_PATH", ".geocode_cache.sqlite")
+GEOCODE_CACHE_SIZE = int(os.getenv("GEOCODE_CACHE_SIZE", "4096"))
+GEOCODE_TTL_SECONDS = int(os.getenv("GEOCODE_TTL_SECONDS", str(30 * 24 * 3600)))
+GEOCODE_NEGATIVE_TTL_SECONDS = int(os.getenv("GEOCODE_NEGATIVE_TTL_SECONDS", str(24 * 3600)))
+
+MISS = object()
+
+# England, Scotland, Wales and Northern Ireland stay as they are: town names
+# repeat across them, so they must not share a key
+COUNTRY_ALIASES = {
+    "uk": "united kingdom",
+    "u.k.": "united kingdom",
+    "great britain": "united kingdom",
+    "britain": "united kingdom",
+    "us": "united states",
+    "u.s.": "united states",
+    "usa": "united states",
+    "u.s.a.": "united states",
+    "america": "united states",
+    "united states of america": "united states",
+    "uae": "united arab emirates",
+    "holland": "netherlands",
+    "the netherlands": "netherlands",
+    "south korea": "korea",
+    "republic of korea": "korea",
+    "czechia": "czech republic",
+    "türkiye": "turkey",
+    "turkiye": "turkey",
+}
+
+
+def normalize_query(query: str) -> str:
+    # "  London ,UK" and "london, united kingdom" share one cache entry
+    parts = [re.sub(r"\s+", " ", part).strip().casefold() for part in query.split(",")]
+    parts = [part for part in parts if part]
+    if len(parts) > 1:
+        parts[-1] = COUNTRY_ALIASES.get(parts[-1], parts[-1])
+    return ", ".join(parts)
+
+
+class GeocodeCache:
+    def __init__(
+        self,
+        path: Optional[str] = GEOCODE_CACHE_PATH,
+        maxsize: int = GEOCODE_CACHE_SIZE,
+        ttl: int = GEOCODE_TTL_SECONDS,
+        negative_ttl: int = GEOCODE_NEGATIVE_TTL_SECONDS,
+    ):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.memory = LRUCache(maxsize=maxsize)  # key -> (expires_at, value)
+        self.lock = threading.Lock()
+        self.counters = {"memory_hits": 0, "persistent_hits": 0, "negative_hits": 0, "misses": 0}
+
+        self.db = None
+        if path:
+            self.db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute("PRAGMA synchronous=NORMAL")
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS geocode (key TEXT PRIMARY KEY, value TEXT, expires_at REAL NOT NULL)"
+            )
+            self.purge_expired()
+
+    def get(self, query: str):
+        # Returns the cached dict, None for a cached "not found", or MISS
+        key = normalize_query(query)
+        now = time.time()
+        with self.lock:
+            entry = self.memory.get(key)
+            if entry and entry[0] > now:
+                self._count_hit("memory_hits", entry[1])
+                return entry[1]
+
+            if self.db is not None:
+                row = self.db.execute(
+                    "SELECT value, expires_at FROM geocode WHERE key = ?", (key,)
+                ).fetchone()
+                if row and row[1] > now:
+                    value = json.loads(row[0]) if row[0] is not None else None
+                    self.memory[key] = (row[1], value)
+                    self._count_hit("persistent_hits", value)
+                    return value
+
+            self.counters["misses"] += 1
+            return MISS
+
+    def set(self, query: str, value: Optional[dict]):
+        key = normalize_query(query)
+        expires_at = time.time() + (self.ttl if value is not None else self.negative_ttl)
+        with self.lock:
+            self.memory[key] = (expires_at, value)
+            if self.db is not None:
+                self.db.execute(
+                    "INSERT OR REPLACE INTO geocode (key, value, expires_at) VALUES (?, ?, ?)",
+                    (key, json.dumps(value) if value is not None else None, expires_at),
+                )
+
+    def expires_at(self, query: str) -> Optional[float]:
+        # Expiry of the cached entry, found or not; None when nothing is cached.
+        # The SQLite row wins: another worker may have refreshed it since this one read it.
+        key = normalize_query(query)
+        with self.lock:
+            if self.db is not None:
+                row = self.db.execute("SELECT expires_at FROM geocode WHERE key = ?", (key,)).fetchone()
+                return row[0] if row else None
+            entry = self.memory.get(key)
+            return entry[0] if entry else None
+
+    def purge_expired(self) -> int:
+        # Expired rows are never read again; clear them out when a worker opens the file
+        if self.db is None:
+            return 0
+        with self.lock:
+            return self.db.execute("DELETE FROM geocode WHERE expires_at <= ?", (time.time(),)).rowcount
+
+    def stats(self) -> dict:
+        with self.lock:
+            stats = dict(self.counters)
+            stats["memory_entries"] = len(self.memory)
+        lookups = stats["memory_hits"] + stats["persistent_hits"] + stats["misses"]
+        stats["hit_ratio"] = round((lookups - stats["misses"]) / lookups, 3) if lookups else 0.0
+        return stats
+
+    def _count_hit(self, tier: str, value):
+        self.counters[tier] += 1
+        if value is None:
+            self.counters["negative_hits"] += 1
+
+
+# One cache per worker process, opened on first use rather than at import:
+# opening sets up the SQLite file and purges its expired rows
+_geocode_cache: Optional[GeocodeCache] = None
+_geocode_cache_lock = threading.Lock()
+
+
+def get_geocode_cache() -> GeocodeCache:
+    global _geocode_cache
+    if _geocode_cache is None:
+        with _geocode_cache_lock:
+            if _geocode_cache is None:
+                _geocode_cache = GeocodeCache()
+    return _geocode_cache
@@ -0,0 +1,175 @@
+# history.py
+# Conversation history kept as an append-only Redis list per session.
+# Each list element is one {"role", "content"} entry, plus "parts" when the
+# entry holds function calls or responses. Entries are msgpack encoded behind
+# a one byte format tag, zstd compressed when large (tool payloads mostly).
+# Older plain JSON elements are still read as they are. A version counter next
+# to the list changes whenever what the model sees for the session changes.
+import json
+import os
+from datetime import timedelta
+from typing import List, Optional
+
+import msgpack
+import zstandard
+from redis.client import NEVER_DECODE
+from redis.exceptions import WatchError
+
+
+HISTORY_PREFIX = "chat_turns:"
+HISTORY_VERSION_PREFIX = "chat_version:"
+LEGACY_HISTORY_PREFIX = "chat_history:"  # old format: the whole history as one JSON blob
+HISTORY_TTL = timedelta(days=7)
+
+# "json" keeps writing the old text format, e.g. while rolling back
+HISTORY_ENCODING = os.getenv("HISTORY_ENCODING", "msgpack")
+HISTORY_COMPRESS_MIN_BYTES = int(os.getenv("HISTORY_COMPRESS_MIN_BYTES", "512"))
+
+FORMAT_MSGPACK = b"\x01"
+FORMAT_MSGPACK_ZSTD = b"\x02"
+
+zstd_compressor = zstandard.ZstdCompressor(level=3)
+zstd_decompressor = zstandard.ZstdDecompressor()
+
+
+def encode_entry(entry: dict) -> bytes:
+    if HISTORY_ENCODING == "json":
+        return json.dumps(entry).encode()
+    packed = msgpack.packb(entry, use_bin_type=True)
+    if len(packed) >= HISTORY_COMPRESS_MIN_BYTES:
+        compressed = zstd_compressor.compress(packed)
+        if len(compressed) < len(packed):
+            return FORMAT_MSGPACK_ZSTD + compressed
+    return FORMAT_MSGPACK + packed
+
+
+def decode_entry(raw) -> dict:
+    if isinstance(raw, str):
+        raw = raw.encode()
+    tag, body = raw[:1], raw[1:]
+    if tag == FORMAT_MSGPACK:
+        return msgpack.unpackb(body, raw=False)
+    if tag == FORMAT_MSGPACK_ZSTD:
+        return msgpack.unpackb(zstd_decompressor.decompress(body), raw=False)
+    return json.loads(raw)  # untagged: a JSON entry written before the binary format
+
+
+def entry_text(entry: dict) -> str:
+    # Flat text for token estimates, summaries and cache keys. Function parts
+    # render the way they were stored before parts were kept structured.
+    if "parts" not in entry:
+        return entry.get("content", "")
+    text = ""
+    for part in entry["parts"]:
+        if "text" in part:
+            text += part["text"]
+        elif "function_call" in part:
+            call = part["function_call"]
+            text += f"FunctionCall: {call['name']}({json.dumps(call['args'])})"
+        elif "function_response" in part:
+            result = part["function_response"]
+            text += f"FunctionResponse: {result['name']}({json.dumps(result['response'])})"
+    return text
+
+
+def is_function_response(entry: dict) -> bool:
+    if "parts" in entry:
+        return any("function_response" in part for part in entry["parts"])
+    return entry.get("content", "").startswith("FunctionResponse:")
+
+
+def history_key(session_id: str) -> str:
+    return HISTORY_PREFIX + session_id
+
+
+def version_key(session_id: str) -> str:
+    return HISTORY_VERSION_PREFIX + session_id
+
+
+async def get_history_version(redis_client, session_id: str) -> Optional[int]:
+    version = await redis_client.get(version_key(session_id))
+    return int(version) if version is not None else None
+
+
+async def bump_history_version(redis_client, session_id: str) -> int:
+    async with redis_client.pipeline(transaction=True) as pipe:
+        pipe.incr(version_key(session_id))
+        pipe.expire(version_key(session_id), HISTORY_TTL)
+        version, _ = await pipe.execute()
+    return version
+
+
+async def history_length(redis_client, session_id: str) -> int:
+    # Entry count without reading the entries
+    return await redis_client.llen(history_key(session_id))
+
+
+async def get_history(redis_client, session_id: str, start: int = 0) -> List[dict]:
+    # Entries from index `start` onwards, so callers only read the part they need
+    key = history_key(session_id)
+    raw_entries = await read_entries(redis_client, key, start)
+    if not raw_entries and start == 0 and await migrate_legacy_history(redis_client, session_id):
+        raw_entries = await read_entries(redis_client, key, start)
+    return [decode_entry(raw) for raw in raw_entries]
+
+
+async def read_entries(redis_client, key: str, start: int) -> List[bytes]:
+    # Raw bytes even on a decode_responses client; binary entries are not UTF-8
+    return await redis_client.execute_command("LRANGE", key, start, -1, **{NEVER_DECODE: True})
+
+
+async def append_history(redis_client, session_id: str, entries: List[dict]) -> Optional[int]:
+    # Returns the history version that includes these entries
+    if not entries:
+        return await get_history_version(redis_client, session_id)
+    key = history_key(session_id)
+    async with redis_client.pipeline(transaction=True) as pipe:
+        pipe.rpush(key, *[encode_entry(entry) for entry in entries])
+        pipe.expire(key, HISTORY_TTL)  # sliding 7 day expiry
+        pipe.incr(version_key(session_id))
+        pipe.expire(version_key(session_id), HISTORY_TTL)
+        results = await pipe.execute()
+    return results[2]
+
+
+async def migrate_legacy_history(redis_client, session_id: str) -> bool:
+    # Moves a `chat_history:<id>` blob into the list format. WATCH makes the
+    # move safe when two requests for the same session race on it.
+    legacy_key = LEGACY_HISTORY_PREFIX + session_id
+    async with redis_client.pipeline(transaction=True) as pipe:
+        try:
+            await pipe.watch(legacy_key)
+            raw = await pipe.get(legacy_key)
+            if not raw:
+                return False
+            entries = json.loads(raw)
+            ttl = await pipe.ttl(legacy_key)
+
+            pipe.multi()
+            if entries:
+                pipe.rpush(history_key(session_id), *[encode_entry(entry) for entry in entries])
+                pipe.expire(history_key(session_id), ttl if ttl > 0 else HISTORY_TTL)
+            pipe.delete(legacy_key)
+            await pipe.execute()
+            return True
+        except WatchError:
+            # Someone else migrated it first
+            return True
+
+
+async def migrate_all_legacy_histories(redis_client) -> int:
+    migrated = 0
+    async for key in redis_client.scan_iter(match=LEGACY_HISTORY_PREFIX + "*", count=500):
+        if await migrate_legacy_history(redis_client, key[len(LEGACY_HISTORY_PREFIX):]):
+            migrated += 1
+    return migrated
+
+
+if __name__ == "__main__":
+    # One-off bulk migration: python -m backend.history
+    import asyncio
+
+    from backend import main
+
+    main.build_clients()
+    print(f"Migrated {asyncio.run(migrate_all_legacy_histories(main.redis_client))} sessions")
@@ -1,20 +1,31 @@
-from fastapi import FastAPI
+from fastapi import BackgroundTasks, FastAPI, Request, Response
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from starlette.background import BackgroundTask
 from pydantic import BaseModel
 from fastapi.middleware.cors import CORSMiddleware
 from dotenv import load_dotenv
 
-from google.genai import types
-from google.genai.types import Content, Part
-from google.generativeai import GenerativeModel, configure
 import google.ai.generativelanguage as glm
-from typing import List, Optional, Callable
-from datetime import timedelta
-from backend.tools import get_weather_forecast
+from google.protobuf.json_format import MessageToDict
+from typing import AsyncIterator, List, Optional, Callable, Tuple, Union
+from backend.tools import (
+    forecast_stats, geocode_limiter, geocode_summary, get_weather_forecast, get_weather_forecast_batch,
+)
+from backend.geocache import get_geocode_cache
+from backend.weather_client import get_weather_client
+from backend.tool_runner import drop_pending_calls, function_calls, get_tool_executor, run_tools, skip_tools, tool_stats
+from backend import admission, metrics, prewarm, response_cache, session_cache
+from backend.session_guard import SessionBusy, coalesce, coalesce_stream, session_guard_stats, session_turn
+from backend.history import append_history, entry_text
+from backend.context import CONTEXT_TOKEN_BUDGET, ContextWindow, build_context, context_metrics, entry_tokens, refresh_summary
 
 import os
-import redis
+import redis.asyncio as redis
 import uuid
 import json
+import asyncio
+import threading
+from contextlib import AsyncExitStack, asynccontextmanager
 
 
 
@@ -22,34 +33,14 @@ import json
 # Load .env file to get the API Key and redis details
 load_dotenv()
 
-redis_client = redis.Redis(
-    host=os.getenv("REDIS_HOST"),
-    port=int(os.getenv("REDIS_PORT")),
-    decode_responses=True,
-    username=os.getenv("REDIS_USERNAME", "default"),
-    password=os.getenv("REDIS_PASSWORD"), 
-)
-
-
-
-HISTORY_PREFIX = "chat_history:"
-
-def get_history(session_id: str) -> List[dict]:
-    key = HISTORY_PREFIX + session_id
-    raw = redis_client.get(key)
-    return json.loads(raw) if raw else []
+# Clients are built by build_clients(), once per worker, from the lifespan hook
+redis_client: Optional[redis.Redis] = None
+model = None
+summary_model = None
+clients_lock = threading.Lock()
 
-def save_history(session_id: str, history: List[dict]):
-    key = HISTORY_PREFIX + session_id
-    redis_client.setex(key, timedelta(days=7), json.dumps(history))  # store full history for 7 days
-
-def append_to_history(session_id: str, role: str, content: str):
-    history = get_history(session_id)
-    history.append({"role": role, "content": content})
-    save_history(session_id, history)
-
-# client = genai.Client()
-configure(api_key=os.getenv("GOOGLE_API_KEY"))
+CHAT_MODEL_NAME = os.getenv("CHAT_MODEL_NAME", "gemini-2.5-flash")
+READY_TIMEOUT_SECONDS = float(os.getenv("READY_TIMEOUT_SECONDS", "2"))
 
 
 system_prompt = """
@@ -70,6 +61,7 @@ As a dedicated travel assistant, you must only respond to travel-related questio
 If a user asks a question that is unrelated to travel, politely inform them that you can only assist with travel topics and do not attempt to answer the unrelated question or redirect them to where they can find their answer.
 If a user is unsure of what they want or ask an empty question, ask how you can assist with travel-related questions and suggest an example.
 If a user asks to get the weather forecast for a city and date range, you must always call the get_weather_forecast tool instead of answering directly.
+If the trip covers several cities, call get_weather_forecast_batch once with every city instead of calling get_weather_forecast for each.
 Do not generate weather-related replies yourself.
 
 
@@ -88,11 +80,76 @@ You: I would be happy to assit! Would you like a mix of sightseeing, food experi
 - Respond in the user's language if their message is not in English, unless they request otherwise.
 """
 
+# Stats the pipeline modules already keep, exported alongside the request metrics
+metrics.register_collector("context", lambda: context_metrics)
+metrics.register_collector("response_cache", response_cache.stats)
+metrics.register_collector("session_guard", lambda: session_guard_stats)
+metrics.register_collector("admission", admission.stats)
+metrics.register_collector("session_cache", session_cache.stats)
+metrics.register_collector("tool", lambda: dict(tool_stats), label="tool")
+metrics.register_collector("geocode_cache", lambda: get_geocode_cache().stats())
+metrics.register_collector("geocode", geocode_summary)
+metrics.register_collector("geocode_limiter", geocode_limiter.stats)
+metrics.register_collector("forecast_cache", forecast_stats)
+metrics.register_collector("weather_client", lambda: get_weather_client().stats())
+metrics.register_collector("prewarm", prewarm.stats)
+
+def build_clients():
+    # google.generativeai is only imported here: it is the heaviest import in
+    # the backend, and scripts that import this module never need it.
+    # Anything already set (the benchmarks install stand-ins) is kept.
+    global redis_client, model, summary_model
+    from google.generativeai import GenerativeModel, configure
+
+    with clients_lock:
+        if redis_client is None:
+            redis_client = redis.Redis(
+                host=os.getenv("REDIS_HOST"),
+                port=int(os.getenv("REDIS_PORT")),
+                decode_responses=True,
+                username=os.getenv("REDIS_USERNAME", "default"),
+                password=os.getenv("REDIS_PASSWORD"),
+            )
+        # The Nominatim rate, the per-client rate limits and the pre-warm budget are shared by every worker through Redis
+        geocode_limiter.redis_client = redis_client
+        admission.session_limiter.redis_client = redis_client
+        admission.ip_limiter.redis_client = redis_client
+        prewarm.redis_client = redis_client
+        configure(api_key=os.getenv("GOOGLE_API_KEY"))
+        if model is None:
+            model = GenerativeModel(
+                model_name=CHAT_MODEL_NAME,
+                tools=[WEATHER_ITINERARY_TOOL],
+                system_instruction=system_prompt,
+            )
+        if summary_model is None:
+            # Plain model (no tools) used to fold old turns into the rolling summary
+            summary_model = GenerativeModel(
+                model_name=CHAT_MODEL_NAME,
+                system_instruction=SUMMARY_PROMPT,
+            )
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Long-lived clients are built once per worker, not per request
+    build_clients()
+    weather_client = get_weather_client()
+    get_geocode_cache()
+    get_tool_executor()
+    prewarm.start()
+    yield
+    await prewarm.stop()
+    weather_client.close()
+    await redis_client.aclose()
+
+
 # Initialize FastAPI app
 app = FastAPI(
     title="Travel Chatbot",
     description="LLM chatbot that answers travel questions using Google's Gemini",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan,
 )
 
 # CORS middleware to allow frontend (like Streamlit) to access API
@@ -120,7 +177,8 @@ WEATHER_ITINERARY_TOOL = glm.Tool(
         glm.FunctionDeclaration(
             name="get_weather_forecast",
             description="""
-            Fetches hourly temperature and dominant weather condition forecasts for a given city in a country and within a date range.
+            Fetches temperature and dominant weather condition forecasts for a given city in a country and within a date range,
+            with a per-day breakdown of temperatures, dominant condition, precipitation hours and amount, rain probability and wind.
             Use this tool to get weather information to help plan travel itineraries,
             suggest appropriate activities (indoor/outdoor), and advise on packing.
             The date range should be between 16 days.
@@ -147,126 +205,497 @@ WEATHER_ITINERARY_TOOL = glm.Tool(
                 },
                 required=["city", "country", "start_date", "end_date"],
             ),
-        )
+        ),
+        glm.FunctionDeclaration(
+            name="get_weather_forecast_batch",
+            description="""
+            Fetches the same weather forecast as get_weather_forecast for several cities at once.
+            Use this instead of repeated get_weather_forecast calls when an itinerary covers more than one city,
+            each with its own date range.
+            """,
+            parameters=glm.Schema(
+                type=glm.Type.OBJECT,
+                properties={
+                    "trips": glm.Schema(
+                        type=glm.Type.ARRAY,
+                        description="One entry per city stop of the itinerary.",
+                        items=glm.Schema(
+                            type=glm.Type.OBJECT,
+                            properties={
+                                "city": glm.Schema(type=glm.Type.STRING, description="The name of the city, e.g. 'Paris'."),
+                                "country": glm.Schema(type=glm.Type.STRING, description="The country the city is in, e.g. 'France'."),
+                                "start_date": glm.Schema(type=glm.Type.STRING, description="Start date of the stay in 'YYYY-MM-DD' format."),
+                                "end_date": glm.Schema(type=glm.Type.STRING, description="End date of the stay in 'YYYY-MM-DD' format, at most 16 days after the start date."),
+                            },
+                            required=["city", "country", "start_date", "end_date"],
+                        ),
+                    )
+                },
+                required=["trips"],
+            ),
+        ),
     ]
 )
 
 
-model = GenerativeModel(
-    model_name="gemini-2.5-flash",
-    tools=[WEATHER_ITINERARY_TOOL], 
-    system_instruction=system_prompt,
-    # safety_settings={
-    #     category=types.HarmCategory.HARM_CATEGORY_HATE_SPEECH,
-    #     threshold=types.HarmBlockThreshold.BLOCK_LOW_AND_ABOVE,
-    #     HarmCategory.HARM_CATEGORY_HARASSMENT: HarmBlockThreshold.BLOCK_MEDIUM_AND_ABOVE,
-    #     HarmCategory.HARM_CATEGORY_HATE_SPEECH: HarmBlockThreshold.BLOCK_MEDIUM_AND_ABOVE,
-    #     HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT: HarmBlockThreshold.BLOCK_MEDIUM_AND_ABOVE,
-    #     HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT: HarmBlockThreshold.BLOCK_MEDIUM_AND_ABOVE,
-    # }
+SUMMARY_PROMPT = (
+    "You maintain a running summary of a conversation between a traveller and a travel assistant. "
+    "Merge the new turns into the existing summary. Keep destinations, dates, budget, preferences, "
+    "decisions made and open questions. Be concise and write in plain prose."
 )
 
 
+async def summarize_turns(previous_summary: str, entries: List[dict]) -> str:
+    transcript = "\n".join(f"{entry['role']}: {entry_text(entry)}" for entry in entries)
+    response = await summary_model.generate_content_async(
+        f"Existing summary:\n{previous_summary or '(none)'}\n\nNew turns:\n{transcript}",
+        generation_config=glm.GenerationConfig(temperature=0.2),
+    )
+    return response.text
+
+
+async def refresh_summary_in_background(session_id: str):
+    try:
+        await refresh_summary(redis_client, session_id, summarize_turns)
+    except Exception as e:
+        print(f"Error refreshing summary for {session_id}: {e}")
+
+
 AVAILABLE_TOOLS: dict[str, Callable] = {
     "get_weather_forecast": get_weather_forecast,
+    "get_weather_forecast_batch": get_weather_forecast_batch,
 }
 
-@app.post("/chat", response_model=ChatResponse)
-def chat_with_bot(request: ChatRequest):
-    try:
-        session_id = request.session_id or str(uuid.uuid4())
-        history = get_history(session_id)
+CHAT_GENERATION_CONFIG = glm.GenerationConfig(
+    temperature=0.4,
+    top_p=1,
+    top_k=40,
+)
 
-        converted_history = []
-        for item in history:
-            if "role" in item and "content" in item:
-                role = item["role"]  
+TOOL_FOLLOW_UP_GENERATION_CONFIG = glm.GenerationConfig(
+    temperature=0.7,
+    top_p=1,
+    top_k=40,
+)
 
-            
-                if role == "assistant":
-                    role = "model"
-                elif role == "tool":
-                    continue  
+# Cap on chained tool rounds per message, so a looping model cannot run forever
+MAX_TOOL_ROUNDS = int(os.getenv("MAX_TOOL_ROUNDS", "3"))
+# Past the cap, the pending calls get this as their result and the model must answer in text
+TOOL_LIMIT_RESULT = "Not run: the limit of tool calls for this message was reached. Answer with what you have."
+NO_TOOLS_CONFIG = {"function_calling_config": {"mode": "none"}}
 
-            converted_history.append(
-                glm.Content(role=role, parts=[glm.Part(text=item["content"])])
-            )
-        chat = model.start_chat(history=converted_history)
-
-        response = chat.send_message(
-            request.message,
-            generation_config=glm.GenerationConfig(
-                temperature=0.4,
-                top_p=1,
-                top_k=40,
-            )
-        )
+# Cached replies are only valid for the prompt and settings that produced them
+RESPONSE_CACHE_FINGERPRINT = response_cache.fingerprint(
+    CHAT_MODEL_NAME, system_prompt, CHAT_GENERATION_CONFIG, TOOL_FOLLOW_UP_GENERATION_CONFIG
+)
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "models/text-embedding-004")
+RESPONSE_CACHE_SEMANTIC = os.getenv("RESPONSE_CACHE_SEMANTIC", "true").lower() in ("1", "true", "yes")
 
 
-        reply_content = ""
-        # Check if the model wants to call a tool
-        if response.candidates and response.candidates[0].content.parts[0].function_call:
-            function_call = response.candidates[0].content.parts[0].function_call
-            tool_name = function_call.name
-            tool_args = {k: v for k, v in function_call.args.items()}
+async def embed_text(text: str) -> List[float]:
+    from google.generativeai import embed_content_async
 
-            
+    result = await embed_content_async(model=EMBEDDING_MODEL, content=text, task_type="SEMANTIC_SIMILARITY")
+    return result["embedding"]
 
-            if tool_name in AVAILABLE_TOOLS:
-                print(f"Tool Call Detected: {tool_name} with args: {tool_args}")
-                tool_output = AVAILABLE_TOOLS[tool_name](**tool_args)
-                print(f"Tool Output: {tool_output}")
 
-                follow_up_response = chat.send_message(
-                    glm.Part(function_response=glm.FunctionResponse(name=tool_name, response=tool_output)),
-                    generation_config=glm.GenerationConfig(
-                        temperature=0.7,
-                        top_p=1,
-                        top_k=40,
-                    )
+response_embedder = embed_text if RESPONSE_CACHE_SEMANTIC else None
+
+TOOL_LIMIT_REPLY = "I couldn't finish looking everything up for that. Could you ask about one thing at a time?"
+SESSION_BUSY_REPLY = "I'm still answering your previous message in this conversation. Please try again in a moment."
+REJECTED_REPLIES = {
+    429: "You're sending messages faster than I can answer them. Please wait a moment and try again.",
+    503: "Wanderbot is very busy right now. Please try again in a few seconds.",
+}
+
+background_jobs = set()
+
+
+def spawn(coro):
+    # Fire-and-forget work that must not hold up a response; keeps a reference until done
+    task = asyncio.create_task(coro)
+    background_jobs.add(task)
+    task.add_done_callback(background_jobs.discard)
+
+
+def to_model_part(part: dict) -> glm.Part:
+    if "function_call" in part:
+        call = part["function_call"]
+        return glm.Part(function_call=glm.FunctionCall(name=call["name"], args=call["args"]))
+    if "function_response" in part:
+        result = part["function_response"]
+        return glm.Part(function_response=glm.FunctionResponse(name=result["name"], response=result["response"]))
+    return glm.Part(text=part["text"])
+
+
+def to_model_history(history: List[dict]) -> List[glm.Content]:
+    converted_history = []
+    for item in history:
+        role = item["role"]
+        if role == "assistant":
+            role = "model"
+        elif role == "tool":
+            continue
+
+        if "parts" in item:
+            parts = [to_model_part(part) for part in item["parts"]]
+        else:
+            parts = [glm.Part(text=item["content"])]
+        converted_history.append(glm.Content(role=role, parts=parts))
+    return converted_history
+
+
+def to_stored_part(part: glm.Part) -> dict:
+    # Struct fields converted straight from protobuf, so nested args survive as-is
+    if part.function_call:
+        return {"function_call": {
+            "name": part.function_call.name,
+            "args": MessageToDict(part._pb.function_call.args),
+        }}
+    if part.function_response:
+        return {"function_response": {
+            "name": part.function_response.name,
+            "response": MessageToDict(part._pb.function_response.response),
+        }}
+    return {"text": part.text}
+
+
+def to_stored_history(chat_history: List[glm.Content]) -> List[dict]:
+    new_history = []
+    for content_item in chat_history:
+        role_to_save = "assistant" if content_item.role == "model" else content_item.role
+        parts = [to_stored_part(part) for part in content_item.parts]
+        entry = {"role": role_to_save, "content": "".join(part.get("text", "") for part in parts)}
+        # Plain text turns stay as text; anything with function parts keeps its structure
+        if any("text" not in part for part in parts):
+            entry["parts"] = parts
+        new_history.append(entry)
+    return new_history
+
+
+async def load_session(session_id: str) -> Tuple[Optional[session_cache.LiveSession], Optional[ContextWindow]]:
+    # This worker's live session when it is still current, otherwise the context from Redis
+    live = await session_cache.checkout(redis_client, session_id)
+    if live is not None:
+        return live, None
+    return None, await build_context(redis_client, session_id)
+
+
+def keep_session(session_id: str, chat, version: Optional[int], tokens: int):
+    # Histories short enough for the reply cache go through Redis each turn, since its keys are built from them
+    if not response_cache.is_cacheable(chat.history):
+        session_cache.store(session_id, chat, version, tokens, CONTEXT_TOKEN_BUDGET)
+
+
+def cached_entries(message: str, reply: str) -> List[dict]:
+    return [{"role": "user", "content": message}, {"role": "assistant", "content": reply}]
+
+
+async def finish_turn(session_id: str, new_entries: List[dict], chat=None, tokens: int = 0):
+    # Everything a finished turn does, for /chat and /chat/stream alike, cached reply or not
+    with metrics.span("history_save"):
+        version = await append_history(redis_client, session_id, new_entries)
+    if chat is not None:
+        keep_session(session_id, chat, version, tokens + entry_tokens(new_entries))
+
+
+def affinity_headers() -> dict:
+    return {session_cache.SESSION_AFFINITY_HEADER: session_cache.WORKER_ID} if session_cache.SESSION_AFFINITY else {}
+
+
+def response_text(response) -> str:
+    # response.text raises when the last turn holds only function calls
+    if not response.candidates:
+        return ""
+    return "".join(part.text for part in response.candidates[0].content.parts if part.text)
+
+
+async def run_turn(session_id: str, message: str, background_tasks: BackgroundTasks) -> str:
+    # Turns of one session run one at a time, across workers; the model slot is only taken once it is this turn's go
+    async with session_turn(redis_client, session_id), admission.model_slot():
+        with metrics.span("history_load"):
+            live, context = await load_session(session_id)
+
+        cached_reply = None
+        if context is not None:
+            with metrics.span("response_cache"):
+                cached_reply = await response_cache.lookup(
+                    redis_client, message, context.entries, RESPONSE_CACHE_FINGERPRINT, embed=response_embedder
                 )
-                reply_content = follow_up_response.text
-            else:
-                reply_content = f"Sorry, Wanderbot doesn't have a tool to perform '{tool_name}'."
+        if cached_reply is not None:
+            await finish_turn(session_id, cached_entries(message, cached_reply))
+            background_tasks.add_task(refresh_summary_in_background, session_id)
+            return cached_reply
+
+        if live is not None:
+            chat, tokens = live.chat, live.tokens
         else:
-            reply_content = response.text or "I'm sorry, I couldn't find a response. Please try again."
-
-
-        new_history = []
-        for content_item in chat.history:
-            role = content_item.role
-            text_content = ""
-            for part in content_item.parts:
-                if part.text:
-                    text_content += part.text
-                elif part.function_call:
-                    args_for_history = {k: v for k, v in part.function_call.args.items()}
-                    text_content += f"FunctionCall: {part.function_call.name}({json.dumps(args_for_history)})"
-                elif part.function_response:
-                    response_data = part.function_response.response
-
-                    if not isinstance(response_data, dict):
-                        try:
-                            response_data = {k: v for k, v in response_data.items()}
-                        except AttributeError:
-                            print(f"DEBUG: Non-dict response_data type: {type(response_data)}. Converting to string.")
-                            response_data = str(response_data)
-                    
-                    try:
-                        text_content += f"FunctionResponse: {part.function_response.name}({json.dumps(response_data)})"
-                    except TypeError as e:
-                        print(f"CRITICAL ERROR IN HISTORY SAVE (FunctionResponse): {e}")
-                        print(f"Offending type: {type(response_data)}, Value: {repr(response_data)}")
-                        text_content += f"FunctionResponse: {part.function_response.name}(SerializationError: {e})"
-
-            role_to_save = "assistant" if role == "model" else role
-            new_history.append({"role": role_to_save, "content": text_content})
-            
-        save_history(session_id, new_history)
+            with metrics.span("history_convert"):
+                model_history = to_model_history(context.entries)
+            chat, tokens = model.start_chat(history=model_history), context.prompt_tokens
+        history_length = len(chat.history)
+
+        with metrics.span("model"):
+            response = await chat.send_message_async(
+                message,
+                generation_config=CHAT_GENERATION_CONFIG,
+            )
+        metrics.record_usage(response)
+
+        # Run every function call the model asks for and send all results back
+        # together, for up to MAX_TOOL_ROUNDS rounds of chained calls
+        tool_rounds = 0
+        limited = False
+        while (calls := function_calls(response)) and not limited:
+            limited = tool_rounds >= MAX_TOOL_ROUNDS
+            if limited:
+                tool_results = skip_tools(calls, TOOL_LIMIT_RESULT)
+            else:
+                tool_rounds += 1
+                with metrics.span("tools"):
+                    tool_results = await run_tools(calls, AVAILABLE_TOOLS)
+            with metrics.span("model"):
+                response = await chat.send_message_async(
+                    tool_results,
+                    generation_config=TOOL_FOLLOW_UP_GENERATION_CONFIG,
+                    tool_config=NO_TOOLS_CONFIG if limited else None,
+                )
+            metrics.record_usage(response)
+        drop_pending_calls(chat, TOOL_LIMIT_REPLY)
+
+        reply_text = response_text(response)
+        reply_content = reply_text or (
+            TOOL_LIMIT_REPLY if limited else "I'm sorry, I couldn't find a response. Please try again."
+        )
+
 
+        # Only this turn's entries are written, the stored history is append-only
+        with metrics.span("history_convert"):
+            new_entries = to_stored_history(chat.history[history_length:])
+        await finish_turn(session_id, new_entries, chat, tokens)
 
+    background_tasks.add_task(refresh_summary_in_background, session_id)
+    if context is not None:
+        background_tasks.add_task(
+            response_cache.store, redis_client, message, context.entries, RESPONSE_CACHE_FINGERPRINT,
+            reply_text, used_tools=tool_rounds > 0, embed=response_embedder,
+        )
+    return reply_content
+
+
+@app.post("/chat", response_model=ChatResponse)
+async def chat_with_bot(request: ChatRequest, background_tasks: BackgroundTasks, response: Response, http_request: Request):
+    try:
+        session_id = request.session_id or str(uuid.uuid4())
+        await admission.check_client(session_id, admission.client_address(http_request))
+        # A double submit shares the turn already running instead of calling the model again
+        with metrics.track_request("chat"):
+            reply_content = await coalesce(
+                session_id, request.message, lambda: run_turn(session_id, request.message, background_tasks)
+            )
+        response.headers.update(affinity_headers())
         return {"reply": reply_content, "session_id": session_id}
 
+    except admission.Rejected as e:
+        return rejected_response(e, session_id)
+    except SessionBusy:
+        return {"reply": SESSION_BUSY_REPLY, "session_id": request.session_id}
     except Exception as e:
         print(f"Error in chat_with_bot: {e}")
-        return {"reply":  "An unexpected error occurred. Please try again"}
\ No newline at end of file
+        return {"reply":  "An unexpected error occurred. Please try again"}
+
+
+def rejected_response(rejection: admission.Rejected, session_id: str) -> JSONResponse:
+    return JSONResponse(
+        {"reply": REJECTED_REPLIES[rejection.status_code], "session_id": session_id, "reason": rejection.reason},
+        status_code=rejection.status_code,
+        headers={"Retry-After": str(rejection.retry_after)},
+    )
+
+
+def sse_event(data: dict, event: Optional[str] = None) -> str:
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data)}\n\n"
+
+
+async def stream_chunks(response) -> AsyncIterator[Union[str, glm.FunctionCall]]:
+    # Yields text as it arrives, and every function call the model asks for
+    async for chunk in response:
+        if not chunk.candidates:
+            continue
+        for part in chunk.candidates[0].content.parts:
+            if part.function_call:
+                yield part.function_call
+            elif part.text:
+                yield part.text
+
+
+async def stream_reply(session_id: str, message: str, turn: AsyncExitStack) -> AsyncIterator[str]:
+    # turn holds the session lock and model slot; closing it releases both.
+    # Runs in its own task (coalesce_stream), so a reader leaving doesn't stop it.
+    yield sse_event({"session_id": session_id}, event="session")
+    timer = metrics.start_request("chat_stream")
+    outcome = "ok"
+    try:
+        async for event in stream_turn(session_id, message):
+            yield event
+    except (GeneratorExit, asyncio.CancelledError):
+        outcome = "cancelled"
+        raise
+    except Exception as e:
+        outcome = "error"
+        print(f"Error in stream_reply: {e}")
+        yield sse_event({"text": "An unexpected error occurred. Please try again"}, event="error")
+    finally:
+        timer.finish(outcome)
+        await turn.aclose()
+
+
+async def busy_reply(session_id: str) -> AsyncIterator[str]:
+    yield sse_event({"session_id": session_id}, event="session")
+    yield sse_event({"text": SESSION_BUSY_REPLY}, event="error")
+
+
+async def stream_turn(session_id: str, message: str) -> AsyncIterator[str]:
+    # Called with the session lock held
+    with metrics.span("history_load"):
+        live, context = await load_session(session_id)
+
+    cached_reply = None
+    if context is not None:
+        with metrics.span("response_cache"):
+            cached_reply = await response_cache.lookup(
+                redis_client, message, context.entries, RESPONSE_CACHE_FINGERPRINT, embed=response_embedder
+            )
+    if cached_reply is not None:
+        yield sse_event({"text": cached_reply})
+        await finish_turn(session_id, cached_entries(message, cached_reply))
+        yield sse_event({"session_id": session_id}, event="done")
+        return
+
+    if live is not None:
+        chat, tokens = live.chat, live.tokens
+    else:
+        with metrics.span("history_convert"):
+            model_history = to_model_history(context.entries)
+        chat, tokens = model.start_chat(history=model_history), context.prompt_tokens
+    history_length = len(chat.history)
+
+    content = message
+    generation_config = CHAT_GENERATION_CONFIG
+    reply_chunks = []
+    tool_rounds = 0
+    limited = False
+    while True:
+        calls = []
+        # The model span covers the whole stream, including time spent yielding to the client
+        with metrics.span("model"):
+            response = await chat.send_message_async(
+                content, generation_config=generation_config, stream=True,
+                tool_config=NO_TOOLS_CONFIG if limited else None,
+            )
+            async for chunk in stream_chunks(response):
+                if isinstance(chunk, str):
+                    reply_chunks.append(chunk)
+                    yield sse_event({"text": chunk})
+                else:
+                    calls.append(chunk)
+        metrics.record_usage(response)
+
+        if not calls or limited:
+            break
+        limited = tool_rounds >= MAX_TOOL_ROUNDS
+        if limited:
+            content = skip_tools(calls, TOOL_LIMIT_RESULT)
+        else:
+            tool_rounds += 1
+            with metrics.span("tools"):
+                content = await run_tools(calls, AVAILABLE_TOOLS)
+        generation_config = TOOL_FOLLOW_UP_GENERATION_CONFIG
+    drop_pending_calls(chat, TOOL_LIMIT_REPLY)
+
+    reply_text = "".join(reply_chunks)
+    reply_content = reply_text or (
+        TOOL_LIMIT_REPLY if limited else "I'm sorry, I couldn't find a response. Please try again."
+    )
+    if not reply_text:
+        yield sse_event({"text": reply_content})
+
+    with metrics.span("history_convert"):
+        new_entries = to_stored_history(chat.history[history_length:])
+    await finish_turn(session_id, new_entries, chat, tokens)
+    yield sse_event({"session_id": session_id}, event="done")
+    if context is not None:
+        spawn(response_cache.store(
+            redis_client, message, context.entries, RESPONSE_CACHE_FINGERPRINT,
+            reply_text, used_tools=tool_rounds > 0, embed=response_embedder,
+        ))
+
+
+async def open_stream_turn(session_id: str) -> AsyncExitStack:
+    # The session lock comes before the model slot: a turn queued behind
+    # another in its session holds no slot while it waits
+    turn = AsyncExitStack()
+    try:
+        await turn.enter_async_context(session_turn(redis_client, session_id))
+        await turn.enter_async_context(admission.model_slot())
+    except BaseException:
+        await turn.aclose()
+        raise
+    return turn
+
+
+@app.post("/chat/stream")
+async def chat_with_bot_stream(request: ChatRequest, http_request: Request):
+    session_id = request.session_id or str(uuid.uuid4())
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no", **affinity_headers()}
+    # Admitted before the stream starts, so overload is still a plain 429/503.
+    # A double submit reads the events of the turn already running.
+    try:
+        await admission.check_client(session_id, admission.client_address(http_request))
+        stream = await coalesce_stream(
+            session_id, request.message,
+            lambda: open_stream_turn(session_id),
+            lambda turn: stream_reply(session_id, request.message, turn),
+        )
+    except admission.Rejected as e:
+        return rejected_response(e, session_id)
+    except SessionBusy:
+        return StreamingResponse(busy_reply(session_id), media_type="text/event-stream", headers=headers)
+    return StreamingResponse(
+        stream.follow(),
+        media_type="text/event-stream",
+        headers=headers,
+        background=BackgroundTask(refresh_summary_in_background, session_id),
+    )
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    if not metrics.METRICS_ENABLED:
+        return PlainTextResponse("Metrics are disabled\n", status_code=404)
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/prewarm")
+async def get_prewarm_status():
+    # Queue, budget and cache freshness of the forecast pre-warm scheduler
+    return prewarm.status()
+
+
+@app.get("/health")
+async def health():
+    # Liveness only; dependencies are checked by /ready
+    return {"status": "ok"}
+
+
+@app.get("/ready")
+async def ready():
+    checks = {"models": model is not None and summary_model is not None, "redis": False}
+    if redis_client is not None:
+        try:
+            checks["redis"] = bool(await asyncio.wait_for(redis_client.ping(), READY_TIMEOUT_SECONDS))
+        except Exception as e:
+            print(f"Readiness check failed for Redis: {e}")
+    ok = all(checks.values())
+    return JSONResponse({"status": "ready" if ok else "not ready", "checks": checks}, status_code=200 if ok else 503)
@@ -0,0 +1,225 @@
+# metrics.py
+# In-process Prometheus-style metrics for the chat pipeline, rendered in the
+# text exposition format by GET /metrics. span() times one pipeline stage into
+# a histogram and also appends it to the current request's trace, which is
+# printed when a request is slow. METRICS_ENABLED=false makes all of it a no-op.
+import bisect
+import contextvars
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Tuple
+
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() in ("1", "true", "yes")
+METRICS_PREFIX = "wanderbot_"
+TRACE_SLOW_SECONDS = float(os.getenv("TRACE_SLOW_SECONDS", "10"))
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+METRIC_HELP = {
+    "requests_total": ("counter", "Chat requests by endpoint and outcome"),
+    "requests_in_flight": ("gauge", "Chat requests currently being answered"),
+    "request_seconds": ("histogram", "End-to-end chat request latency"),
+    "stage_seconds": ("histogram", "Latency of one chat pipeline stage"),
+    "stage_errors_total": ("counter", "Errors raised inside a chat pipeline stage"),
+    "model_tokens_total": ("counter", "Gemini tokens reported in usage metadata"),
+    "rate_limit_wait_seconds": ("histogram", "Time spent waiting for an upstream rate limiter slot"),
+    "requests_shed_total": ("counter", "Chat requests turned away by admission control, by reason"),
+    "admission_wait_seconds": ("histogram", "Time admitted or timed-out chat requests spent in the admission queue"),
+}
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+metrics_lock = threading.Lock()
+counters: Dict[Tuple[str, LabelKey], float] = {}
+gauges: Dict[Tuple[str, LabelKey], float] = {}
+histograms: Dict[Tuple[str, LabelKey], list] = {}  # bucket counts, then sum and count
+
+# (name, label, callback): snapshots of the stats dicts other modules already keep
+collectors: List[Tuple[str, Optional[str], Callable[[], dict]]] = []
+
+current_trace: contextvars.ContextVar = contextvars.ContextVar("current_trace", default=None)
+
+
+def label_key(labels: dict) -> LabelKey:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def inc(name: str, value: float = 1.0, **labels):
+    if not METRICS_ENABLED:
+        return
+    key = (name, label_key(labels))
+    with metrics_lock:
+        counters[key] = counters.get(key, 0.0) + value
+
+
+def add_gauge(name: str, delta: float, **labels):
+    if not METRICS_ENABLED:
+        return
+    key = (name, label_key(labels))
+    with metrics_lock:
+        gauges[key] = gauges.get(key, 0.0) + delta
+
+
+def observe(name: str, value: float, **labels):
+    if not METRICS_ENABLED:
+        return
+    key = (name, label_key(labels))
+    index = bisect.bisect_left(LATENCY_BUCKETS, value)
+    with metrics_lock:
+        histogram = histograms.get(key)
+        if histogram is None:
+            histogram = histograms[key] = [0] * (len(LATENCY_BUCKETS) + 1) + [0.0, 0]
+        histogram[index] += 1
+        histogram[-2] += value
+        histogram[-1] += 1
+
+
+def register_collector(name: str, callback: Callable[[], dict], label: Optional[str] = None):
+    # callback returns {stat: number}, or {label value: {stat: number}} when label is given
+    collectors.append((name, label, callback))
+
+
+@contextmanager
+def span(stage: str):
+    if not METRICS_ENABLED:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        inc("stage_errors_total", stage=stage)
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        observe("stage_seconds", elapsed, stage=stage)
+        trace = current_trace.get()
+        if trace is not None:
+            trace.append((stage, elapsed))
+
+
+class RequestTimer:
+    # One request's in-flight gauge, outcome counter and latency, from creation to finish()
+    def __init__(self, endpoint: str):
+        self.endpoint = endpoint
+        self.trace = []
+        self.started = time.perf_counter()
+        self.finished = False
+        add_gauge("requests_in_flight", 1, endpoint=endpoint)
+
+    def finish(self, outcome: str = "ok"):
+        if self.finished or not METRICS_ENABLED:
+            return
+        self.finished = True
+        elapsed = time.perf_counter() - self.started
+        add_gauge("requests_in_flight", -1, endpoint=self.endpoint)
+        inc("requests_total", endpoint=self.endpoint, outcome=outcome)
+        observe("request_seconds", elapsed, endpoint=self.endpoint)
+        if elapsed > TRACE_SLOW_SECONDS:
+            stages = ", ".join(f"{stage}={seconds * 1000:.0f}ms" for stage, seconds in self.trace)
+            print(f"Slow {self.endpoint} request took {elapsed:.2f}s: {stages}")
+
+
+def start_request(endpoint: str) -> RequestTimer:
+    # For async generators, which may be closed from another context than the
+    # one they started in, so a ContextVar token cannot be reset there. The
+    # trace is set for the calling task and goes away with it.
+    timer = RequestTimer(endpoint)
+    if METRICS_ENABLED:
+        current_trace.set(timer.trace)
+    return timer
+
+
+@contextmanager
+def track_request(endpoint: str):
+    if not METRICS_ENABLED:
+        yield
+        return
+    timer = RequestTimer(endpoint)
+    token = current_trace.set(timer.trace)
+    outcome = "ok"
+    try:
+        yield
+    except Exception:
+        outcome = "error"
+        raise
+    finally:
+        current_trace.reset(token)
+        timer.finish(outcome)
+
+
+def record_usage(response):
+    # Token counts Gemini reports for one call; absent on stubs and errors
+    usage = getattr(response, "usage_metadata", None)
+    if usage is None:
+        return
+    inc("model_tokens_total", usage.prompt_token_count, kind="prompt")
+    inc("model_tokens_total", usage.candidates_token_count, kind="output")
+
+
+def format_labels(labels: LabelKey, extra: Tuple[Tuple[str, str], ...] = ()) -> str:
+    pairs = labels + extra
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in pairs) + "}"
+
+
+def format_value(value) -> str:
+    return str(value) if isinstance(value, int) else repr(float(value))
+
+
+def render() -> str:
+    with metrics_lock:
+        counter_items = sorted(counters.items())
+        gauge_items = sorted(gauges.items())
+        histogram_items = sorted((key, list(values)) for key, values in histograms.items())
+
+    lines = []
+    described = set()
+
+    def describe(name: str):
+        if name in described:
+            return
+        described.add(name)
+        kind, text = METRIC_HELP.get(name, ("gauge", name.replace("_", " ")))
+        lines.append(f"# HELP {METRICS_PREFIX}{name} {text}")
+        lines.append(f"# TYPE {METRICS_PREFIX}{name} {kind}")
+
+    for (name, labels), value in counter_items + gauge_items:
+        describe(name)
+        lines.append(f"{METRICS_PREFIX}{name}{format_labels(labels)} {format_value(value)}")
+
+    for (name, labels), values in histogram_items:
+        describe(name)
+        cumulative = 0
+        for bound, count in zip(LATENCY_BUCKETS + ("+Inf",), values):
+            cumulative += count
+            lines.append(f"{METRICS_PREFIX}{name}_bucket{format_labels(labels, (('le', str(bound)),))} {cumulative}")
+        lines.append(f"{METRICS_PREFIX}{name}_sum{format_labels(labels)} {format_value(values[-2])}")
+        lines.append(f"{METRICS_PREFIX}{name}_count{format_labels(labels)} {values[-1]}")
+
+    # Samples of one metric must be contiguous, so collector output is grouped by metric first
+    collected: Dict[str, List[str]] = {}
+    for name, label, callback in collectors:
+        try:
+            snapshot = callback()
+        except Exception as e:
+            print(f"Metrics collector {name} failed: {e}")
+            continue
+        groups = snapshot.items() if label else [(None, snapshot)]
+        for label_value, stats in groups:
+            labels = ((label, str(label_value)),) if label else ()
+            for stat, value in stats.items():
+                if isinstance(value, (int, float)):
+                    metric = f"{name}_{stat}"
+                    collected.setdefault(metric, []).append(
+                        f"{METRICS_PREFIX}{metric}{format_labels(labels)} {format_value(value)}"
+                    )
+    for metric, samples in collected.items():
+        describe(metric)
+        lines.extend(samples)
+
+    return "\n".join(lines) + "\n"
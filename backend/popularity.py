@@ -0,0 +1,43 @@
+# popularity.py
+# Approximate "most requested lately" ranking in bounded memory. Scores decay
+# exponentially with a configurable half-life, and when the table is full the
+# lowest-scoring key makes room for a new one.
+import math
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+
+class DecayingTopK:
+    def __init__(self, capacity: int, half_life_seconds: float):
+        self.capacity = capacity
+        self.decay = math.log(2) / half_life_seconds
+        self.items: Dict[str, list] = {}  # key -> [score, updated, payload]
+        self.lock = threading.Lock()
+
+    def score_at(self, item: list, now: float) -> float:
+        return item[0] * math.exp(-self.decay * (now - item[1]))
+
+    def add(self, key: str, payload: Any = None, weight: float = 1.0, now: Optional[float] = None):
+        now = time.time() if now is None else now
+        with self.lock:
+            item = self.items.get(key)
+            if item is None:
+                if len(self.items) >= self.capacity:
+                    coldest = min(self.items, key=lambda k: self.score_at(self.items[k], now))
+                    del self.items[coldest]
+                self.items[key] = [weight, now, payload]
+                return
+            item[0] = self.score_at(item, now) + weight
+            item[1] = now
+            item[2] = payload
+
+    def top(self, k: int, now: Optional[float] = None) -> List[Tuple[str, float, Any]]:
+        now = time.time() if now is None else now
+        with self.lock:
+            ranked = [(key, self.score_at(item, now), item[2]) for key, item in self.items.items()]
+        ranked.sort(key=lambda entry: entry[1], reverse=True)
+        return ranked[:k]
+
+    def __len__(self) -> int:
+        return len(self.items)
@@ -0,0 +1,259 @@
+# prewarm.py
+# Background refresh of the destinations the forecast tools are asked about
+# most, so the weather tool answers from warm caches. Each cycle ranks the
+# recently requested destinations (tools.popular_destinations), queues the
+# top PREWARM_TOP_K whose data is missing or about to go stale, and refreshes
+# them within PREWARM_BUDGET_PER_HOUR upstream requests, a budget every worker
+# draws from through Redis:
+#   - geocodes from Nominatim PREWARM_GEOCODE_LEAD_SECONDS before they expire,
+#   - the next 16 days of forecast, batched PREWARM_BATCH_SIZE cells per
+#     Open-Meteo request, PREWARM_FORECAST_LEAD_SECONDS before they expire.
+# Forecast days expire when the next model run is published, and the new run
+# cannot be fetched any earlier. So the scheduler wakes up twice per run: just
+# before the publish time, to carry the current run over until the new one is
+# out, and right after it, to fetch the new run. Every worker warms its own
+# forecast cache.
+import asyncio
+import os
+import time
+import uuid
+from collections import deque
+from datetime import datetime, timedelta
+from typing import List, Optional
+
+from backend import tools
+from backend.gazetteer import lookup_city
+from backend.geocache import get_geocode_cache
+
+
+PREWARM_ENABLED = os.getenv("PREWARM_ENABLED", "true").lower() in ("1", "true", "yes")
+PREWARM_TOP_K = int(os.getenv("PREWARM_TOP_K", "20"))
+PREWARM_BUDGET_PER_HOUR = int(os.getenv("PREWARM_BUDGET_PER_HOUR", "60"))
+PREWARM_INTERVAL_SECONDS = float(os.getenv("PREWARM_INTERVAL_SECONDS", "600"))
+PREWARM_PUBLISH_GRACE_SECONDS = float(os.getenv("PREWARM_PUBLISH_GRACE_SECONDS", "60"))
+PREWARM_GEOCODE_LEAD_SECONDS = float(os.getenv("PREWARM_GEOCODE_LEAD_SECONDS", str(2 * 24 * 3600)))
+PREWARM_FORECAST_LEAD_SECONDS = float(os.getenv("PREWARM_FORECAST_LEAD_SECONDS", "300"))
+PREWARM_BATCH_SIZE = int(os.getenv("PREWARM_BATCH_SIZE", "10"))
+PREWARM_FORECAST_DAYS = 16  # the longest range the weather tools accept
+
+PREWARM_BUDGET_KEY = "prewarm_budget"
+
+# Records one upstream request in a sliding one-hour log shared by every
+# worker, unless ARGV[1] requests were already made in the last hour.
+# Returns {1, used} when recorded, {0, used} when over budget.
+BUDGET_SCRIPT = """
+local clock = redis.call('TIME')
+local now = clock[1] * 1000 + math.floor(clock[2] / 1000)
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now - 3600000)
+local used = redis.call('ZCARD', KEYS[1])
+if used >= tonumber(ARGV[1]) then
+    return {0, used}
+end
+redis.call('ZADD', KEYS[1], now, ARGV[2])
+redis.call('PEXPIRE', KEYS[1], 3600000)
+return {1, used + 1}
+"""
+
+prewarm_stats = {
+    "cycles": 0, "forecasts_refreshed": 0, "geocodes_refreshed": 0,
+    "over_budget": 0, "errors": 0, "budget_used": 0, "last_cycle_seconds": 0.0,
+}
+prewarm_queue: List[dict] = []  # what the current cycle still has to refresh
+destination_status: List[dict] = []  # what the last plan found, for stats and GET /prewarm
+budget_spent: deque = deque()  # this worker's requests in the last hour, while Redis is unreachable
+prewarm_task: Optional[asyncio.Task] = None
+next_cycle_at = 0.0
+redis_client = None  # set by the app once Redis is available
+budget_script = None
+
+
+async def spend() -> bool:
+    global budget_script
+    spent = used = None
+    if redis_client is not None:
+        try:
+            if budget_script is None:
+                budget_script = redis_client.register_script(BUDGET_SCRIPT)
+            spent, used = await budget_script(keys=[PREWARM_BUDGET_KEY], args=[PREWARM_BUDGET_PER_HOUR, uuid.uuid4().hex])
+            spent, used = bool(int(spent)), int(used)
+        except Exception as e:
+            print(f"Pre-warm budget in Redis unavailable, counting for this worker only: {e}")
+    if spent is None:
+        now = time.time()
+        while budget_spent and budget_spent[0] <= now - 3600:
+            budget_spent.popleft()
+        spent = len(budget_spent) < PREWARM_BUDGET_PER_HOUR
+        if spent:
+            budget_spent.append(now)
+        used = len(budget_spent)
+    prewarm_stats["budget_used"] = used
+    if not spent:
+        prewarm_stats["over_budget"] += 1
+    return spent
+
+
+def forecast_window():
+    start = datetime.utcnow().date()
+    return start, start + timedelta(days=PREWARM_FORECAST_DAYS - 1)
+
+
+def expiries(query: str, latitude: float, longitude: float) -> dict:
+    # When each cached piece goes stale; None when it is not cached (or needs no cache)
+    return {
+        "forecast_expires": tools.forecast_expires_at(tools.snap_to_grid(latitude, longitude), *forecast_window()),
+        "geocode_expires": None if lookup_city(query) else get_geocode_cache().expires_at(query),
+    }
+
+
+def seconds_left(expires: Optional[float], now: float) -> Optional[int]:
+    return round(expires - now) if expires else None
+
+
+def survey(now: float) -> List[tuple]:
+    # The top destinations with the expiry of their cached data; also kept for stats and GET /prewarm
+    ranked = []
+    for key, score, destination in tools.popular_destinations.top(PREWARM_TOP_K, now):
+        ranked.append((key, score, destination, expiries(destination["query"], destination["latitude"], destination["longitude"])))
+    destination_status[:] = [{"key": key, "score": round(score, 2), **expires} for key, score, _, expires in ranked]
+    return ranked
+
+
+def plan(now: float) -> List[dict]:
+    queue = []
+    for key, score, destination, expires in survey(now):
+        refresh = []
+        geocode_left = seconds_left(expires["geocode_expires"], now)
+        if geocode_left is not None and geocode_left < PREWARM_GEOCODE_LEAD_SECONDS:
+            refresh.append("geocode")
+        forecast_left = seconds_left(expires["forecast_expires"], now)
+        if forecast_left is None or forecast_left <= PREWARM_FORECAST_LEAD_SECONDS:
+            refresh.append("forecast")
+        if refresh:
+            queue.append({"key": key, "score": round(score, 2), "refresh": refresh, **destination})
+    return queue
+
+
+async def refresh_geocodes(queue: List[dict]):
+    for item in [item for item in queue if "geocode" in item["refresh"]]:
+        if not await spend():
+            return
+        # Shares the request with a user lookup of the same place already in flight
+        location_data = await tools.geocode_deduplicated(item["query"])
+        item["refresh"].remove("geocode")
+        if location_data:
+            prewarm_stats["geocodes_refreshed"] += 1
+            item["latitude"], item["longitude"] = location_data["latitude"], location_data["longitude"]
+
+
+async def refresh_forecasts(queue: List[dict]):
+    start, end = forecast_window()
+    cells = {}
+    for item in queue:
+        if "forecast" in item["refresh"]:
+            cells.setdefault(tools.snap_to_grid(item["latitude"], item["longitude"]), []).append(item)
+
+    pending = list(cells)
+    for i in range(0, len(pending), PREWARM_BATCH_SIZE):
+        batch = pending[i:i + PREWARM_BATCH_SIZE]
+        if not await spend():
+            return
+        now = time.time()
+        expires_at = tools.forecast_expiry(now)
+        if expires_at - now <= PREWARM_FORECAST_LEAD_SECONDS:
+            # Just before a publish: keep this run until the cycle after the new one is out
+            expires_at += PREWARM_PUBLISH_GRACE_SECONDS + PREWARM_FORECAST_LEAD_SECONDS
+        await asyncio.to_thread(tools.fetch_cells, {cell: (start, end) for cell in batch}, now, expires_at)
+        prewarm_stats["forecasts_refreshed"] += len(batch)
+        for cell in batch:
+            for item in cells[cell]:
+                item["refresh"].remove("forecast")
+
+
+async def run_cycle():
+    started = time.time()
+    # Surveying reads the geocode cache's SQLite file, so it stays off the event loop
+    prewarm_queue[:] = await asyncio.to_thread(plan, started)
+    try:
+        await refresh_geocodes(prewarm_queue)
+        await refresh_forecasts(prewarm_queue)
+    finally:
+        # Whatever is left waits for the next cycle (out of budget or failed)
+        prewarm_queue[:] = [item for item in prewarm_queue if item["refresh"]]
+        await asyncio.to_thread(survey, time.time())
+        prewarm_stats["cycles"] += 1
+        prewarm_stats["last_cycle_seconds"] = round(time.time() - started, 3)
+
+
+def next_wake(now: float) -> float:
+    # The regular interval, or the next pre-publish or post-publish cycle if that is sooner
+    publish = tools.forecast_expiry(now)
+    cadence = tools.FORECAST_UPDATE_HOURS * 3600
+    wakes = [
+        publish - cadence + PREWARM_PUBLISH_GRACE_SECONDS,
+        publish - PREWARM_FORECAST_LEAD_SECONDS,
+        publish + PREWARM_PUBLISH_GRACE_SECONDS,
+    ]
+    soonest = min(wake for wake in wakes if wake > now + 1.0)
+    return max(1.0, min(PREWARM_INTERVAL_SECONDS, soonest - now))
+
+
+async def run_scheduler():
+    global next_cycle_at
+    while True:
+        try:
+            await run_cycle()
+        except Exception as e:
+            prewarm_stats["errors"] += 1
+            print(f"Forecast pre-warm cycle failed: {e}")
+        wait = next_wake(time.time())
+        next_cycle_at = time.time() + wait
+        await asyncio.sleep(wait)
+
+
+def start():
+    global prewarm_task
+    if PREWARM_ENABLED and prewarm_task is None:
+        prewarm_task = asyncio.create_task(run_scheduler())
+
+
+async def stop():
+    global prewarm_task
+    if prewarm_task is not None:
+        prewarm_task.cancel()
+        try:
+            await prewarm_task
+        except asyncio.CancelledError:
+            pass
+        prewarm_task = None
+
+
+def stats() -> dict:
+    # From the last plan; recomputing freshness here would query the caches on every scrape
+    now = time.time()
+    result = dict(prewarm_stats)
+    result["queue_length"] = len(prewarm_queue)
+    result["budget_per_hour"] = PREWARM_BUDGET_PER_HOUR
+    result["tracked_destinations"] = len(tools.popular_destinations)
+    result["warm_destinations"] = sum(
+        1 for destination in destination_status if (destination["forecast_expires"] or 0) > now
+    )
+    return result
+
+
+def status() -> dict:
+    # Everything the scheduler knows as of its last cycle, for GET /prewarm
+    now = time.time()
+    return {
+        "enabled": PREWARM_ENABLED,
+        "stats": stats(),
+        "next_cycle_in_seconds": round(next_cycle_at - now) if prewarm_task is not None else None,
+        "queue": [{key: item[key] for key in ("key", "score", "refresh")} for item in prewarm_queue],
+        "destinations": [
+            {
+                "key": destination["key"], "score": destination["score"],
+                "forecast_fresh_seconds": seconds_left(destination["forecast_expires"], now),
+                "geocode_fresh_seconds": seconds_left(destination["geocode_expires"], now),
+            }
+            for destination in destination_status
+        ],
+    }
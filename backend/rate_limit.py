@@ -0,0 +1,125 @@
+# rate_limit.py
+# Token buckets shared by every worker through Redis. acquire() is for
+# upstreams with a global rate limit (Nominatim allows one request per second
+# per application): it reserves a token and awaits until it is due, so waiting
+# callers never hold a thread or a lock. try_acquire() is for limiting clients:
+# one bucket per key, and no waiting, just how long until a token is free.
+# While Redis is unreachable the buckets fall back to in-process ones and
+# retry Redis after a cooldown.
+import asyncio
+import os
+import time
+from typing import Tuple
+
+from cachetools import LRUCache
+
+from backend import metrics
+
+
+RATE_LIMIT_PREFIX = "rate_limit:"
+RATE_LIMIT_REDIS_RETRY_SECONDS = float(os.getenv("RATE_LIMIT_REDIS_RETRY_SECONDS", "30"))
+RATE_LIMIT_LOCAL_KEYS = int(os.getenv("RATE_LIMIT_LOCAL_KEYS", "10000"))
+
+# Reserves one token unless the caller would have to wait longer than
+# max_wait_ms for it. Returns {1, wait_ms} when reserved, {0, wait_ms} when not.
+# Tokens may go negative: each reservation queues behind the earlier ones.
+# Uses the Redis clock so workers with skewed clocks still agree.
+TOKEN_BUCKET_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local max_wait_ms = tonumber(ARGV[3])
+local clock = redis.call('TIME')
+local now = clock[1] * 1000 + math.floor(clock[2] / 1000)
+
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(state[1]) or capacity
+local updated = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + (now - updated) * rate / 1000)
+
+local wait_ms = 0
+if tokens < 1 then
+    wait_ms = math.ceil((1 - tokens) * 1000 / rate)
+end
+if wait_ms > max_wait_ms then
+    return {0, wait_ms}
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens - 1, 'updated', now)
+redis.call('PEXPIRE', KEYS[1], math.ceil(capacity * 1000 / rate) + wait_ms + 1000)
+return {1, wait_ms}
+"""
+
+
+class RateLimited(Exception):
+    pass
+
+
+class TokenBucket:
+    def __init__(self, name: str, rate: float, capacity: float = 1.0, max_wait: float = 20.0):
+        self.name = name
+        self.rate = rate  # tokens per second
+        self.capacity = capacity
+        self.max_wait = max_wait
+        self.redis_client = None  # set by the app once Redis is available
+        self.script = None
+        self.redis_retry_at = 0.0
+
+        self.local = LRUCache(maxsize=RATE_LIMIT_LOCAL_KEYS)  # key -> (tokens, updated)
+        self.counters = {"acquired": 0, "waited": 0, "wait_seconds": 0.0, "max_wait_seconds": 0.0, "rejected": 0, "local_fallbacks": 0}
+
+    async def acquire(self):
+        reserved, wait = await self.reserve("", self.max_wait)
+        if not reserved:
+            self.counters["rejected"] += 1
+            raise RateLimited(f"{self.name} is busy, no slot within {self.max_wait:.0f}s")
+
+        self.counters["acquired"] += 1
+        metrics.observe("rate_limit_wait_seconds", wait, limiter=self.name)
+        if wait > 0:
+            self.counters["waited"] += 1
+            self.counters["wait_seconds"] += wait
+            self.counters["max_wait_seconds"] = max(self.counters["max_wait_seconds"], wait)
+            await asyncio.sleep(wait)
+
+    async def try_acquire(self, key: str) -> float:
+        # Takes a token from key's bucket if one is free now: 0.0 when taken,
+        # otherwise the seconds until one will be (for Retry-After)
+        reserved, wait = await self.reserve(key, 0.0)
+        if not reserved:
+            self.counters["rejected"] += 1
+            return max(wait, 0.001)
+        self.counters["acquired"] += 1
+        return 0.0
+
+    async def reserve(self, key: str, max_wait: float) -> Tuple[bool, float]:
+        # Whether a token was reserved, and the seconds until it is (or would be) due
+        if self.redis_client is not None and time.monotonic() >= self.redis_retry_at:
+            try:
+                if self.script is None:
+                    self.script = self.redis_client.register_script(TOKEN_BUCKET_SCRIPT)
+                reserved, wait_ms = await self.script(
+                    keys=[RATE_LIMIT_PREFIX + self.name + (":" + key if key else "")],
+                    args=[self.rate, self.capacity, int(max_wait * 1000)],
+                )
+                return bool(int(reserved)), int(wait_ms) / 1000
+            except Exception as e:
+                print(f"Rate limiter {self.name} falling back to local bucket: {e}")
+                self.redis_retry_at = time.monotonic() + RATE_LIMIT_REDIS_RETRY_SECONDS
+        self.counters["local_fallbacks"] += 1
+        return self.reserve_local(key, max_wait)
+
+    def reserve_local(self, key: str, max_wait: float) -> Tuple[bool, float]:
+        # Same algorithm as the Lua script; no await in here, so it is atomic on the event loop
+        now = time.monotonic()
+        tokens, updated = self.local.get(key, (self.capacity, now))
+        tokens = min(self.capacity, tokens + (now - updated) * self.rate)
+        wait = max(0.0, (1 - tokens) / self.rate)
+        if wait > max_wait:
+            return False, wait
+        self.local[key] = (tokens - 1, now)
+        return True, wait
+
+    def stats(self) -> dict:
+        stats = dict(self.counters)
+        stats["avg_wait_seconds"] = round(stats["wait_seconds"] / stats["waited"], 3) if stats["waited"] else 0.0
+        stats["using_redis"] = int(self.redis_client is not None and time.monotonic() >= self.redis_retry_at)
+        return stats
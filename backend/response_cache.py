@@ -0,0 +1,173 @@
+# response_cache.py
+# Opt-in cache of model replies for repeated questions. An exact-match tier
+# lives in Redis and is shared by all workers; a per-worker embedding index
+# also catches rephrasings of questions asked without prior history.
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from typing import Awaitable, Callable, List, Optional
+
+import numpy as np
+from cachetools import LRUCache
+
+from backend.history import entry_text
+
+
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "false").lower() in ("1", "true", "yes")
+RESPONSE_CACHE_PREFIX = "response_cache:"
+RESPONSE_CACHE_TTL_SECONDS = int(os.getenv("RESPONSE_CACHE_TTL_SECONDS", str(24 * 3600)))
+# Replies that used tools (weather) are time-sensitive; 0 means never cache them
+RESPONSE_CACHE_TOOL_TTL_SECONDS = int(os.getenv("RESPONSE_CACHE_TOOL_TTL_SECONDS", "0"))
+# Turns with more history than this bypass the cache
+RESPONSE_CACHE_MAX_HISTORY = int(os.getenv("RESPONSE_CACHE_MAX_HISTORY", "2"))
+RESPONSE_CACHE_SIMILARITY = float(os.getenv("RESPONSE_CACHE_SIMILARITY", "0.93"))
+RESPONSE_CACHE_INDEX_SIZE = int(os.getenv("RESPONSE_CACHE_INDEX_SIZE", "5000"))
+
+Embedder = Callable[[str], Awaitable[List[float]]]
+
+response_cache_stats = {
+    "lookups": 0,
+    "exact_hits": 0,
+    "semantic_hits": 0,
+    "misses": 0,
+    "bypassed": 0,
+    "stores": 0,
+    "errors": 0,
+    "lookup_seconds": 0.0,
+}
+
+
+def normalize_prompt(text: str) -> str:
+    text = re.sub(r"\s+", " ", text.casefold()).strip()
+    return text.rstrip("?!. ")
+
+
+def fingerprint(*parts) -> str:
+    # Identifies the system prompt and generation config a reply was produced with
+    return hashlib.sha256(json.dumps([str(part) for part in parts]).encode()).hexdigest()[:16]
+
+
+def cache_key(message: str, history: List[dict], config_fingerprint: str) -> str:
+    payload = json.dumps({
+        "message": normalize_prompt(message),
+        "history": [[entry.get("role"), normalize_prompt(entry_text(entry))] for entry in history],
+        "config": config_fingerprint,
+    })
+    return RESPONSE_CACHE_PREFIX + hashlib.sha256(payload.encode()).hexdigest()
+
+
+class SemanticIndex:
+    # Unit vectors in a fixed-size ring buffer; search is one matrix-vector product
+    def __init__(self, size: int = RESPONSE_CACHE_INDEX_SIZE):
+        self.size = size
+        self.vectors: Optional[np.ndarray] = None
+        self.keys: List[Optional[str]] = [None] * size
+        self.expires_at = np.zeros(size)
+        self.next_slot = 0
+        self.lock = threading.Lock()
+
+    def add(self, vector: List[float], key: str, expires_at: float):
+        vector = np.asarray(vector, dtype=np.float32)
+        vector /= np.linalg.norm(vector) or 1.0
+        with self.lock:
+            if self.vectors is None:
+                self.vectors = np.zeros((self.size, vector.shape[0]), dtype=np.float32)
+            slot = self.next_slot
+            self.vectors[slot] = vector
+            self.keys[slot] = key
+            self.expires_at[slot] = expires_at
+            self.next_slot = (slot + 1) % self.size
+
+    def search(self, vector: List[float], threshold: float) -> Optional[str]:
+        with self.lock:
+            if self.vectors is None:
+                return None
+            vector = np.asarray(vector, dtype=np.float32)
+            vector /= np.linalg.norm(vector) or 1.0
+            scores = self.vectors @ vector
+            scores[self.expires_at <= time.time()] = -1.0
+            best = int(scores.argmax())
+            if scores[best] >= threshold:
+                return self.keys[best]
+        return None
+
+
+semantic_index = SemanticIndex()
+# A miss embeds the prompt on lookup and again on store; remember it in between
+_recent_embeddings = LRUCache(maxsize=1024)
+
+
+async def embed_prompt(embed: Embedder, message: str) -> List[float]:
+    text = normalize_prompt(message)
+    vector = _recent_embeddings.get(text)
+    if vector is None:
+        vector = await embed(text)
+        _recent_embeddings[text] = vector
+    return vector
+
+
+def is_cacheable(history: List[dict]) -> bool:
+    return RESPONSE_CACHE_ENABLED and len(history) <= RESPONSE_CACHE_MAX_HISTORY
+
+
+async def lookup(redis_client, message: str, history: List[dict], config_fingerprint: str,
+                 embed: Optional[Embedder] = None) -> Optional[str]:
+    if not is_cacheable(history):
+        response_cache_stats["bypassed"] += 1
+        return None
+    started = time.perf_counter()
+    response_cache_stats["lookups"] += 1
+    try:
+        reply = await redis_client.get(cache_key(message, history, config_fingerprint))
+        if reply is not None:
+            response_cache_stats["exact_hits"] += 1
+            return reply
+
+        # Rephrasings only match for first-turn questions, where no history shapes the answer
+        if embed is not None and not history:
+            key = semantic_index.search(await embed_prompt(embed, message), RESPONSE_CACHE_SIMILARITY)
+            if key:
+                reply = await redis_client.get(key)
+                if reply is not None:
+                    response_cache_stats["semantic_hits"] += 1
+                    return reply
+
+        response_cache_stats["misses"] += 1
+        return None
+    except Exception as e:
+        # The cache is optional; a Redis or embedding failure is just a miss
+        print(f"Response cache lookup failed: {e}")
+        response_cache_stats["errors"] += 1
+        response_cache_stats["misses"] += 1
+        return None
+    finally:
+        response_cache_stats["lookup_seconds"] += time.perf_counter() - started
+
+
+async def store(redis_client, message: str, history: List[dict], config_fingerprint: str, reply: str,
+                used_tools: bool = False, embed: Optional[Embedder] = None):
+    if not is_cacheable(history) or not reply:
+        return
+    ttl = RESPONSE_CACHE_TOOL_TTL_SECONDS if used_tools else RESPONSE_CACHE_TTL_SECONDS
+    if ttl <= 0:
+        return
+    key = cache_key(message, history, config_fingerprint)
+    try:
+        await redis_client.setex(key, ttl, reply)
+        response_cache_stats["stores"] += 1
+        if embed is not None and not history:
+            semantic_index.add(await embed_prompt(embed, message), key, time.time() + ttl)
+    except Exception as e:
+        print(f"Response cache store failed: {e}")
+        response_cache_stats["errors"] += 1
+
+
+def stats() -> dict:
+    result = dict(response_cache_stats)
+    hits = result["exact_hits"] + result["semantic_hits"]
+    result["hit_ratio"] = round(hits / result["lookups"], 3) if result["lookups"] else 0.0
+    result["avg_lookup_ms"] = round(result["lookup_seconds"] / result["lookups"] * 1000, 2) if result["lookups"] else 0.0
+    return result
@@ -0,0 +1,84 @@
+# session_cache.py
+# Live chat sessions kept in this worker between turns, so an active
+# conversation does not re-read, decode and convert its history every turn.
+# Each entry remembers the history version (a counter bumped in Redis on every
+# append and summary refresh) it was built from, and is only reused while the
+# stored version still matches. Turns of a session are serialized by
+# session_guard, so an entry is taken out for the turn and put back after the
+# turn has been saved; a failed turn simply leaves it out.
+import os
+import socket
+from dataclasses import dataclass
+from typing import Any, Optional
+
+from cachetools import TTLCache
+
+from backend.history import get_history_version
+
+
+SESSION_CACHE_SIZE = int(os.getenv("SESSION_CACHE_SIZE", "512"))
+SESSION_CACHE_TTL_SECONDS = float(os.getenv("SESSION_CACHE_TTL_SECONDS", "900"))
+
+# Set SESSION_AFFINITY=true to tag responses with the worker that holds the
+# session, for a load balancer that routes on it (e.g. nginx `hash $http_...`)
+SESSION_AFFINITY = os.getenv("SESSION_AFFINITY", "false").lower() in ("1", "true", "yes")
+SESSION_AFFINITY_HEADER = "X-Wanderbot-Worker"
+WORKER_ID = os.getenv("WORKER_ID") or f"{socket.gethostname()}-{os.getpid()}"
+
+session_cache_stats = {"hits": 0, "misses": 0, "stale": 0, "over_budget": 0, "stores": 0}
+
+
+@dataclass
+class LiveSession:
+    chat: Any  # the model's ChatSession, history already converted
+    version: int  # history version this chat matches
+    tokens: int  # estimated prompt tokens of chat.history
+    size_bytes: int
+
+
+sessions: TTLCache = TTLCache(maxsize=SESSION_CACHE_SIZE, ttl=SESSION_CACHE_TTL_SECONDS)
+
+
+def history_size(chat) -> int:
+    # Serialized size of the converted history; the objects in memory are a small multiple of it
+    return sum(type(content).pb(content).ByteSize() for content in chat.history)
+
+
+async def checkout(redis_client, session_id: str) -> Optional[LiveSession]:
+    # Takes the session out of the cache if it is still current; None means rebuild from Redis
+    live = sessions.pop(session_id, None)
+    if live is None:
+        session_cache_stats["misses"] += 1
+        return None
+    if await get_history_version(redis_client, session_id) != live.version:
+        # Another worker answered a turn, or the summary moved on, since this was cached
+        session_cache_stats["stale"] += 1
+        return None
+    session_cache_stats["hits"] += 1
+    return live
+
+
+def store(session_id: str, chat, version: Optional[int], tokens: int, token_budget: int):
+    if version is None or SESSION_CACHE_SIZE <= 0:
+        return
+    if tokens > token_budget:
+        # Let the next turn go through build_context, which trims to the budget
+        session_cache_stats["over_budget"] += 1
+        return
+    sessions[session_id] = LiveSession(chat, version, tokens, history_size(chat))
+    session_cache_stats["stores"] += 1
+
+
+def clear():
+    sessions.clear()
+
+
+def stats() -> dict:
+    result = dict(session_cache_stats)
+    lookups = result["hits"] + result["misses"] + result["stale"]
+    result["hit_ratio"] = round(result["hits"] / lookups, 3) if lookups else 0.0
+    sessions.expire()
+    live = list(sessions.values())
+    result["entries"] = len(live)
+    result["history_bytes"] = sum(session.size_bytes for session in live)
+    return result
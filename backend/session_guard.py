@@ -0,0 +1,142 @@
+# session_guard.py
+# Keeps turns of one conversation from racing each other. A Redis lock
+# serializes turns per session across workers, and identical messages already
+# in flight in this worker share one model call: coalesce() for /chat,
+# coalesce_stream() for /chat/stream, where every copy gets the same events.
+# A message repeated after its turn finished is a new turn: users do send
+# "yes" twice on purpose.
+import asyncio
+import hashlib
+import os
+import time
+import uuid
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Awaitable, Callable, Dict, List
+
+from redis.exceptions import WatchError
+
+from backend.response_cache import normalize_prompt
+
+
+SESSION_LOCK_PREFIX = "chat_lock:"
+# Longer than a turn can take: model calls plus MAX_TOOL_ROUNDS of tool timeouts
+SESSION_LOCK_TTL_MS = int(os.getenv("SESSION_LOCK_TTL_MS", "180000"))
+SESSION_LOCK_WAIT_SECONDS = float(os.getenv("SESSION_LOCK_WAIT_SECONDS", "60"))
+
+session_guard_stats = {"lock_waits": 0, "lock_wait_seconds": 0.0, "lock_timeouts": 0, "coalesced": 0}
+
+_in_flight: Dict[tuple, asyncio.Task] = {}
+_in_flight_streams: Dict[tuple, "SharedStream"] = {}
+
+
+class SessionBusy(Exception):
+    pass
+
+
+async def release_lock(redis_client, key: str, token: str):
+    # Only delete the lock if it is still ours; it may have expired and been taken
+    async with redis_client.pipeline(transaction=True) as pipe:
+        try:
+            await pipe.watch(key)
+            if await pipe.get(key) == token:
+                pipe.multi()
+                pipe.delete(key)
+                await pipe.execute()
+        except WatchError:
+            pass
+
+
+@asynccontextmanager
+async def session_turn(redis_client, session_id: str):
+    key = SESSION_LOCK_PREFIX + session_id
+    token = uuid.uuid4().hex
+    started = time.monotonic()
+    delay = 0.01
+    while not await redis_client.set(key, token, nx=True, px=SESSION_LOCK_TTL_MS):
+        if time.monotonic() - started > SESSION_LOCK_WAIT_SECONDS:
+            session_guard_stats["lock_timeouts"] += 1
+            raise SessionBusy(session_id)
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, 0.25)
+    if delay > 0.01:
+        session_guard_stats["lock_waits"] += 1
+        session_guard_stats["lock_wait_seconds"] += time.monotonic() - started
+    try:
+        yield
+    finally:
+        await release_lock(redis_client, key, token)
+
+
+def message_hash(message: str) -> str:
+    return hashlib.sha256(normalize_prompt(message).encode()).hexdigest()
+
+
+async def coalesce(session_id: str, message: str, compute: Callable[[], Awaitable]):
+    # Identical (session, message) pairs already running in this worker share one result
+    key = (session_id, message_hash(message))
+    task = _in_flight.get(key)
+    if task is not None:
+        session_guard_stats["coalesced"] += 1
+    else:
+        task = asyncio.ensure_future(compute())
+        _in_flight[key] = task
+        task.add_done_callback(lambda _: _in_flight.pop(key, None))
+    # shield: one caller disconnecting must not cancel the shared turn
+    return await asyncio.shield(task)
+
+
+class SharedStream:
+    # One streamed turn, run by its own task and read by every identical
+    # request. Readers that join late replay the events from the start.
+    def __init__(self):
+        self.events: List[str] = []
+        self.done = False
+        self.changed = asyncio.Condition()
+        # Resolves once the turn may start (lock and model slot held), or with why it may not
+        self.admitted = asyncio.get_running_loop().create_future()
+
+    async def run(self, open_turn: Callable[[], Awaitable], produce: Callable[..., AsyncIterator[str]]):
+        try:
+            try:
+                turn = await open_turn()
+            except BaseException as e:
+                self.admitted.set_exception(e)
+                return
+            self.admitted.set_result(None)
+            async for event in produce(turn):
+                async with self.changed:
+                    self.events.append(event)
+                    self.changed.notify_all()
+        finally:
+            async with self.changed:
+                self.done = True
+                self.changed.notify_all()
+
+    async def follow(self) -> AsyncIterator[str]:
+        i = 0
+        while True:
+            while i < len(self.events):
+                yield self.events[i]
+                i += 1
+            if self.done:
+                return
+            async with self.changed:
+                await self.changed.wait_for(lambda: self.done or len(self.events) > i)
+
+
+async def coalesce_stream(session_id: str, message: str, open_turn: Callable[[], Awaitable],
+                          produce: Callable[..., AsyncIterator[str]]) -> SharedStream:
+    # The stream for this (session, message), starting one if none is in flight.
+    # open_turn() takes the lock and whatever else the turn needs and may raise;
+    # produce(turn) yields the events. Raises what open_turn raised.
+    key = (session_id, message_hash(message))
+    stream = _in_flight_streams.get(key)
+    if stream is not None:
+        session_guard_stats["coalesced"] += 1
+    else:
+        stream = _in_flight_streams[key] = SharedStream()
+        # Its own task: the turn finishes and is stored even if every reader goes away
+        task = asyncio.ensure_future(stream.run(open_turn, produce))
+        task.add_done_callback(lambda _: _in_flight_streams.pop(key, None))
+    await asyncio.shield(stream.admitted)
+    return stream
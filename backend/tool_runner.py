@@ -0,0 +1,125 @@
+# tool_runner.py
+# Runs the function calls the model asks for. All calls from one model turn
+# run concurrently, each with its own timeout, and come back as
+# function_response parts in call order. Coroutine tools run on the event
+# loop and hand their blocking I/O (HTTP, SQLite, index loads) to
+# run_blocking(); plain functions run whole on the same bounded pool, so
+# TOOL_WORKERS caps both.
+import asyncio
+import contextvars
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Callable, Dict, List, Optional
+
+import google.ai.generativelanguage as glm
+
+
+TOOL_WORKERS = int(os.getenv("TOOL_WORKERS", "16"))
+TOOL_TIMEOUT_SECONDS = float(os.getenv("TOOL_TIMEOUT_SECONDS", "30"))
+# Per-tool overrides, e.g. a batch call covers several cities
+TOOL_TIMEOUTS = {
+    "get_weather_forecast_batch": 60.0,
+}
+SLOW_TOOL_SECONDS = float(os.getenv("SLOW_TOOL_SECONDS", "5"))
+
+# Started on first use (or by the app's lifespan), not at import
+_tool_executor: Optional[ThreadPoolExecutor] = None
+_tool_executor_lock = threading.Lock()
+
+tool_stats: Dict[str, dict] = {}
+tool_stats_lock = threading.Lock()
+
+
+def get_tool_executor() -> ThreadPoolExecutor:
+    global _tool_executor
+    if _tool_executor is None:
+        with _tool_executor_lock:
+            if _tool_executor is None:
+                _tool_executor = ThreadPoolExecutor(max_workers=TOOL_WORKERS, thread_name_prefix="tool")
+    return _tool_executor
+
+
+async def run_blocking(func: Callable, *args):
+    # Context copied so spans inside func land in the calling request's trace
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_tool_executor(), contextvars.copy_context().run, partial(func, *args))
+
+
+def record_tool_call(name: str, seconds: float, outcome: str):
+    with tool_stats_lock:
+        stats = tool_stats.setdefault(
+            name, {"calls": 0, "errors": 0, "timeouts": 0, "total_seconds": 0.0, "max_seconds": 0.0}
+        )
+        stats["calls"] += 1
+        stats["total_seconds"] += seconds
+        stats["max_seconds"] = max(stats["max_seconds"], seconds)
+        if outcome == "error":
+            stats["errors"] += 1
+        elif outcome == "timeout":
+            stats["timeouts"] += 1
+    if seconds > SLOW_TOOL_SECONDS:
+        print(f"Slow tool call: {name} took {seconds:.2f}s ({outcome})")
+
+
+def function_calls(response) -> List[glm.FunctionCall]:
+    if not response.candidates:
+        return []
+    return [part.function_call for part in response.candidates[0].content.parts if part.function_call]
+
+
+async def run_tool(function_call: glm.FunctionCall, tools: Dict[str, Callable]) -> glm.Part:
+    tool_name = function_call.name
+    tool_args = {k: v for k, v in function_call.args.items()}
+    print(f"Tool Call Detected: {tool_name} with args: {tool_args}")
+
+    if tool_name not in tools:
+        tool_output = {"error": f"Wanderbot doesn't have a tool to perform '{tool_name}'."}
+    else:
+        timeout = TOOL_TIMEOUTS.get(tool_name, TOOL_TIMEOUT_SECONDS)
+        started = time.perf_counter()
+        outcome = "ok"
+        tool = tools[tool_name]
+        if asyncio.iscoroutinefunction(tool):
+            call = tool(**tool_args)
+        else:
+            call = run_blocking(partial(tool, **tool_args))
+        try:
+            tool_output = await asyncio.wait_for(call, timeout)
+        except asyncio.TimeoutError:
+            outcome = "timeout"
+            tool_output = {"error": f"'{tool_name}' took longer than {timeout:.0f} seconds. Please try again."}
+        except Exception as e:
+            outcome = "error"
+            tool_output = {"error": f"'{tool_name}' failed: {e}"}
+        record_tool_call(tool_name, time.perf_counter() - started, outcome)
+
+    print(f"Tool Output: {tool_output}")
+    return glm.Part(function_response=glm.FunctionResponse(name=tool_name, response=tool_output))
+
+
+async def run_tools(calls: List[glm.FunctionCall], tools: Dict[str, Callable]) -> List[glm.Part]:
+    return list(await asyncio.gather(*(run_tool(call, tools) for call in calls)))
+
+
+def skip_tools(calls: List[glm.FunctionCall], reason: str) -> List[glm.Part]:
+    # Every function_call needs a function_response, even the ones that are not run
+    return [
+        glm.Part(function_response=glm.FunctionResponse(name=call.name, response={"error": reason}))
+        for call in calls
+    ]
+
+
+def drop_pending_calls(chat, reply: str):
+    # Last resort before saving: a model turn ending in unanswered function calls
+    # would make the stored history invalid for every later turn. The calls are
+    # replaced by the reply the user is shown.
+    if not chat.history or chat.history[-1].role != "model":
+        return
+    last = chat.history[-1]
+    parts = [part for part in last.parts if not part.function_call]
+    if len(parts) == len(last.parts):
+        return
+    chat.history = chat.history[:-1] + [glm.Content(role="model", parts=parts or [glm.Part(text=reply)])]
@@ -1,20 +1,52 @@
 # tools.py
-import openmeteo_requests
-import pandas as pd
-import requests_cache
-from retry_requests import retry
-from datetime import datetime, timedelta
+import numpy as np
+from datetime import date, datetime, timedelta
+import asyncio
 import json
-from functools import partial
-from typing import Optional
+import os
+import threading
+import time
+from typing import Dict, List, Optional
+from cachetools import LRUCache
 from geopy.geocoders import Nominatim
-from geopy.extra.rate_limiter import RateLimiter
 from geopy.exc import GeocoderTimedOut, GeocoderServiceError
+from backend.geocache import MISS, get_geocode_cache, normalize_query
+from backend.gazetteer import lookup_city
+from backend.popularity import DecayingTopK
+from backend.rate_limit import RateLimited, TokenBucket
+from backend.tool_runner import run_blocking
+from backend.weather_client import get_weather_client
+from backend import metrics
 
 
 geolocator = Nominatim(user_agent="Wanderbot") 
 
-geocode_city = RateLimiter(geolocator.geocode, min_delay_seconds=1.1, swallow_exceptions=True, return_value_on_exception=None)
+# Nominatim's policy is at most one request per second for the whole app, so
+# the bucket is shared by all workers through Redis (wired up in backend.main)
+NOMINATIM_RATE = float(os.getenv("NOMINATIM_RATE", "0.9"))
+GEOCODE_MAX_WAIT_SECONDS = float(os.getenv("GEOCODE_MAX_WAIT_SECONDS", "20"))
+geocode_limiter = TokenBucket("nominatim", rate=NOMINATIM_RATE, max_wait=GEOCODE_MAX_WAIT_SECONDS)
+
+# Lookups currently waiting on Nominatim, so identical concurrent queries share one request
+geocode_in_flight: Dict[str, asyncio.Future] = {}
+geocode_stats = {"upstream_calls": 0, "deduplicated": 0}
+
+
+# Forecast cache: one entry per (grid cell, local day), so overlapping date
+# ranges and nearby coordinates share upstream data.
+FORECAST_GRID_DEGREES = float(os.getenv("FORECAST_GRID_DEGREES", "0.1"))  # about 11 km
+FORECAST_UPDATE_HOURS = int(os.getenv("FORECAST_UPDATE_HOURS", "3"))  # how often the forecast model reruns
+FORECAST_PUBLISH_DELAY_SECONDS = int(os.getenv("FORECAST_PUBLISH_DELAY_SECONDS", "1800"))
+HOURLY_VARIABLES = ["temperature_2m", "weather_code", "precipitation", "precipitation_probability", "wind_speed_10m"]
+
+forecast_cache = LRUCache(maxsize=int(os.getenv("FORECAST_CACHE_SIZE", "20000")))
+forecast_cache_lock = threading.Lock()
+forecast_cache_stats = {"day_hits": 0, "day_misses": 0, "upstream_calls": 0}
+
+# Destinations the forecast tools were asked about lately, ranked for backend.prewarm
+PREWARM_TRACKED = int(os.getenv("PREWARM_TRACKED", "256"))
+PREWARM_HALF_LIFE_SECONDS = float(os.getenv("PREWARM_HALF_LIFE_SECONDS", str(6 * 3600)))
+popular_destinations = DecayingTopK(PREWARM_TRACKED, PREWARM_HALF_LIFE_SECONDS)
 
 def recursively_convert_to_dict(obj):
     if isinstance(obj, dict):
@@ -28,17 +60,67 @@ def recursively_convert_to_dict(obj):
 
 
 
+def lookup_known(city_name: str):
+    # Offline index, then the geocode cache: a dict, None for a cached "not found", or MISS.
+    # Blocking (the index loads on first use, the cache reads SQLite), so run off the event loop.
+    try:
+        location_data = lookup_city(city_name)
+        if location_data:
+            return location_data
+    except Exception as e:
+        print(f"Gazetteer lookup failed for '{city_name}': {e}")
+    return get_geocode_cache().get(city_name)
+
+
 # Geocoding Function 
-def get_coordinates_from_city(city_name: str) -> Optional[dict]:
+async def get_coordinates_from_city(city_name: str) -> Optional[dict]:
+    # Offline index first; Nominatim (through the cache) only for places it does not know
+    cached = await run_blocking(lookup_known, city_name)
+    if cached is not MISS:
+        return dict(cached) if cached else None
+
+    result = await geocode_deduplicated(city_name)
+    return dict(result) if result else None
+
+
+async def geocode_deduplicated(city_name: str) -> Optional[dict]:
+    # Nominatim, bypassing the cache; identical lookups in flight at the same time share one request
+    key = normalize_query(city_name)
+    pending = geocode_in_flight.get(key)
+    if pending is not None:
+        geocode_stats["deduplicated"] += 1
+        return await asyncio.shield(pending)
+
+    pending = geocode_in_flight[key] = asyncio.get_running_loop().create_future()
+    result = None
+    try:
+        result = await geocode_upstream(city_name)
+    finally:
+        # Waiters get None when this lookup failed or was cancelled, as a failed lookup would
+        pending.set_result(result)
+        del geocode_in_flight[key]
+    return result
+
+
+async def geocode_upstream(city_name: str) -> Optional[dict]:
     try:
-        location = geocode_city(city_name)
+        await geocode_limiter.acquire()
+        geocode_stats["upstream_calls"] += 1
+        with metrics.span("geocode"):
+            location = await run_blocking(geolocator.geocode, city_name)
+        result = None
         if location:
-            return {
+            result = {
                 "latitude": location.latitude,
                 "longitude": location.longitude,
                 "name": location.address.split(',')[0].strip(), 
                 "full_address": location.address,
             }
+        # Only answers are cached, never failures, so an outage is not remembered as "not found"
+        await run_blocking(get_geocode_cache().set, city_name, result)
+        return result
+    except RateLimited as e:
+        print(f"Geocoding skipped for '{city_name}': {e}")
         return None
     except (GeocoderTimedOut, GeocoderServiceError) as e:
         print(f"Geocoding error for '{city_name}': {e}")
@@ -48,20 +130,242 @@ def get_coordinates_from_city(city_name: str) -> Optional[dict]:
         return None
 
 
-# get_weather_forecast with geocoding integration
-def get_weather_forecast(city: str, country: str, start_date: str, end_date: str) -> dict:
-    full_location = f"{city}, {country}"
-    location_data = get_coordinates_from_city(full_location)
+def geocode_summary() -> dict:
+    stats = dict(geocode_stats)
+    stats["in_flight"] = len(geocode_in_flight)
+    return stats
 
 
-    if not location_data:
-        return {"error": f"Could not find geographic coordinates for '{city}'. Please check the city name or provide a more specific location."}
+def forecast_stats() -> dict:
+    with forecast_cache_lock:
+        stats = dict(forecast_cache_stats)
+        stats["entries"] = len(forecast_cache)
+    lookups = stats["day_hits"] + stats["day_misses"]
+    stats["hit_ratio"] = round(stats["day_hits"] / lookups, 3) if lookups else 0.0
+    return stats
 
-    latitude = location_data["latitude"]
-    longitude = location_data["longitude"]
-    resolved_city_name = location_data.get("name", city) 
 
+def snap_to_grid(latitude: float, longitude: float) -> tuple:
+    return round(latitude / FORECAST_GRID_DEGREES), round(longitude / FORECAST_GRID_DEGREES)
+
+
+def cell_centre(cell: tuple) -> tuple:
+    return round(cell[0] * FORECAST_GRID_DEGREES, 4), round(cell[1] * FORECAST_GRID_DEGREES, 4)
+
+
+def record_destination(query: str, location_data: dict):
+    popular_destinations.add(normalize_query(query), {
+        "query": query, "latitude": location_data["latitude"], "longitude": location_data["longitude"],
+    })
+
+
+def forecast_expiry(now: float) -> float:
+    # Cached days stay valid until the next model run has been published
+    cadence = FORECAST_UPDATE_HOURS * 3600
+    delay = FORECAST_PUBLISH_DELAY_SECONDS
+    return ((now - delay) // cadence + 1) * cadence + delay
+
+
+def fetch_forecast_days_batch(locations: List[tuple]) -> List[Dict[date, dict]]:
+    # locations: (latitude, longitude, start, end). Open-Meteo takes comma-separated
+    # coordinates and answers with one response per location, but a single date
+    # range, so the union of the ranges is requested and sliced per location.
+    start = min(location[2] for location in locations)
+    end = max(location[3] for location in locations)
+    params = {
+        "latitude": ",".join(str(location[0]) for location in locations),
+        "longitude": ",".join(str(location[1]) for location in locations),
+        "hourly": ",".join(HOURLY_VARIABLES),
+        "start_date": start.isoformat(),
+        "end_date": end.isoformat(),
+        "timezone": "auto"
+    }
+    with metrics.span("open_meteo"):
+        responses = get_weather_client().weather_api(params)
+    with forecast_cache_lock:
+        forecast_cache_stats["upstream_calls"] += 1
+
+    results = []
+    for response in responses:
+        hourly = response.Hourly()
+        values = {name: hourly.Variables(i).ValuesAsNumpy() for i, name in enumerate(HOURLY_VARIABLES)}
+
+        # With timezone=auto the hourly series starts at local midnight, 24 values per day
+        days = {}
+        for i in range((end - start).days + 1):
+            days[start + timedelta(days=i)] = {name: series[i * 24:(i + 1) * 24].copy() for name, series in values.items()}
+        results.append(days)
+    return results
+
+
+def fetch_forecast_days(latitude: float, longitude: float, start: date, end: date) -> Dict[date, dict]:
+    return fetch_forecast_days_batch([(latitude, longitude, start, end)])[0]
+
+
+def fetch_cells(spans: Dict[tuple, tuple], now: float, expires_at: Optional[float] = None) -> Dict[tuple, Dict[date, dict]]:
+    # spans: cell -> (first day, last day). One upstream request at the cell
+    # centres, so every point in a cell shares it; the days go into the cache.
+    cells = list(spans)
+    fetched = fetch_forecast_days_batch([(*cell_centre(cell), *spans[cell]) for cell in cells])
+    expires_at = expires_at or forecast_expiry(now)
+    fetched_by_cell = dict(zip(cells, fetched))
+    with forecast_cache_lock:
+        for cell, cell_days in fetched_by_cell.items():
+            for day, data in cell_days.items():
+                forecast_cache[(*cell, day)] = (expires_at, data)
+    return fetched_by_cell
+
+
+def forecast_expires_at(cell: tuple, start: date, end: date) -> Optional[float]:
+    # When the first of these cached days goes stale; None when any of them is not cached
+    expiries = []
+    with forecast_cache_lock:
+        for i in range((end - start).days + 1):
+            entry = forecast_cache.get((*cell, start + timedelta(days=i)))
+            if entry is None:
+                return None
+            expiries.append(entry[0])
+    return min(expiries)
+
+
+def get_hourly_forecast_batch(locations: List[tuple]) -> List[Dict[str, np.ndarray]]:
+    # locations: (latitude, longitude, start, end). Cached days are reused; every
+    # location with missing days is fetched in one shared upstream request.
+    now = time.time()
+    cells, wanted, slices = [], [], []
+    with forecast_cache_lock:
+        for latitude, longitude, start, end in locations:
+            cell = snap_to_grid(latitude, longitude)
+            days = [start + timedelta(days=i) for i in range((end - start).days + 1)]
+            cached = {}
+            for day in days:
+                entry = forecast_cache.get((*cell, day))
+                if entry and entry[0] > now:
+                    cached[day] = entry[1]
+            forecast_cache_stats["day_hits"] += len(cached)
+            forecast_cache_stats["day_misses"] += len(days) - len(cached)
+            cells.append(cell)
+            wanted.append(days)
+            slices.append(cached)
+
+    # Span of missing days per distinct cell
+    to_fetch = {}
+    for cell, days, cached in zip(cells, wanted, slices):
+        missing = [day for day in days if day not in cached]
+        if missing:
+            first, last = to_fetch.get(cell, (missing[0], missing[-1]))
+            to_fetch[cell] = (min(first, missing[0]), max(last, missing[-1]))
 
+    if to_fetch:
+        fetched_by_cell = fetch_cells(to_fetch, now)
+        for cell, cached in zip(cells, slices):
+            if cell in fetched_by_cell:
+                for day, data in fetched_by_cell[cell].items():
+                    cached.setdefault(day, data)
+
+    return [
+        {name: np.concatenate([cached[day][name] for day in days]) for name in HOURLY_VARIABLES}
+        for days, cached in zip(wanted, slices)
+    ]
+
+
+def get_hourly_forecast(latitude: float, longitude: float, start: date, end: date) -> Dict[str, np.ndarray]:
+    return get_hourly_forecast_batch([(latitude, longitude, start, end)])[0]
+
+
+# WMO weather code -> condition index. The last slot catches unknown or missing codes.
+WEATHER_CONDITIONS = ["clear", "cloudy", "fog", "rain", "snow", "thunderstorm", "other"]
+_OTHER = len(WEATHER_CONDITIONS) - 1
+WEATHER_CODE_LOOKUP = np.full(101, _OTHER, dtype=np.intp)
+WEATHER_CODE_LOOKUP[0] = 0
+WEATHER_CODE_LOOKUP[1:4] = 1
+WEATHER_CODE_LOOKUP[45:49] = 2
+WEATHER_CODE_LOOKUP[51:68] = 3
+WEATHER_CODE_LOOKUP[80:83] = 3  # rain showers
+WEATHER_CODE_LOOKUP[71:78] = 4
+WEATHER_CODE_LOOKUP[85:87] = 4  # snow showers
+WEATHER_CODE_LOOKUP[95:100] = 5
+
+PRECIPITATION_HOUR_MM = 0.1
+
+
+def classify_weather_codes(codes: np.ndarray) -> np.ndarray:
+    valid = np.isfinite(codes) & (codes >= 0) & (codes < 100)
+    return WEATHER_CODE_LOOKUP[np.where(valid, codes, 100).astype(np.intp)]
+
+
+def summarize_hourly(hourly: Dict[str, np.ndarray], start: date) -> dict:
+    # One vectorized pass over the (days, 24) hourly arrays
+    temperature = hourly["temperature_2m"].reshape(-1, 24)
+    conditions = classify_weather_codes(hourly["weather_code"]).reshape(-1, 24)
+    precipitation, precipitation_probability, wind_speed = np.nan_to_num(np.stack([
+        hourly["precipitation"], hourly["precipitation_probability"], hourly["wind_speed_10m"],
+    ])).reshape(3, -1, 24)
+    n_days = temperature.shape[0]
+    n_conditions = len(WEATHER_CONDITIONS)
+
+    day_index = np.repeat(np.arange(n_days), 24)
+    counts = np.bincount(day_index * n_conditions + conditions.ravel(), minlength=n_days * n_conditions)
+    counts = counts.reshape(n_days, n_conditions)
+    # "other" only wins a day when nothing else was reported
+    day_dominant = np.where(counts[:, :_OTHER].any(axis=1), counts[:, :_OTHER].argmax(axis=1), _OTHER)
+    dominant_share = counts[np.arange(n_days), day_dominant] / 24
+
+    day_stats = np.stack([
+        temperature.min(axis=1),
+        temperature.max(axis=1),
+        temperature.mean(axis=1),
+        precipitation.sum(axis=1),
+        wind_speed.max(axis=1),
+    ]).astype(np.float64).round(1).tolist()
+    precipitation_hours = (precipitation >= PRECIPITATION_HOUR_MM).sum(axis=1).tolist()
+    max_precipitation_probability = precipitation_probability.max(axis=1).astype(int).tolist()
+
+    daily = [
+        {
+            "date": (start + timedelta(days=i)).isoformat(),
+            "min_temp": day_min,
+            "max_temp": day_max,
+            "avg_temp": day_mean,
+            "dominant_condition": WEATHER_CONDITIONS[dominant],
+            "dominant_condition_share": share,
+            "precipitation_hours": hours,
+            "precipitation_mm": precipitation_mm,
+            "max_precipitation_probability": probability,
+            "max_wind_speed_kmh": wind,
+        }
+        for i, (day_min, day_max, day_mean, precipitation_mm, wind, dominant, share, hours, probability) in enumerate(zip(
+            *day_stats, day_dominant.tolist(), dominant_share.round(2).tolist(),
+            precipitation_hours, max_precipitation_probability,
+        ))
+    ]
+
+    # Overall label keeps the original precedence: any rain makes the period rainy
+    present = counts.sum(axis=0) > 0
+    clear, cloudy, fog, rain, snow, thunderstorm = present[:_OTHER]
+    dominant_weather = "mixed"
+    if rain or thunderstorm:
+        dominant_weather = "rainy"
+    elif snow:
+        dominant_weather = "snowy"
+    elif clear and not cloudy and not fog:
+        dominant_weather = "clear"
+    elif cloudy:
+        dominant_weather = "cloudy"
+
+    return {
+        "temperature_summary_celsius": {
+            "min_temp": float(temperature.min()),
+            "max_temp": float(temperature.max()),
+            "avg_temp": round(float(temperature.mean()), 1)
+        },
+        "dominant_weather_condition": dominant_weather,
+        "daily": daily,
+    }
+
+
+def parse_forecast_dates(start_date: str, end_date: str):
+    # Returns (start, end) dates, or an error dict for the model
     try:
         start_dt = datetime.strptime(start_date, '%Y-%m-%d')
         end_dt = datetime.strptime(end_date, '%Y-%m-%d')
@@ -76,75 +380,90 @@ def get_weather_forecast(city: str, country: str, start_date: str, end_date: str
 
     except ValueError:
         return {"error": "Invalid date format. Please use YYYY-MM-DD."}
+    return start_dt.date(), end_dt.date()
 
-    try:
-        cache_session = requests_cache.CachedSession('.cache', expire_after=3600)
-        retry_session = retry(cache_session, retries=5, backoff_factor=0.2)
-        openmeteo = openmeteo_requests.Client(session=retry_session)
-
-        url = "https://api.open-meteo.com/v1/forecast"
-        params = {
-            "latitude": latitude,
-            "longitude": longitude,
-            "hourly": "temperature_2m,weather_code",
-            "start_date": start_date,
-            "end_date": end_date,
-            "timezone": "auto"
-        }
-        responses = openmeteo.weather_api(url, params=params)
 
-        response = responses[0]
+def build_forecast_result(location_data: dict, city: str, start_date: str, end_date: str, hourly: Dict[str, np.ndarray]) -> dict:
+    summary = summarize_hourly(hourly, datetime.strptime(start_date, '%Y-%m-%d').date())
 
-        hourly = response.Hourly()
-        hourly_temperature_2m = hourly.Variables(0).ValuesAsNumpy()
-        hourly_weather_code = hourly.Variables(1).ValuesAsNumpy()
+    result = {
+        "city": location_data.get("name", city),
+        "latitude": location_data["latitude"], 
+        "longitude": location_data["longitude"],
+        "start_date": start_date,
+        "end_date": end_date,
+        "temperature_summary_celsius": summary["temperature_summary_celsius"],
+        "dominant_weather_condition": summary["dominant_weather_condition"],
+        "daily_forecast": summary["daily"],
+    }
 
-        temp_summary = {
-            "min_temp": float(hourly_temperature_2m.min()),
-            "max_temp": float(hourly_temperature_2m.max()),
-            "avg_temp": round(float(hourly_temperature_2m.mean()), 1)
-        }
+    return recursively_convert_to_dict(result)
 
-        weather_conditions = {
-            "clear": False, "cloudy": False, "rain": False, "snow": False, "fog": False
-        }
-        for code in hourly_weather_code:
-            if code == 0:
-                weather_conditions["clear"] = True
-            elif 1 <= code <= 3:
-                weather_conditions["cloudy"] = True
-            elif 45 <= code <= 48:
-                weather_conditions["fog"] = True
-            elif 51 <= code <= 67:
-                weather_conditions["rain"] = True
-            elif 71 <= code <= 77:
-                weather_conditions["snow"] = True
-
-        dominant_weather = "mixed"
-        if weather_conditions["rain"]:
-            dominant_weather = "rainy"
-        elif weather_conditions["snow"]:
-            dominant_weather = "snowy"
-        elif weather_conditions["clear"] and not weather_conditions["cloudy"] and not weather_conditions["fog"]:
-            dominant_weather = "clear"
-        elif weather_conditions["cloudy"]:
-            dominant_weather = "cloudy"
-
-        result = {
-            "city": resolved_city_name,
-            "latitude": latitude, 
-            "longitude": longitude,
-            "start_date": start_date,
-            "end_date": end_date,
-            "temperature_summary_celsius": temp_summary,
-            "dominant_weather_condition": dominant_weather,
-        }
 
-        final_result = recursively_convert_to_dict(result)
+# get_weather_forecast with geocoding integration
+async def get_weather_forecast(city: str, country: str, start_date: str, end_date: str) -> dict:
+    full_location = f"{city}, {country}"
+    location_data = await get_coordinates_from_city(full_location)
 
 
-        return final_result
+    if not location_data:
+        return {"error": f"Could not find geographic coordinates for '{city}'. Please check the city name or provide a more specific location."}
+    record_destination(full_location, location_data)
+
+    latitude = location_data["latitude"]
+    longitude = location_data["longitude"]
+    resolved_city_name = location_data.get("name", city) 
 
 
+    dates = parse_forecast_dates(start_date, end_date)
+    if isinstance(dates, dict):
+        return dates
+
+    try:
+        hourly = await run_blocking(get_hourly_forecast, latitude, longitude, *dates)
+        return build_forecast_result(location_data, city, start_date, end_date, hourly)
+
     except Exception as e:
         return {"error": f"Failed to fetch weather forecast for {resolved_city_name or city} at {latitude},{longitude}: {str(e)}"}
+
+
+# Several cities in one go: geocoding runs concurrently and all uncached
+# forecasts share one upstream request
+async def get_weather_forecast_batch(trips: list) -> dict:
+    trips = [dict(trip) for trip in trips]
+    results: List[Optional[dict]] = [None] * len(trips)
+
+    async def geocode_trip(trip: dict) -> Optional[dict]:
+        if not all(trip.get(key) for key in ("city", "country", "start_date", "end_date")):
+            return None
+        return await get_coordinates_from_city(f"{trip['city']}, {trip['country']}")
+
+    locations = await asyncio.gather(*(geocode_trip(trip) for trip in trips))
+
+    pending = []
+    for i, (trip, location_data) in enumerate(zip(trips, locations)):
+        if not all(trip.get(key) for key in ("city", "country", "start_date", "end_date")):
+            results[i] = {"error": "Each trip needs city, country, start_date and end_date."}
+            continue
+        if not location_data:
+            results[i] = {"error": f"Could not find geographic coordinates for '{trip['city']}'. Please check the city name or provide a more specific location."}
+            continue
+        record_destination(f"{trip['city']}, {trip['country']}", location_data)
+        dates = parse_forecast_dates(trip["start_date"], trip["end_date"])
+        if isinstance(dates, dict):
+            results[i] = dates
+            continue
+        pending.append((i, trip, location_data, dates))
+
+    if pending:
+        try:
+            hourly_batch = await run_blocking(get_hourly_forecast_batch, [
+                (location_data["latitude"], location_data["longitude"], *dates) for _, _, location_data, dates in pending
+            ])
+            for (i, trip, location_data, _), hourly in zip(pending, hourly_batch):
+                results[i] = build_forecast_result(location_data, trip["city"], trip["start_date"], trip["end_date"], hourly)
+        except Exception as e:
+            for i, trip, _, _ in pending:
+                results[i] = {"error": f"Failed to fetch weather forecast for {trip['city']}: {str(e)}"}
+
+    return {"forecasts": results}
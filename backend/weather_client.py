@@ -0,0 +1,130 @@
+# weather_client.py
+# One Open-Meteo client per worker process, shared by every tool call.
+# Keeps a pooled keep-alive HTTP session with retries and a response cache
+# whose backend is chosen with WEATHER_CACHE_BACKEND (sqlite, memory or redis).
+import os
+import threading
+import time
+from typing import Optional
+
+import openmeteo_requests
+import requests_cache
+from requests.adapters import HTTPAdapter
+from urllib3 import Retry
+
+
+OPEN_METEO_URL = os.getenv("OPEN_METEO_URL", "https://api.open-meteo.com/v1/forecast")
+
+WEATHER_CACHE_BACKEND = os.getenv("WEATHER_CACHE_BACKEND", "sqlite")
+WEATHER_CACHE_PATH = os.getenv("WEATHER_CACHE_PATH", ".cache")
+WEATHER_CACHE_EXPIRE_SECONDS = int(os.getenv("WEATHER_CACHE_EXPIRE_SECONDS", "3600"))
+WEATHER_POOL_SIZE = int(os.getenv("WEATHER_POOL_SIZE", "32"))
+WEATHER_TIMEOUT = (3.05, 10)  # connect, read
+
+
+def make_cache_backend(name: str):
+    if name == "memory":
+        return requests_cache.SQLiteCache(use_memory=True)
+    if name == "redis":
+        import redis
+
+        connection = redis.Redis(
+            host=os.getenv("REDIS_HOST"),
+            port=int(os.getenv("REDIS_PORT")),
+            username=os.getenv("REDIS_USERNAME", "default"),
+            password=os.getenv("REDIS_PASSWORD"),
+        )
+        return requests_cache.RedisCache(namespace="weather_http", connection=connection)
+    # WAL lets several worker processes read the same file while one writes
+    return requests_cache.SQLiteCache(WEATHER_CACHE_PATH, wal=True)
+
+
+class TrackingAdapter(HTTPAdapter):
+    # Remembers the connection pools it hands out so reuse can be reported
+    def __init__(self, *args, **kwargs):
+        self.pools = set()
+        super().__init__(*args, **kwargs)
+
+    def get_connection_with_tls_context(self, *args, **kwargs):
+        pool = super().get_connection_with_tls_context(*args, **kwargs)
+        self.pools.add(pool)
+        return pool
+
+
+class MeteredSession(requests_cache.CachedSession):
+    def __init__(self, *args, on_response=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.on_response = on_response
+
+    def request(self, method, url, *args, **kwargs):
+        kwargs.setdefault("timeout", WEATHER_TIMEOUT)
+        started = time.perf_counter()
+        response = super().request(method, url, *args, **kwargs)
+        if self.on_response:
+            self.on_response(getattr(response, "from_cache", False), time.perf_counter() - started)
+        return response
+
+
+class WeatherClient:
+    def __init__(self, cache_backend: str = WEATHER_CACHE_BACKEND, pool_size: int = WEATHER_POOL_SIZE):
+        self.lock = threading.Lock()
+        self.counters = {"requests": 0, "cache_hits": 0, "upstream_calls": 0, "upstream_seconds": 0.0, "upstream_max_seconds": 0.0}
+
+        self.session = MeteredSession(
+            backend=make_cache_backend(cache_backend),
+            expire_after=WEATHER_CACHE_EXPIRE_SECONDS,
+            on_response=self._record,
+        )
+        self.adapter = TrackingAdapter(
+            pool_connections=4,
+            pool_maxsize=pool_size,
+            max_retries=Retry(total=5, backoff_factor=0.2, status_forcelist=(500, 502, 504)),
+        )
+        self.session.mount("https://", self.adapter)
+        self.session.mount("http://", self.adapter)
+        self.client = openmeteo_requests.Client(session=self.session)
+
+    def weather_api(self, params: dict, url: Optional[str] = None):
+        return self.client.weather_api(url or OPEN_METEO_URL, params=params)
+
+    def _record(self, from_cache: bool, seconds: float):
+        with self.lock:
+            self.counters["requests"] += 1
+            if from_cache:
+                self.counters["cache_hits"] += 1
+            else:
+                self.counters["upstream_calls"] += 1
+                self.counters["upstream_seconds"] += seconds
+                self.counters["upstream_max_seconds"] = max(self.counters["upstream_max_seconds"], seconds)
+
+    def connection_stats(self) -> dict:
+        opened = requests = 0
+        for pool in list(self.adapter.pools):
+            opened += pool.num_connections
+            requests += pool.num_requests
+        return {"connections_opened": opened, "connections_reused": max(requests - opened, 0)}
+
+    def stats(self) -> dict:
+        with self.lock:
+            stats = dict(self.counters)
+        upstream = stats["upstream_calls"]
+        stats["upstream_avg_seconds"] = round(stats["upstream_seconds"] / upstream, 4) if upstream else 0.0
+        stats["cache_hit_ratio"] = round(stats["cache_hits"] / stats["requests"], 3) if stats["requests"] else 0.0
+        stats.update(self.connection_stats())
+        return stats
+
+    def close(self):
+        self.session.close()
+
+
+_weather_client: Optional[WeatherClient] = None
+_weather_client_lock = threading.Lock()
+
+
+def get_weather_client() -> WeatherClient:
+    global _weather_client
+    if _weather_client is None:
+        with _weather_client_lock:
+            if _weather_client is None:
+                _weather_client = WeatherClient()
+    return _weather_client
@@ -0,0 +1,88 @@
+# Load benchmark for POST /chat against stubbed Gemini and Redis backends.
+#
+#   python -m benchmarks.chat_load --latency 0.2 --requests 512
+#   python -m benchmarks.chat_load --stream   # also reports time-to-first-token
+#
+# With the async pipeline, throughput should grow roughly linearly with
+# concurrency until the event loop itself saturates.
+import argparse
+import asyncio
+import statistics
+import time
+
+from benchmarks.stubs import FakeModel, install_fakes, prepare_env, serve
+
+prepare_env()
+
+import httpx  # noqa: E402
+
+from backend import main  # noqa: E402
+
+
+def percentile(values: list, q: float) -> float:
+    return values[max(int(len(values) * q) - 1, 0)]
+
+
+def latency_summary(seconds: list) -> dict:
+    values = sorted(seconds)
+    return {
+        "p50_ms": round(statistics.median(values) * 1000, 1),
+        "p95_ms": round(percentile(values, 0.95) * 1000, 1),
+        "p99_ms": round(percentile(values, 0.99) * 1000, 1),
+    }
+
+
+async def run_level(client: httpx.AsyncClient, concurrency: int, total: int, stream: bool = False) -> dict:
+    latencies = []
+    first_token = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(i: int):
+        # Distinct messages, so the duplicate-submit guard never short-circuits a turn
+        payload = {"session_id": f"bench-{i % concurrency}", "message": f"3 days in Paris, question {i}"}
+        async with semaphore:
+            started = time.perf_counter()
+            if stream:
+                async with client.stream("POST", "/chat/stream", json=payload) as response:
+                    response.raise_for_status()
+                    seen_text = False
+                    async for line in response.aiter_lines():
+                        if not seen_text and line.startswith("data:") and '"text"' in line:
+                            seen_text = True
+                            first_token.append(time.perf_counter() - started)
+            else:
+                response = await client.post("/chat", json=payload)
+                response.raise_for_status()
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(total)))
+    elapsed = time.perf_counter() - started
+
+    result = {
+        "concurrency": concurrency,
+        "requests": total,
+        "throughput_rps": round(total / elapsed, 1),
+        **latency_summary(latencies),
+    }
+    if first_token:
+        result["ttft_p50_ms"] = latency_summary(first_token)["p50_ms"]
+    return result
+
+
+async def main_async(args):
+    install_fakes(main, FakeModel(latency=args.latency))
+
+    limits = httpx.Limits(max_connections=max(args.concurrency))
+    async with serve(main.app) as base_url, httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60) as client:
+        for concurrency in args.concurrency:
+            print(await run_level(client, concurrency, args.requests, stream=args.stream))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--latency", type=float, default=0.2, help="simulated model latency per call (seconds)")
+    parser.add_argument("--requests", type=int, default=256)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32, 128, 256])
+    parser.add_argument("--stream", action="store_true", help="use the SSE endpoint instead of /chat")
+    asyncio.run(main_async(parser.parse_args()))
@@ -0,0 +1,77 @@
+# Per-turn latency and prompt size against conversation length, with and
+# without context windowing.
+#
+#   python -m benchmarks.context_length --turns 10 50 200
+#
+# The stub model charges latency per prompt token, so unbounded history
+# shows up as latency growing with the conversation.
+import argparse
+import asyncio
+import json
+import time
+
+from benchmarks.stubs import FakeModel, fake_redis, prepare_env
+
+prepare_env()
+
+import httpx  # noqa: E402
+
+from backend import context, history, main  # noqa: E402
+
+PADDING = "We talked about museums, food markets, day trips and train passes. " * 6
+
+
+async def seed(redis_client, session_id: str, turns: int):
+    entries = []
+    for i in range(turns):
+        entries.append({"role": "user", "content": f"Question {i}: {PADDING}"})
+        entries.append({"role": "assistant", "content": f"Answer {i}: {PADDING}"})
+    await history.append_history(redis_client, session_id, entries)
+
+
+async def measure(turns: int, windowed: bool, args) -> dict:
+    main.redis_client = fake_redis()
+    main.model = FakeModel(latency=args.latency, latency_per_token=args.latency_per_token)
+    main.summary_model = FakeModel(latency=0, reply_text="The traveller is planning a week in Lisbon.")
+    main.session_cache.clear()
+    budget = args.budget if windowed else 10**9
+
+    session_id = f"bench-{turns}"
+    await seed(main.redis_client, session_id, turns)
+    if windowed:
+        await context.refresh_summary(main.redis_client, session_id, main.summarize_turns)
+
+    build_context = context.build_context
+    main.build_context = lambda redis_client, session_id: build_context(redis_client, session_id, token_budget=budget)
+    try:
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            started = time.perf_counter()
+            response = await client.post("/chat", json={"session_id": session_id, "message": "What next?"})
+            elapsed = time.perf_counter() - started
+        response.raise_for_status()
+    finally:
+        main.build_context = build_context
+
+    return {
+        "turns": turns,
+        "windowed": windowed,
+        "prompt_tokens": main.model.prompt_tokens[0],
+        "latency_ms": round(elapsed * 1000, 1),
+    }
+
+
+async def main_async(args):
+    for turns in args.turns:
+        for windowed in (False, True):
+            print(json.dumps(await measure(turns, windowed, args)))
+    print(json.dumps({"context_metrics": context.context_metrics}))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--turns", type=int, nargs="+", default=[5, 20, 50, 100, 200])
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--latency-per-token", type=float, default=0.00002)
+    parser.add_argument("--budget", type=int, default=context.CONTEXT_TOKEN_BUDGET)
+    asyncio.run(main_async(parser.parse_args()))
@@ -0,0 +1,82 @@
+# Lookup latency of the offline gazetteer.
+#
+#   python -m benchmarks.gazetteer_lookup                       # synthetic dump
+#   python -m benchmarks.gazetteer_lookup cities15000.txt countryInfo.txt
+import argparse
+import json
+import os
+import random
+import string
+import tempfile
+import time
+
+from backend.gazetteer import Gazetteer, build_index
+
+REAL_QUERIES = [("London", "England"), ("Paris", "France"), ("Lagos", "Nigeria"), ("New York", "USA"), ("Sao Paulo", "Brazil")]
+
+NO_MATCH_QUERIES = [("New Yo", "USA"), ("Lond", "UK"), ("Pariss", "France"), ("Lagoss", "Nigeria")]
+
+
+def write_synthetic_dump(directory: str, count: int) -> tuple:
+    rng = random.Random(42)
+    countries = [("GB", "United Kingdom"), ("FR", "France"), ("NG", "Nigeria"), ("US", "United States"), ("BR", "Brazil")]
+    cities_path = os.path.join(directory, "cities.txt")
+    countries_path = os.path.join(directory, "countryInfo.txt")
+    with open(countries_path, "w", encoding="utf-8") as f:
+        f.write("#ISO\tISO3\tISO-Numeric\tfips\tCountry\n")
+        for code, name in countries:
+            f.write(f"{code}\t{code}X\t0\t{code}\t{name}\n")
+    with open(cities_path, "w", encoding="utf-8") as f:
+        names = [q[0] for q in REAL_QUERIES] + [
+            "".join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(4, 12))).title() for _ in range(count)
+        ]
+        for i, name in enumerate(names):
+            code = countries[min(i, len(countries) - 1)][0] if i < len(REAL_QUERIES) else rng.choice(countries)[0]
+            fields = [str(i), name, name, "", str(rng.uniform(-80, 80)), str(rng.uniform(-180, 180)), "P", "PPL", code,
+                      "", "", "", "", "", str(rng.randint(15000, 9000000)), "", "", "UTC", "2024-01-01"]
+            f.write("\t".join(fields) + "\n")
+    return cities_path, countries_path
+
+
+def time_lookups(gazetteer: Gazetteer, queries, rounds: int) -> float:
+    started = time.perf_counter()
+    for _ in range(rounds):
+        for city, country in queries:
+            gazetteer.lookup(city, country)
+    return (time.perf_counter() - started) / (rounds * len(queries)) * 1e6
+
+
+def main(args):
+    with tempfile.TemporaryDirectory() as tmp:
+        if args.cities:
+            cities_path, countries_path = args.cities, args.countries
+        else:
+            cities_path, countries_path = write_synthetic_dump(tmp, args.size)
+
+        started = time.perf_counter()
+        count = build_index(cities_path, countries_path, os.path.join(tmp, "index"))
+        build_s = time.perf_counter() - started
+
+        started = time.perf_counter()
+        gazetteer = Gazetteer(os.path.join(tmp, "index"))
+        load_ms = (time.perf_counter() - started) * 1000
+
+        print(json.dumps({
+            "cities": count,
+            "build_s": round(build_s, 2),
+            "load_ms": round(load_ms, 2),
+            "exact_us": round(time_lookups(gazetteer, REAL_QUERIES, args.rounds), 1),
+            # Partial and misspelt names are left to Nominatim
+            "no_match_us": round(time_lookups(gazetteer, NO_MATCH_QUERIES, args.rounds), 1),
+            "no_match_found": sum(gazetteer.lookup(city, country) is not None for city, country in NO_MATCH_QUERIES),
+            "sample": gazetteer.lookup("London", "England"),
+        }))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("cities", nargs="?")
+    parser.add_argument("countries", nargs="?")
+    parser.add_argument("--size", type=int, default=30000, help="synthetic cities when no dump is given")
+    parser.add_argument("--rounds", type=int, default=200)
+    main(parser.parse_args())
@@ -0,0 +1,107 @@
+# Harness for the shared Nominatim token bucket and geocode de-duplication,
+# against fakeredis and the local Nominatim stand-in. Checks that several
+# workers sharing one Redis stay within the configured rate together, and that
+# concurrent lookups of the same city make a single upstream request.
+#
+#   python -m benchmarks.geocode_limiter
+import argparse
+import asyncio
+import json
+import sys
+import time
+
+from benchmarks.stubs import prepare_env
+
+prepare_env()
+
+import fakeredis  # noqa: E402
+
+from backend import tools  # noqa: E402
+from backend.geocache import get_geocode_cache  # noqa: E402
+from backend.rate_limit import TokenBucket  # noqa: E402
+from benchmarks.upstreams import offline_upstreams  # noqa: E402
+
+
+async def paced(buckets: list, calls: int) -> list:
+    started = time.perf_counter()
+
+    async def acquire(bucket: TokenBucket) -> float:
+        await bucket.acquire()
+        return time.perf_counter() - started
+
+    return sorted(await asyncio.gather(*(acquire(buckets[i % len(buckets)]) for i in range(calls))))
+
+
+async def shared_rate(workers: int, calls: int, rate: float) -> dict:
+    # One bucket per simulated worker, all talking to the same Redis
+    server = fakeredis.FakeServer()
+    buckets = []
+    for _ in range(workers):
+        bucket = TokenBucket("harness", rate=rate, max_wait=60)
+        bucket.redis_client = fakeredis.aioredis.FakeRedis(server=server, decode_responses=True)
+        buckets.append(bucket)
+
+    times = await paced(buckets, calls)
+    gaps = [later - earlier for earlier, later in zip(times, times[1:])]
+    return {
+        "scenario": "shared_rate",
+        "workers": workers,
+        "calls": calls,
+        "rate": rate,
+        "observed_rate": round((calls - 1) / times[-1], 2) if times[-1] else None,
+        "min_gap_ms": round(min(gaps) * 1000, 1),
+        "local_fallbacks": sum(bucket.counters["local_fallbacks"] for bucket in buckets),
+    }
+
+
+async def local_rate(calls: int, rate: float) -> dict:
+    # No Redis at all: one worker still keeps to the rate on its own
+    bucket = TokenBucket("harness-local", rate=rate, max_wait=60)
+    times = await paced([bucket], calls)
+    return {
+        "scenario": "local_rate",
+        "calls": calls,
+        "rate": rate,
+        "observed_rate": round((calls - 1) / times[-1], 2) if times[-1] else None,
+    }
+
+
+async def deduplicated(clients: int) -> dict:
+    get_geocode_cache().memory.clear()
+    with offline_upstreams(geocode_rate=5) as upstream:
+        results = await asyncio.gather(*(tools.get_coordinates_from_city("Lisbon, Portugal") for _ in range(clients)))
+        requests = upstream.requests["nominatim"]
+    return {
+        "scenario": "deduplicated",
+        "clients": clients,
+        "nominatim_requests": requests,
+        "all_resolved": all(result and result["name"] == "Lisboa" for result in results),
+        "geocode": tools.geocode_summary(),
+    }
+
+
+async def main_async(args) -> bool:
+    shared = await shared_rate(args.workers, args.calls, args.rate)
+    local = await local_rate(args.calls, args.rate)
+    dedup = await deduplicated(args.clients)
+    for result in (shared, local, dedup):
+        print(json.dumps(result))
+
+    # Small tolerance for timer granularity; the Redis clock has millisecond resolution
+    limit = args.rate * 1.05
+    return (
+        shared["observed_rate"] <= limit and shared["local_fallbacks"] == 0
+        and local["observed_rate"] <= limit
+        and dedup["nominatim_requests"] == 1 and dedup["all_resolved"]
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--calls", type=int, default=20)
+    parser.add_argument("--rate", type=float, default=20.0, help="tokens per second")
+    parser.add_argument("--clients", type=int, default=16, help="concurrent lookups of one city")
+    ok = asyncio.run(main_async(parser.parse_args()))
+    print("OK" if ok else "FAILED")
+    sys.exit(0 if ok else 1)
@@ -0,0 +1,114 @@
+# Micro-benchmark: stored size and encode/decode time of a session history in
+# the old flattened-JSON format against the tagged msgpack(+zstd) encoding in
+# backend/history.py. The session mixes chat turns with forecast tool calls
+# built from the real summarize_hourly output.
+#
+#   python -m benchmarks.history_encoding --turns 20 --days 7
+#
+# --redis-url also writes each variant to a real Redis and reports MEMORY USAGE
+# for the session list, which includes Redis' own per-element overhead.
+import argparse
+import asyncio
+import json
+import timeit
+from datetime import date, timedelta
+
+from backend import history
+from backend.tools import build_forecast_result
+from benchmarks.weather_summary import make_hourly
+
+
+def make_session(turns: int, days: int) -> list:
+    start = date(2026, 5, 1)
+    end = start + timedelta(days=days - 1)
+    forecast = build_forecast_result(
+        {"name": "Lisbon", "latitude": 38.72, "longitude": -9.14},
+        "Lisbon", start.isoformat(), end.isoformat(), make_hourly(days),
+    )
+    args = {"city": "Lisbon", "country": "Portugal", "start_date": start.isoformat(), "end_date": end.isoformat()}
+    entries = []
+    for turn in range(turns):
+        entries.append({"role": "user", "content": f"What should I pack for Lisbon, question {turn}?"})
+        if turn % 2 == 0:  # every other turn goes through the forecast tool
+            entries.append({"role": "assistant", "content": "", "parts": [
+                {"function_call": {"name": "get_weather_forecast", "args": args}},
+            ]})
+            entries.append({"role": "user", "content": "", "parts": [
+                {"function_response": {"name": "get_weather_forecast", "response": forecast}},
+            ]})
+        entries.append({"role": "assistant", "content": "Expect mild days and a couple of showers. " * 8})
+    return entries
+
+
+def legacy_entry(entry: dict) -> dict:
+    # What to_stored_history saved before parts were kept structured
+    return {"role": entry["role"], "content": history.entry_text(entry)}
+
+
+def measure(name: str, encode, decode, entries: list, repeat: int) -> dict:
+    encoded = [encode(entry) for entry in entries]
+    encode_s = timeit.timeit(lambda: [encode(entry) for entry in entries], number=repeat) / repeat
+    decode_s = timeit.timeit(lambda: [decode(raw) for raw in encoded], number=repeat) / repeat
+    return {
+        "format": name,
+        "stored_bytes": sum(len(raw) for raw in encoded),
+        "encode_ms": round(encode_s * 1000, 3),
+        "decode_ms": round(decode_s * 1000, 3),
+    }
+
+
+async def redis_memory(url: str, encoded_sessions: dict) -> dict:
+    import redis.asyncio as redis
+
+    client = redis.Redis.from_url(url)
+    usage = {}
+    try:
+        for name, encoded in encoded_sessions.items():
+            key = f"benchmark_history:{name}"
+            await client.delete(key)
+            await client.rpush(key, *encoded)
+            usage[name] = await client.memory_usage(key, samples=0)
+            await client.delete(key)
+    finally:
+        await client.aclose()
+    return usage
+
+
+def encoder(encoding: str, compress_min_bytes: int):
+    def encode(entry):
+        history.HISTORY_ENCODING = encoding
+        history.HISTORY_COMPRESS_MIN_BYTES = compress_min_bytes
+        return history.encode_entry(entry)
+    return encode
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--turns", type=int, default=20)
+    parser.add_argument("--days", type=int, default=7)
+    parser.add_argument("--repeat", type=int, default=200)
+    parser.add_argument("--redis-url")
+    args = parser.parse_args()
+
+    compress_min_bytes = history.HISTORY_COMPRESS_MIN_BYTES
+    entries = make_session(args.turns, args.days)
+    legacy = [legacy_entry(entry) for entry in entries]
+    results = [
+        measure("json_flattened (old)", lambda entry: json.dumps(entry).encode(), json.loads, legacy, args.repeat),
+        measure("msgpack", encoder("msgpack", 1 << 30), history.decode_entry, entries, args.repeat),
+        measure("msgpack+zstd", encoder("msgpack", compress_min_bytes), history.decode_entry, entries, args.repeat),
+    ]
+    if args.redis_url:
+        encoded_sessions = {
+            "json_flattened (old)": [json.dumps(entry).encode() for entry in legacy],
+            "msgpack": [encoder("msgpack", 1 << 30)(entry) for entry in entries],
+            "msgpack+zstd": [encoder("msgpack", compress_min_bytes)(entry) for entry in entries],
+        }
+        usage = asyncio.run(redis_memory(args.redis_url, encoded_sessions))
+        for result in results:
+            result["redis_memory_bytes"] = usage[result["format"]]
+
+    baseline = results[0]["stored_bytes"]
+    for result in results:
+        result["size_vs_old"] = round(result["stored_bytes"] / baseline, 3)
+    print(json.dumps({"entries": len(entries), "results": results}, indent=2))
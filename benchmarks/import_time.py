@@ -0,0 +1,99 @@
+# Cold-start profile of the backend: `python -X importtime` for backend.main
+# in fresh interpreters, plus the time the lifespan hook takes to build the
+# clients. Reports medians, the slowest direct imports and the heaviest
+# top-level packages, as JSON.
+#
+#   python -m benchmarks.import_time --runs 5
+#   python -m benchmarks.import_time --budget-ms 2000   # exits 1 when over budget
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+from collections import defaultdict
+
+from benchmarks.stubs import prepare_env
+
+STARTUP_SCRIPT = """
+import asyncio, json, time
+started = time.perf_counter()
+from backend import main
+imported = time.perf_counter()
+
+async def startup():
+    async with main.lifespan(main.app):
+        return time.perf_counter()
+
+ready = asyncio.run(startup())
+print(json.dumps({"import_ms": (imported - started) * 1000, "lifespan_ms": (ready - imported) * 1000}))
+"""
+
+
+def parse_importtime(stderr: str) -> list:
+    # Lines look like "import time:  self_us |  cumulative_us | <indent>module"
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip(" "))) // 2
+        rows.append({"module": name.strip(), "self_us": int(self_us), "cumulative_us": int(cumulative_us), "depth": depth})
+    return rows
+
+
+def profile_imports() -> list:
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import backend.main"],
+        capture_output=True, text=True, check=True,
+    )
+    return parse_importtime(result.stderr)
+
+
+def profile_startup() -> dict:
+    result = subprocess.run([sys.executable, "-c", STARTUP_SCRIPT], capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def summarize(runs: list, startups: list, top: int) -> dict:
+    totals = [next(row["cumulative_us"] for row in rows if row["module"] == "backend.main") / 1000 for rows in runs]
+
+    # Direct imports of backend.main (depth 1) and self time per top-level package, from the median run
+    median_run = sorted(runs, key=lambda rows: next(r["cumulative_us"] for r in rows if r["module"] == "backend.main"))[len(runs) // 2]
+    direct = sorted((row for row in median_run if row["depth"] == 1), key=lambda row: row["cumulative_us"], reverse=True)
+    packages = defaultdict(int)
+    for row in median_run:
+        packages[row["module"].split(".")[0]] += row["self_us"]
+
+    return {
+        "runs": len(runs),
+        "import_backend_main_ms": round(statistics.median(totals), 1),
+        "import_wall_ms": round(statistics.median(s["import_ms"] for s in startups), 1),
+        "lifespan_startup_ms": round(statistics.median(s["lifespan_ms"] for s in startups), 1),
+        "slowest_direct_imports_ms": {row["module"]: round(row["cumulative_us"] / 1000, 1) for row in direct[:top]},
+        "heaviest_packages_ms": {
+            name: round(us / 1000, 1) for name, us in sorted(packages.items(), key=lambda item: item[1], reverse=True)[:top]
+        },
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=10)
+    parser.add_argument("--output", help="write the JSON report here")
+    parser.add_argument("--budget-ms", type=float, help="fail when the median import of backend.main is slower")
+    args = parser.parse_args()
+
+    prepare_env()
+    report = summarize(
+        [profile_imports() for _ in range(args.runs)],
+        [profile_startup() for _ in range(args.runs)],
+        args.top,
+    )
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.budget_ms and report["import_backend_main_ms"] > args.budget_ms:
+        print(f"backend.main import took {report['import_backend_main_ms']}ms, over the {args.budget_ms}ms budget")
+        sys.exit(1)
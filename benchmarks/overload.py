@@ -0,0 +1,157 @@
+# Overload benchmark for admission control. The stub model serves at most
+# --model-capacity calls at once (the rest queue, like a quota-bound Gemini)
+# and far more clients than that hammer POST /chat, first with admission
+# control off, then on. Reports latency of the requests that were answered,
+# how many were shed and how fast, plus a per-session and per-IP rate limit
+# check, as JSON. The benchmark connects over loopback, as the Streamlit
+# frontend does, so the per-IP limit applies only where it forwards an address. Latency is timed in the server as well as in the client:
+# client and server share one event loop here, so with this many clients the
+# client-side numbers also include time spent queueing on loopback.
+#
+#   python -m benchmarks.overload --clients 64 --requests 512
+import argparse
+import asyncio
+import json
+import sys
+import time
+from collections import Counter
+
+from benchmarks.stubs import FakeModel, install_fakes, prepare_env, serve
+
+prepare_env()
+
+import httpx  # noqa: E402
+
+from backend import admission, main  # noqa: E402
+from benchmarks.chat_load import latency_summary  # noqa: E402
+
+
+class ServerTimer:
+    # ASGI wrapper recording (status, seconds) from request start to the last body chunk
+    def __init__(self, app):
+        self.app = app
+        self.records = []
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        started = time.perf_counter()
+        status = None
+
+        async def timed_send(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body" and not message.get("more_body"):
+                self.records.append((status, time.perf_counter() - started))
+            await send(message)
+
+        await self.app(scope, receive, timed_send)
+
+
+def configure(enabled: bool, args):
+    admission.ADMISSION_ENABLED = enabled
+    admission.model_gate = admission.ConcurrencyGate(args.concurrency_limit, args.queue_size, args.queue_timeout)
+    for key in admission.admission_stats:
+        admission.admission_stats[key] = 0
+
+
+async def hammer(client: httpx.AsyncClient, timer: ServerTimer, run: str, clients: int, total: int) -> dict:
+    answered, shed = [], []
+    timer.records.clear()
+    statuses = Counter()
+    retry_after = set()
+    semaphore = asyncio.Semaphore(clients)
+
+    async def one(i: int):
+        # A fresh session per request, so only the global limits are in play
+        payload = {"session_id": f"overload-{run}-{i}", "message": f"Plan a weekend in Rome, request {i}"}
+        async with semaphore:
+            started = time.perf_counter()
+            response = await client.post("/chat", json=payload)
+            elapsed = time.perf_counter() - started
+            statuses[response.status_code] += 1
+            if response.status_code == 200:
+                answered.append(elapsed)
+                return
+            shed.append(elapsed)
+            retry_after.add(response.headers.get("retry-after"))
+            # Clients back off as told; retrying at once would only measure the event loop
+            await asyncio.sleep(float(response.headers.get("retry-after", 1)))
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(total)))
+    elapsed = time.perf_counter() - started
+    result = {
+        "statuses": dict(statuses),
+        "answered_rps": round(len(answered) / elapsed, 1),
+        "answered": latency_summary(answered) if answered else None,
+        "shed": latency_summary(shed) if shed else None,
+        "server_answered": server_summary(timer, 200),
+        "server_shed": server_summary(timer, 503),
+        "retry_after": sorted(value or "missing" for value in retry_after),
+    }
+    return result
+
+
+def server_summary(timer: ServerTimer, status: int):
+    seconds = [elapsed for code, elapsed in timer.records if code == status]
+    return latency_summary(seconds) if seconds else None
+
+
+async def rate_limits(client: httpx.AsyncClient, args) -> dict:
+    # Back-to-back turns from one session, then many sessions from one address
+    session = Counter()
+    for i in range(int(admission.session_limiter.capacity) + 3):
+        response = await client.post("/chat", json={"session_id": "overload-one-session", "message": f"Turn {i}"})
+        session[response.status_code] += 1
+
+    # One end user behind the frontend, across several sessions
+    admission.ip_limiter.rate, admission.ip_limiter.capacity = 1 / 60, 5
+    address = Counter()
+    for i in range(8):
+        response = await client.post(
+            "/chat", json={"session_id": f"overload-ip-{i}", "message": "Hello"}, headers={"X-Forwarded-For": "203.0.113.7"}
+        )
+        address[response.status_code] += 1
+    return {"one_session": dict(session), "one_address": dict(address)}
+
+
+async def main_async(args) -> bool:
+    install_fakes(main, FakeModel(latency=args.latency, capacity=args.model_capacity))
+    for limiter in (admission.session_limiter, admission.ip_limiter):
+        limiter.redis_client = main.redis_client
+
+    report = {"model_capacity": args.model_capacity, "clients": args.clients, "requests": args.requests}
+    limits = httpx.Limits(max_connections=args.clients)
+    timer = ServerTimer(main.app)
+    async with serve(timer) as base_url, httpx.AsyncClient(base_url=base_url, limits=limits, timeout=120) as client:
+        configure(False, args)
+        report["admission_off"] = await hammer(client, timer, "off", args.clients, args.requests)
+        configure(True, args)
+        report["admission_on"] = await hammer(client, timer, "on", args.clients, args.requests)
+        report["admission_on"]["stats"] = admission.stats()
+        report["rate_limits"] = await rate_limits(client, args)
+    print(json.dumps(report, indent=2))
+
+    off, on, limited = report["admission_off"], report["admission_on"], report["rate_limits"]
+    return (
+        on["server_answered"]["p99_ms"] < off["server_answered"]["p99_ms"]
+        and "missing" not in on["retry_after"]
+        and limited["one_session"].get(429, 0) > 0
+        and limited["one_address"].get(429, 0) > 0
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--latency", type=float, default=0.2, help="stub model latency per call")
+    parser.add_argument("--model-capacity", type=int, default=8, help="model calls the stub serves at once")
+    parser.add_argument("--clients", type=int, default=64, help="concurrent clients")
+    parser.add_argument("--requests", type=int, default=512)
+    parser.add_argument("--concurrency-limit", type=int, default=8, help="MODEL_CONCURRENCY for the admission-on run")
+    parser.add_argument("--queue-size", type=int, default=8)
+    parser.add_argument("--queue-timeout", type=float, default=1.0)
+    ok = asyncio.run(main_async(parser.parse_args()))
+    print("OK" if ok else "FAILED")
+    sys.exit(0 if ok else 1)
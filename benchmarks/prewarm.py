@@ -0,0 +1,90 @@
+# Harness for the forecast pre-warm scheduler, against the local Nominatim
+# and Open-Meteo stand-ins. Users ask about a skewed mix of destinations, the
+# cached forecasts are then aged past their expiry, and one pre-warm cycle
+# runs. Checks that the popular destinations are answered from the cache
+# afterwards. Then a second worker (sharing the fake Redis) runs a cycle of
+# its own, and both together must have kept to the hourly request budget.
+#
+#   python -m benchmarks.prewarm --budget 2
+import argparse
+import asyncio
+import json
+import sys
+from datetime import date, timedelta
+
+from benchmarks.stubs import BENCHMARK_TRIPS, fake_redis, prepare_env
+
+prepare_env()
+
+from backend import prewarm, tools  # noqa: E402
+from benchmarks.upstreams import offline_upstreams  # noqa: E402
+
+
+def age_forecasts():
+    # As if the next model run had been published since these were fetched
+    with tools.forecast_cache_lock:
+        for key, (expires_at, data) in list(tools.forecast_cache.items()):
+            tools.forecast_cache[key] = (0.0, data)
+
+
+async def ask(city: str, country: str, days: int):
+    start = date.today() + timedelta(days=1)
+    await tools.get_weather_forecast(city, country, start.isoformat(), (start + timedelta(days=days - 1)).isoformat())
+
+
+async def main_async(args) -> bool:
+    prewarm.PREWARM_TOP_K = args.top_k
+    prewarm.PREWARM_BUDGET_PER_HOUR = args.budget
+    prewarm.PREWARM_BATCH_SIZE = args.batch_size
+    prewarm.redis_client = fake_redis()
+
+    with offline_upstreams() as upstream:
+        # Destination i is asked about len - i times, so the ranking is known
+        for i, (city, country) in enumerate(BENCHMARK_TRIPS):
+            for _ in range(len(BENCHMARK_TRIPS) - i):
+                await ask(city, country, days=3)
+        age_forecasts()
+        before = dict(upstream.requests)
+        await prewarm.run_cycle()
+        cycle_requests = {key: upstream.requests[key] - before[key] for key in before}
+
+        before = dict(upstream.requests)
+        hits_before = tools.forecast_cache_stats["day_hits"]
+        for city, country in BENCHMARK_TRIPS[:args.top_k]:
+            await ask(city, country, days=7)
+        after_requests = {key: upstream.requests[key] - before[key] for key in before}
+
+        # Another worker's cold caches, drawing on the same budget
+        age_forecasts()
+        before = dict(upstream.requests)
+        await prewarm.run_cycle()
+        second_worker_requests = {key: upstream.requests[key] - before[key] for key in before}
+
+    status = prewarm.status()
+    result = {
+        "top_k": args.top_k,
+        "budget": args.budget,
+        "cycle_requests": cycle_requests,
+        "requests_after_prewarm": after_requests,
+        "second_worker_requests": second_worker_requests,
+        "day_hits_after_prewarm": tools.forecast_cache_stats["day_hits"] - hits_before,
+        "stats": status["stats"],
+        "destinations": status["destinations"],
+    }
+    print(json.dumps(result, indent=2))
+
+    warmed_all = -(-args.top_k // args.batch_size) <= args.budget
+    return (
+        sum(cycle_requests.values()) + sum(second_worker_requests.values()) <= args.budget
+        and (not warmed_all or sum(after_requests.values()) == 0)
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--top-k", type=int, default=4)
+    parser.add_argument("--budget", type=int, default=2, help="upstream requests per hour")
+    parser.add_argument("--batch-size", type=int, default=10, help="cells per Open-Meteo request")
+    ok = asyncio.run(main_async(parser.parse_args()))
+    print("OK" if ok else "FAILED")
+    sys.exit(0 if ok else 1)
@@ -0,0 +1,99 @@
+# Concurrency harness for per-session turn handling, against fakeredis and
+# the stub model. Fires overlapping /chat and /chat/stream requests at one
+# session and checks that no turn is lost and duplicates share a single model
+# call, with every streamed copy getting the whole reply.
+#
+#   python -m benchmarks.session_concurrency
+import argparse
+import asyncio
+import json
+import sys
+
+from benchmarks.stubs import FakeModel, fake_redis, prepare_env
+
+prepare_env()
+
+import httpx  # noqa: E402
+
+from backend import history, main, session_guard  # noqa: E402
+
+
+class CountingModel(FakeModel):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.calls = 0
+
+    def call_latency(self, prompt_chars: int) -> float:
+        # Counted per send, not per start_chat: active sessions reuse their chat
+        self.calls += 1
+        return super().call_latency(prompt_chars)
+
+
+def streamed_text(body: str) -> str:
+    # The reply text from an SSE body; error events carry text too
+    return "".join(
+        json.loads(line[len("data:"):]).get("text", "")
+        for line in body.splitlines() if line.startswith("data:")
+    )
+
+
+async def fire(client: httpx.AsyncClient, path: str, session_id: str, messages: list) -> list:
+    responses = await asyncio.gather(*(
+        client.post(path, json={"session_id": session_id, "message": message}) for message in messages
+    ))
+    if path == "/chat/stream":
+        return [streamed_text(response.text) for response in responses]
+    return [response.json()["reply"] for response in responses]
+
+
+async def scenario(name: str, path: str, messages: list, latency: float) -> dict:
+    main.redis_client = fake_redis()
+    main.model = CountingModel(latency=latency)
+    session_id = f"harness-{name}"
+
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://harness", timeout=60) as client:
+        replies = await fire(client, path, session_id, messages)
+
+    stored = await history.get_history(main.redis_client, session_id)
+    roles = [entry["role"] for entry in stored]
+    stored_messages = [entry["content"] for entry in stored if entry["role"] == "user"]
+    # Each turn must have seen every earlier turn: the stub's history grows by two per turn
+    alternating = roles == ["user", "assistant"] * (len(roles) // 2)
+    return {
+        "scenario": name,
+        "path": path,
+        "requests": len(messages),
+        "model_calls": main.model.calls,
+        "stored_turns": len(stored_messages),
+        "history_alternates": alternating,
+        "all_replied": all(reply == main.model.reply_text for reply in replies),
+    }
+
+
+async def main_async(args) -> bool:
+    ok = True
+    for path in ("/chat", "/chat/stream"):
+        label = path.strip("/").replace("/", "-")
+        # Double submit: identical messages coalesce into one model call and one stored turn
+        duplicates = await scenario(f"{label}-duplicates", path, ["Plan 3 days in Rome"] * args.clients, args.latency)
+        # Different messages from several tabs: every turn stored, in order, none overwritten
+        distinct = await scenario(f"{label}-distinct", path, [f"Question {i}" for i in range(args.clients)], args.latency)
+        print(json.dumps(duplicates))
+        print(json.dumps(distinct))
+        ok = ok and (
+            duplicates["model_calls"] == 1 and duplicates["stored_turns"] == 1 and duplicates["all_replied"]
+            and distinct["model_calls"] == args.clients and distinct["stored_turns"] == args.clients
+            and distinct["history_alternates"] and distinct["all_replied"]
+        )
+    print(json.dumps({"session_guard": session_guard.session_guard_stats}))
+    return ok
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--latency", type=float, default=0.05)
+    ok = asyncio.run(main_async(parser.parse_args()))
+    print("OK" if ok else "FAILED")
+    sys.exit(0 if ok else 1)
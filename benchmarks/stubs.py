@@ -0,0 +1,191 @@
+# Local stand-ins for the external backends used by backend/main.py.
+# They let the benchmarks drive the real FastAPI app fully offline.
+import asyncio
+import contextlib
+import os
+import socket
+import tempfile
+import time
+from datetime import date, timedelta
+
+import google.ai.generativelanguage as glm
+
+
+def prepare_env():
+    # backend.main reads these at import time
+    os.environ.setdefault("REDIS_HOST", "localhost")
+    os.environ.setdefault("REDIS_PORT", "6379")
+    os.environ.setdefault("GOOGLE_API_KEY", "benchmark")
+    # Keep benchmark runs off the on-disk caches and independent of a locally built city index
+    os.environ.setdefault("WEATHER_CACHE_BACKEND", "memory")
+    os.environ.setdefault("GEOCODE_CACHE_PATH", "")
+    os.environ.setdefault("GAZETTEER_DIR", os.path.join(tempfile.gettempdir(), "wanderbot-benchmark-no-gazetteer"))
+    # Background refreshes would show up in the upstream request counts
+    os.environ.setdefault("PREWARM_ENABLED", "false")
+    # Load tests drive a few sessions hard from one address; benchmarks.overload turns this back on
+    os.environ.setdefault("ADMISSION_ENABLED", "false")
+
+
+BENCHMARK_TRIPS = [
+    ("Lisbon", "Portugal"), ("Paris", "France"), ("Rome", "Italy"),
+    ("Tokyo", "Japan"), ("New York", "United States"), ("Cape Town", "South Africa"),
+]
+
+
+class FakeResponse:
+    def __init__(self, content: glm.Content, prompt_tokens: int = 0):
+        self.candidates = [glm.Candidate(content=content)]
+        self.usage_metadata = glm.GenerateContentResponse.UsageMetadata(
+            prompt_token_count=prompt_tokens,
+            candidates_token_count=sum(len(part.text) for part in content.parts) // 4,
+        )
+
+    @property
+    def text(self) -> str:
+        return "".join(part.text for part in self.candidates[0].content.parts)
+
+
+class FakeStreamResponse:
+    def __init__(self, reply: FakeResponse, latency: float):
+        self.reply = reply
+        self.latency = latency
+        self.usage_metadata = reply.usage_metadata
+
+    async def __aiter__(self):
+        parts = self.reply.candidates[0].content.parts
+        if any(part.function_call for part in parts):
+            # Function calls arrive whole, in one chunk
+            await asyncio.sleep(self.latency)
+            yield self.reply
+            return
+        words = self.reply.text.split(" ")
+        delay = self.latency / max(len(words), 1)
+        for i, word in enumerate(words):
+            await asyncio.sleep(delay)
+            text = word if i == 0 else " " + word
+            yield FakeResponse(glm.Content(role="model", parts=[glm.Part(text=text)]))
+
+
+class FakeChatSession:
+    def __init__(self, model: "FakeModel", history):
+        self.model = model
+        self.history = list(history)
+
+    def _reply(self, content, prompt_tokens: int = 0) -> FakeResponse:
+        if isinstance(content, str):
+            content = glm.Content(role="user", parts=[glm.Part(text=content)])
+        elif isinstance(content, glm.Part):
+            content = glm.Content(role="user", parts=[content])
+        elif isinstance(content, list):
+            content = glm.Content(role="user", parts=content)
+
+        is_user_message = not any(part.function_response for part in content.parts)
+        calls = self.model.next_tool_calls() if is_user_message else []
+        if calls:
+            reply = glm.Content(role="model", parts=[glm.Part(function_call=call) for call in calls])
+        else:
+            reply = glm.Content(role="model", parts=[glm.Part(text=self.model.reply_text)])
+        self.history.extend([content, reply])
+        return FakeResponse(reply, prompt_tokens)
+
+    def prompt_chars(self) -> int:
+        return sum(len(part.text) for content in self.history for part in content.parts)
+
+    def send_message(self, content, **kwargs):
+        prompt_chars = self.prompt_chars()
+        time.sleep(self.model.call_latency(prompt_chars))
+        return self._reply(content, prompt_chars // 4)
+
+    async def send_message_async(self, content, stream: bool = False, **kwargs):
+        prompt_chars = self.prompt_chars()
+        latency = self.model.call_latency(prompt_chars)
+        if stream:
+            return FakeStreamResponse(self._reply(content, prompt_chars // 4), latency)
+        if self.model.slots is None:
+            await asyncio.sleep(latency)
+        else:
+            async with self.model.slots:
+                await asyncio.sleep(latency)
+        return self._reply(content, prompt_chars // 4)
+
+
+class FakeModel:
+    # latency_per_token models prefill cost growing with the prompt.
+    # tool_every=N makes every Nth user message ask for tool_calls forecasts
+    # (in parallel) before answering; 0 never calls tools.
+    # capacity=N serves at most N non-streaming calls at once, the rest queue
+    # (like a quota-bound upstream); 0 is unlimited.
+    def __init__(self, latency: float = 0.2, reply_text: str = "Here is your travel plan.", latency_per_token: float = 0.0,
+                 tool_every: int = 0, tool_calls: int = 1, forecast_days: int = 3, capacity: int = 0):
+        self.latency = latency
+        self.reply_text = reply_text
+        self.latency_per_token = latency_per_token
+        self.tool_every = tool_every
+        self.tool_calls = tool_calls
+        self.forecast_days = forecast_days
+        self.prompt_tokens = []
+        self.user_messages = 0
+        self.slots = asyncio.Semaphore(capacity) if capacity else None
+
+    def call_latency(self, prompt_chars: int) -> float:
+        tokens = prompt_chars // 4
+        self.prompt_tokens.append(tokens)
+        return self.latency + tokens * self.latency_per_token
+
+    def next_tool_calls(self) -> list:
+        self.user_messages += 1
+        if not self.tool_every or self.user_messages % self.tool_every:
+            return []
+        start = date.today() + timedelta(days=1)
+        end = start + timedelta(days=self.forecast_days - 1)
+        calls = []
+        for i in range(self.tool_calls):
+            city, country = BENCHMARK_TRIPS[(self.user_messages + i) % len(BENCHMARK_TRIPS)]
+            calls.append(glm.FunctionCall(name="get_weather_forecast", args={
+                "city": city, "country": country, "start_date": start.isoformat(), "end_date": end.isoformat(),
+            }))
+        return calls
+
+    def start_chat(self, history=None):
+        return FakeChatSession(self, history or [])
+
+    async def generate_content_async(self, contents, **kwargs):
+        await asyncio.sleep(self.call_latency(len(str(contents))))
+        return FakeResponse(glm.Content(role="model", parts=[glm.Part(text=self.reply_text)]))
+
+
+def install_fakes(main, model: FakeModel):
+    # Swaps every external backend backend.main talks to; the summary model
+    # starts being called once a session outgrows the recent-turn window
+    main.model = model
+    main.summary_model = FakeModel(latency=0, reply_text="The traveller is planning a trip.")
+    main.redis_client = fake_redis()
+    # Live sessions hold chats of the previous model
+    main.session_cache.clear()
+
+
+def fake_redis():
+    import fakeredis
+
+    return fakeredis.aioredis.FakeRedis(decode_responses=True)
+
+
+@contextlib.asynccontextmanager
+async def serve(app):
+    # Real HTTP on a loopback port: httpx's ASGITransport buffers whole
+    # responses, which hides streaming behaviour.
+    import uvicorn
+
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    task = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.01)
+    try:
+        yield f"http://127.0.0.1:{port}"
+    finally:
+        server.should_exit = True
+        await task
@@ -0,0 +1,174 @@
+# Offline benchmark suite: load scenarios against POST /chat plus the
+# micro-benchmarks, written out as one JSON document so runs can be diffed.
+#
+#   python -m benchmarks.suite --output results.json
+#   python -m benchmarks.suite --output after.json --baseline results.json
+#
+# Everything external is local: the stub Gemini model (tool calls included),
+# fakeredis, and the Nominatim/Open-Meteo stand-ins in benchmarks/upstreams.py.
+# Per-stage timings come from the spans in backend/metrics.py.
+import argparse
+import asyncio
+import json
+import platform
+import time
+import timeit
+from collections import defaultdict
+from datetime import date
+
+from benchmarks.stubs import FakeModel, install_fakes, prepare_env, serve
+
+prepare_env()
+
+import httpx  # noqa: E402
+
+from backend import history, main, metrics, session_cache, tools  # noqa: E402
+from backend.geocache import get_geocode_cache  # noqa: E402
+from backend.weather_client import get_weather_client  # noqa: E402
+from benchmarks.chat_load import latency_summary, run_level  # noqa: E402
+from benchmarks.history_encoding import make_session  # noqa: E402
+from benchmarks.upstreams import offline_upstreams  # noqa: E402
+from benchmarks.weather_summary import make_hourly  # noqa: E402
+
+SCENARIOS = {
+    "chat": {"tool_every": 0},
+    # Every other message asks for two forecasts in parallel before answering
+    "chat_with_tools": {"tool_every": 2, "tool_calls": 2},
+}
+
+stage_samples = defaultdict(list)
+record_stage = metrics.observe
+
+
+def recording_observe(name: str, value: float, **labels):
+    if name == "stage_seconds":
+        stage_samples[labels["stage"]].append(value)
+    record_stage(name, value, **labels)
+
+
+def reset_caches():
+    # Every level starts cold, so levels and runs stay comparable
+    with tools.forecast_cache_lock:
+        tools.forecast_cache.clear()
+    geocode_cache = get_geocode_cache()
+    with geocode_cache.lock:
+        geocode_cache.memory.clear()
+    get_weather_client().session.cache.clear()
+
+
+async def run_scenario(name: str, args, upstream) -> list:
+    results = []
+    for concurrency in args.concurrency:
+        install_fakes(main, FakeModel(latency=args.latency, **SCENARIOS[name]))
+        reset_caches()
+        stage_samples.clear()
+        upstream_before = dict(upstream.requests)
+        sessions_before = dict(session_cache.session_cache_stats)
+
+        limits = httpx.Limits(max_connections=concurrency)
+        async with serve(main.app) as base_url, httpx.AsyncClient(base_url=base_url, limits=limits, timeout=120) as client:
+            result = await run_level(client, concurrency, args.requests, stream=args.stream)
+
+        result["scenario"] = name
+        result["stages"] = {
+            stage: {"calls": len(samples), "mean_ms": round(sum(samples) / len(samples) * 1000, 2), **latency_summary(samples)}
+            for stage, samples in sorted(stage_samples.items())
+        }
+        result["upstream_requests"] = {key: upstream.requests[key] - upstream_before[key] for key in upstream.requests}
+        sessions = session_cache.stats()
+        result["session_cache"] = {
+            **{key: sessions[key] - sessions_before[key] for key in sessions_before},
+            "entries": sessions["entries"],
+            "history_bytes": sessions["history_bytes"],
+        }
+        results.append(result)
+        print(json.dumps(result))
+    return results
+
+
+def time_ms(fn, repeat: int) -> float:
+    return round(timeit.timeit(fn, number=repeat) / repeat * 1000, 4)
+
+
+def micro_benchmarks(repeat: int) -> dict:
+    entries = make_session(turns=20, days=7)
+    model_history = main.to_model_history(entries)
+    encoded = [history.encode_entry(entry) for entry in entries]
+    hourly = make_hourly(16)
+    return {
+        "history_to_model_ms": time_ms(lambda: main.to_model_history(entries), repeat),
+        "history_to_stored_ms": time_ms(lambda: main.to_stored_history(model_history), repeat),
+        "history_encode_ms": time_ms(lambda: [history.encode_entry(entry) for entry in entries], repeat),
+        "history_decode_ms": time_ms(lambda: [history.decode_entry(raw) for raw in encoded], repeat),
+        "weather_summary_16d_ms": time_ms(lambda: tools.summarize_hourly(hourly, date(2026, 5, 1)), repeat),
+    }
+
+
+def compare(current: dict, baseline: dict) -> dict:
+    # Ratios against the baseline run: above 1 means slower (or, for throughput, faster)
+    previous = {(r["scenario"], r["concurrency"]): r for r in baseline.get("load", [])}
+    load = []
+    for result in current["load"]:
+        before = previous.get((result["scenario"], result["concurrency"]))
+        if before:
+            load.append({
+                "scenario": result["scenario"],
+                "concurrency": result["concurrency"],
+                "throughput_ratio": round(result["throughput_rps"] / before["throughput_rps"], 3),
+                "p95_ratio": round(result["p95_ms"] / before["p95_ms"], 3),
+                "p99_ratio": round(result["p99_ms"] / before["p99_ms"], 3),
+            })
+    micro = {
+        key: round(value / baseline["micro"][key], 3)
+        for key, value in current.get("micro", {}).items()
+        if baseline.get("micro", {}).get(key)
+    }
+    return {"load": load, "micro": micro}
+
+
+async def main_async(args) -> dict:
+    metrics.METRICS_ENABLED = True
+    metrics.observe = recording_observe
+    report = {
+        "meta": {
+            "started": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "latency": args.latency,
+            "upstream_latency": args.upstream_latency,
+            "requests": args.requests,
+            "stream": args.stream,
+        },
+        "load": [],
+    }
+    with offline_upstreams(latency=args.upstream_latency) as upstream:
+        for name in args.scenarios:
+            report["load"].extend(await run_scenario(name, args, upstream))
+    if not args.skip_micro:
+        report["micro"] = micro_benchmarks(args.repeat)
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--latency", type=float, default=0.2, help="simulated model latency per call (seconds)")
+    parser.add_argument("--upstream-latency", type=float, default=0.05, help="Nominatim/Open-Meteo stand-in latency")
+    parser.add_argument("--requests", type=int, default=256)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32, 128])
+    parser.add_argument("--scenarios", nargs="+", choices=sorted(SCENARIOS), default=list(SCENARIOS))
+    parser.add_argument("--stream", action="store_true", help="use the SSE endpoint instead of /chat")
+    parser.add_argument("--repeat", type=int, default=200, help="iterations per micro-benchmark")
+    parser.add_argument("--skip-micro", action="store_true")
+    parser.add_argument("--output", help="write the JSON report here")
+    parser.add_argument("--baseline", help="earlier report to compare against")
+    args = parser.parse_args()
+
+    report = asyncio.run(main_async(args))
+    if args.baseline:
+        with open(args.baseline) as f:
+            report["comparison"] = compare(report, json.load(f))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    print(json.dumps(report.get("micro", {})))
+    if "comparison" in report:
+        print(json.dumps(report["comparison"]))
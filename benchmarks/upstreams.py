@@ -0,0 +1,149 @@
+# Local stand-ins for Nominatim and Open-Meteo, served over real HTTP so the
+# geocoding and forecast tools run their normal client code (token bucket,
+# requests-cache, connection pool, flatbuffers decoding).
+#
+# Responses replay the payloads in benchmarks/fixtures, which follow the
+# upstream response formats: Nominatim search results keyed by query, and one
+# 7 day hourly Open-Meteo series that is tiled over whatever dates and
+# locations a request asks for and re-encoded as flatbuffers.
+import contextlib
+import json
+import os
+import threading
+import time
+from datetime import date, datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import flatbuffers
+import numpy as np
+
+FIXTURES_DIR = os.path.join(os.path.dirname(__file__), "fixtures")
+
+
+def load_fixture(name: str):
+    with open(os.path.join(FIXTURES_DIR, name), encoding="utf-8") as f:
+        return json.load(f)
+
+
+def encode_forecast(latitude: float, longitude: float, start: date, hourly: dict, utc_offset_seconds: int = 0) -> bytes:
+    # One size-prefixed WeatherApiResponse holding only the hourly block, which
+    # is all openmeteo_requests needs to decode it
+    builder = flatbuffers.Builder(4096)
+    variables = []
+    for values in hourly.values():
+        vector = builder.CreateNumpyVector(np.asarray(values, dtype=np.float32))
+        builder.StartObject(12)
+        builder.PrependUOffsetTRelativeSlot(3, vector, 0)  # values
+        variables.append(builder.EndObject())
+    builder.StartVector(4, len(variables), 4)
+    for variable in reversed(variables):
+        builder.PrependUOffsetTRelative(variable)
+    variable_vector = builder.EndVector()
+
+    hours = len(next(iter(hourly.values())))
+    start_time = int(datetime(start.year, start.month, start.day, tzinfo=timezone.utc).timestamp()) - utc_offset_seconds
+    builder.StartObject(4)
+    builder.PrependInt64Slot(0, start_time, 0)  # time
+    builder.PrependInt64Slot(1, start_time + hours * 3600, 0)  # time_end
+    builder.PrependInt32Slot(2, 3600, 0)  # interval
+    builder.PrependUOffsetTRelativeSlot(3, variable_vector, 0)
+    hourly_block = builder.EndObject()
+
+    builder.StartObject(14)
+    builder.PrependFloat32Slot(0, latitude, 0)
+    builder.PrependFloat32Slot(1, longitude, 0)
+    builder.PrependInt32Slot(6, utc_offset_seconds, 0)
+    builder.PrependUOffsetTRelativeSlot(11, hourly_block, 0)
+    builder.FinishSizePrefixed(builder.EndObject())
+    return bytes(builder.Output())
+
+
+class UpstreamServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, latency: float = 0.0):
+        super().__init__(("127.0.0.1", 0), UpstreamHandler)
+        self.latency = latency
+        self.geocoding = load_fixture("nominatim_search.json")
+        self.forecast = load_fixture("open_meteo_hourly.json")
+        self.requests = {"nominatim": 0, "open_meteo": 0}
+        self.lock = threading.Lock()
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def count(self, upstream: str):
+        with self.lock:
+            self.requests[upstream] += 1
+
+    def search(self, query: dict) -> bytes:
+        results = self.geocoding.get(query.get("q", [""])[0].strip().lower(), [])
+        return json.dumps(results[: int(query.get("limit", ["10"])[0])]).encode()
+
+    def forecast_response(self, query: dict) -> bytes:
+        start = date.fromisoformat(query["start_date"][0])
+        end = date.fromisoformat(query["end_date"][0])
+        hours = ((end - start).days + 1) * 24
+        recorded = self.forecast["hourly"]
+        hourly = {name: np.resize(recorded[name], hours) for name in query["hourly"][0].split(",")}
+        latitudes = query["latitude"][0].split(",")
+        longitudes = query["longitude"][0].split(",")
+        return b"".join(
+            encode_forecast(float(lat), float(lon), start, hourly, self.forecast["utc_offset_seconds"])
+            for lat, lon in zip(latitudes, longitudes)
+        )
+
+
+class UpstreamHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, like the real APIs
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        if url.path == "/search":
+            self.server.count("nominatim")
+            self.reply(self.server.search(query), "application/json")
+        elif url.path == "/v1/forecast":
+            self.server.count("open_meteo")
+            self.reply(self.server.forecast_response(query), "application/octet-stream")
+        else:
+            self.send_error(404)
+
+    def reply(self, body: bytes, content_type: str):
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@contextlib.contextmanager
+def offline_upstreams(latency: float = 0.0, geocode_rate: float = 1000.0):
+    # Points backend.tools at the stand-ins for the duration of the block.
+    # geocode_rate replaces Nominatim's one request per second, which would
+    # otherwise dominate any load test that geocodes.
+    from geopy.geocoders import Nominatim
+
+    from backend import tools, weather_client
+
+    server = UpstreamServer(latency)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    previous = tools.geolocator, tools.geocode_limiter.rate, weather_client.OPEN_METEO_URL
+    tools.geolocator = Nominatim(user_agent="Wanderbot", domain=server.base_url[len("http://"):], scheme="http")
+    tools.geocode_limiter.rate = geocode_rate
+    weather_client.OPEN_METEO_URL = server.base_url + "/v1/forecast"
+    try:
+        yield server
+    finally:
+        tools.geolocator, tools.geocode_limiter.rate, weather_client.OPEN_METEO_URL = previous
+        server.shutdown()
+        server.server_close()
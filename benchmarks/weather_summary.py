@@ -0,0 +1,95 @@
+# Micro-benchmark: the original per-hour Python loop against the vectorized
+# summarize_hourly in backend/tools.py, over a 16 day hourly forecast.
+#
+#   python -m benchmarks.weather_summary
+import argparse
+import json
+import timeit
+from datetime import date
+
+import numpy as np
+
+from backend.tools import WEATHER_CONDITIONS, classify_weather_codes, summarize_hourly
+
+
+def legacy_conditions(hourly_weather_code) -> dict:
+    weather_conditions = {"clear": False, "cloudy": False, "rain": False, "snow": False, "fog": False}
+    for code in hourly_weather_code:
+        if code == 0:
+            weather_conditions["clear"] = True
+        elif 1 <= code <= 3:
+            weather_conditions["cloudy"] = True
+        elif 45 <= code <= 48:
+            weather_conditions["fog"] = True
+        elif 51 <= code <= 67:
+            weather_conditions["rain"] = True
+        elif 71 <= code <= 77:
+            weather_conditions["snow"] = True
+    return weather_conditions
+
+
+def legacy_summary(hourly_temperature_2m, hourly_weather_code) -> dict:
+    # The loop get_weather_forecast used before vectorization
+    temp_summary = {
+        "min_temp": float(hourly_temperature_2m.min()),
+        "max_temp": float(hourly_temperature_2m.max()),
+        "avg_temp": round(float(hourly_temperature_2m.mean()), 1)
+    }
+    weather_conditions = legacy_conditions(hourly_weather_code)
+    dominant_weather = "mixed"
+    if weather_conditions["rain"]:
+        dominant_weather = "rainy"
+    elif weather_conditions["snow"]:
+        dominant_weather = "snowy"
+    elif weather_conditions["clear"] and not weather_conditions["cloudy"] and not weather_conditions["fog"]:
+        dominant_weather = "clear"
+    elif weather_conditions["cloudy"]:
+        dominant_weather = "cloudy"
+    return {"temperature_summary_celsius": temp_summary, "dominant_weather_condition": dominant_weather}
+
+
+def vectorized_conditions(hourly_weather_code) -> np.ndarray:
+    return np.bincount(classify_weather_codes(hourly_weather_code), minlength=len(WEATHER_CONDITIONS)) > 0
+
+
+def make_hourly(days: int, seed: int = 7) -> dict:
+    rng = np.random.default_rng(seed)
+    hours = days * 24
+    codes = rng.choice([0, 1, 2, 3, 45, 51, 61, 63, 71, 80, 95], size=hours).astype(np.float32)
+    return {
+        "temperature_2m": rng.normal(18, 6, hours).astype(np.float32),
+        "weather_code": codes,
+        "precipitation": np.where(codes >= 51, rng.random(hours) * 3, 0).astype(np.float32),
+        "precipitation_probability": rng.integers(0, 100, hours).astype(np.float32),
+        "wind_speed_10m": rng.random(hours).astype(np.float32) * 40,
+    }
+
+
+def main(args):
+    hourly = make_hourly(args.days)
+    start = date.today()
+    number = args.number
+
+    legacy = timeit.timeit(lambda: legacy_summary(hourly["temperature_2m"], hourly["weather_code"]), number=number)
+    vectorized = timeit.timeit(lambda: summarize_hourly(hourly, start), number=number)
+    legacy_classify = timeit.timeit(lambda: legacy_conditions(hourly["weather_code"]), number=number)
+    vectorized_classify = timeit.timeit(lambda: vectorized_conditions(hourly["weather_code"]), number=number)
+
+    # The full summaries are not like for like: the vectorized one also builds the per-day breakdown
+    print(json.dumps({
+        "days": args.days,
+        "legacy_summary_us": round(legacy / number * 1e6, 1),
+        "vectorized_summary_with_daily_us": round(vectorized / number * 1e6, 1),
+        "legacy_classify_us": round(legacy_classify / number * 1e6, 1),
+        "vectorized_classify_us": round(vectorized_classify / number * 1e6, 1),
+        "classify_speedup": round(legacy_classify / vectorized_classify, 1),
+        "same_dominant": legacy_summary(hourly["temperature_2m"], hourly["weather_code"])["dominant_weather_condition"]
+        == summarize_hourly(hourly, start)["dominant_weather_condition"],
+    }))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--days", type=int, default=16)
+    parser.add_argument("--number", type=int, default=2000)
+    main(parser.parse_args())
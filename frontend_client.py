@@ -0,0 +1,123 @@
+# frontend_client.py
+# Backend access and cached assets for the Streamlit app. Streamlit reruns
+# app.py on every interaction, so anything expensive lives here behind
+# st.cache_resource / st.cache_data:
+#   - one keep-alive requests.Session per server process, shared by every
+#     user, with connect/read timeouts and a retry policy,
+#   - the stylesheet and logo, read from disk once,
+#   - a chat render that only draws the most recent CHAT_RENDER_WINDOW
+#     messages, with a button to show older ones.
+# Requests carry the user's address in X-Forwarded-For, since the backend's
+# per-address rate limit would otherwise see every user as this server.
+# POST /chat is not idempotent, so only failures where the backend never ran
+# the turn are retried: connection errors, and 429/503 from its admission
+# control, after the Retry-After it sent plus some jitter.
+import json
+import os
+import random
+
+import requests
+import streamlit as st
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+API_URL = os.getenv("FASTAPI_URL", "http://localhost:8000/chat")
+STREAM_URL = os.getenv("FASTAPI_STREAM_URL", API_URL.rstrip("/") + "/stream")
+
+CONNECT_TIMEOUT_SECONDS = float(os.getenv("BACKEND_CONNECT_TIMEOUT_SECONDS", "3.05"))
+# Longest gap between streamed chunks, which includes the tool rounds
+READ_TIMEOUT_SECONDS = float(os.getenv("BACKEND_READ_TIMEOUT_SECONDS", "60"))
+BACKEND_RETRIES = int(os.getenv("BACKEND_RETRIES", "2"))
+RETRY_JITTER_SECONDS = float(os.getenv("BACKEND_RETRY_JITTER_SECONDS", "1"))
+BACKEND_POOL_SIZE = int(os.getenv("BACKEND_POOL_SIZE", "32"))
+CHAT_RENDER_WINDOW = int(os.getenv("CHAT_RENDER_WINDOW", "30"))
+
+ERROR_REPLY = "WanderBot ran into an issue. Please try again later."
+
+
+class JitteredRetry(Retry):
+    # Spreads out clients that were all told the same Retry-After
+    def get_retry_after(self, response):
+        retry_after = super().get_retry_after(response)
+        if retry_after is not None:
+            retry_after += random.uniform(0, RETRY_JITTER_SECONDS)
+        return retry_after
+
+
+@st.cache_resource
+def get_session() -> requests.Session:
+    retry = JitteredRetry(
+        total=BACKEND_RETRIES,
+        connect=BACKEND_RETRIES,
+        read=0,  # the turn may already have run
+        status=BACKEND_RETRIES,
+        other=0,
+        allowed_methods=frozenset({"GET", "POST"}),
+        status_forcelist=(429, 503),
+        backoff_factor=0.5,
+        backoff_jitter=RETRY_JITTER_SECONDS,
+        respect_retry_after_header=True,
+        raise_on_status=False,  # the last 429/503 still carries a reply to show
+    )
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=BACKEND_POOL_SIZE, max_retries=retry)
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+@st.cache_data
+def load_css(path: str = "styles.css") -> str:
+    with open(path) as f:
+        return f.read()
+
+
+@st.cache_data
+def load_image(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def forwarded_for() -> dict:
+    # Unknown for local connections; the backend then limits by session only
+    address = st.context.ip_address
+    return {"X-Forwarded-For": address} if address else {}
+
+
+def stream_reply(session_id: str, message: str):
+    # Yields reply text from the backend's Server-Sent Events as it arrives
+    try:
+        with get_session().post(
+            STREAM_URL,
+            json={"session_id": session_id, "message": message},
+            headers=forwarded_for(),
+            stream=True,
+            timeout=(CONNECT_TIMEOUT_SECONDS, READ_TIMEOUT_SECONDS),
+        ) as response:
+            if response.status_code in (429, 503):
+                # Still busy after the retries; the backend explains why
+                yield response.json().get("reply") or ERROR_REPLY
+                return
+            response.raise_for_status()
+            for line in response.iter_lines(decode_unicode=True):
+                if line and line.startswith("data:"):
+                    data = json.loads(line[len("data:"):])
+                    if "text" in data:
+                        yield data["text"]
+    except Exception as e:
+        print(f"Error in stream_reply: {e}")
+        yield ERROR_REPLY
+
+
+def render_messages(messages: list):
+    # Long chats only draw the latest window; older messages are a click away
+    window = st.session_state.setdefault("render_window", CHAT_RENDER_WINDOW)
+    hidden = len(messages) - window
+    if hidden > 0:
+        if st.button(f"Show {min(hidden, CHAT_RENDER_WINDOW)} older messages", key="show-older"):
+            st.session_state.render_window = window + CHAT_RENDER_WINDOW
+            st.rerun()
+    for message in messages[max(hidden, 0):]:
+        with st.chat_message(message["role"]):
+            st.markdown(message["content"])